@@ -19,6 +19,7 @@ from starlette.middleware.base import BaseHTTPMiddleware
 
 from config.config import settings
 from backend.api.routes import router
+from backend.services.annotation_service import annotation_service
 
 # 版本戳 - 用于缓存破坏
 APP_VERSION_TIMESTAMP = datetime.now().strftime("%Y%m%d%H%M%S")
@@ -75,6 +76,12 @@ templates = Jinja2Templates(directory=str(templates_dir))
 app.include_router(router, prefix="/api/v1", tags=["API"])
 
 
+@app.on_event("startup")
+async def resume_background_jobs():
+    """恢复上次运行中被中断的自动标注任务"""
+    annotation_service.resume_auto_annotate_jobs()
+
+
 # ==================== 前端路由 ====================
 @app.get("/", response_class=HTMLResponse)
 async def root(request: Request):
@@ -3,12 +3,16 @@ API 路由定义
 """
 import sys
 import os
+import json
+import asyncio
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Optional, Dict, Any
 from datetime import datetime
 
-from fastapi import APIRouter, UploadFile, File, HTTPException, Form
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Request
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.concurrency import run_in_threadpool
 
 # 添加项目根目录到 Python 路径
 project_root = Path(__file__).resolve().parent.parent.parent
@@ -18,16 +22,36 @@ from config.config import settings
 from backend.models.schemas import (
     InferenceRequest, InferenceResponse, TrainingConfig,
     TrainingStatus, ModelInfo, DatasetInfo, ExportConfig,
-    SystemInfo,
+    SystemInfo, JobStatus, BenchmarkRequest, QuantizeRequest, UploadSessionCreate, DedupRequest,
+    ShardPackRequest, ShardUnpackRequest, ShardPredictRequest,
+    DatasetSnapshotRequest, DatasetCheckoutRequest, AnnotationPatchRequest,
     ObjectCountingRequest, HeatmapRequest, SpeedEstimationRequest,
     DistanceCalculationRequest, ObjectBlurRequest, ObjectCropRequest,
     QueueManagementRequest, SolutionResponse
 )
 from backend.services.yolo_service import yolo_service
 from backend.services.annotation_service import annotation_service
+from backend.utils.annotation_store import AnnotationConflictError
 from backend.services.solutions_service import solutions_service
 from backend.services.supervision_service import supervision_service
-from backend.utils.file_utils import allowed_file, save_uploaded_file, get_unique_filename
+from backend.services.model_index_service import model_index_service
+from backend.services.export_service import export_service
+from backend.services.job_service import job_service, FINISHED_STATUSES
+from backend.services.benchmark_service import benchmark_service
+from backend.services.quantization_service import quantization_service
+from backend.services.upload_service import upload_service, UploadError
+from backend.services.dataset_catalog_service import dataset_catalog_service
+from backend.services.dataset_stats_service import dataset_stats_service
+from backend.services.dedup_service import dedup_service
+from backend.services.shard_service import shard_service
+from backend.services.dataset_version_service import dataset_version_service
+from backend.services.dataset_ingest_service import dataset_ingest_service, IngestError
+from backend.services.preview_service import (
+    preview_service, source_version, IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL
+)
+from backend.utils.file_utils import (
+    allowed_file, save_uploaded_file, get_unique_filename, FileTooLargeError
+)
 
 router = APIRouter()
 
@@ -38,9 +62,9 @@ async def get_system_info():
     """获取系统信息"""
     import platform
     
-    # 获取模型和数据集数量
-    models = yolo_service.list_models() if yolo_service else []
-    datasets = list(settings.DATASETS_DIR.glob("*/data.yaml"))
+    # 获取模型和数据集数量（索引未命中时需要读取权重文件，放到线程池中执行）
+    models = await run_in_threadpool(model_index_service.list_models)
+    datasets = await run_in_threadpool(dataset_catalog_service.list_datasets)
     
     # 获取 GPU 信息
     gpu_available, gpu_info = (False, None)
@@ -67,6 +91,64 @@ async def get_system_info():
     )
 
 
+@router.get("/jobs", response_model=List[JobStatus])
+async def list_jobs(job_type: Optional[str] = None):
+    """列出后台任务"""
+    return job_service.list(job_type)
+
+
+@router.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job_status(job_id: str):
+    """获取后台任务状态"""
+    job = job_service.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("/jobs/{job_id}/cancel", response_model=JobStatus)
+async def cancel_job(job_id: str):
+    """取消后台任务（在当前批次结束后停止）；任务已结束或不支持取消时返回 409"""
+    try:
+        job = job_service.cancel(job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get("/jobs/{job_id}/events")
+async def stream_job_events(request: Request, job_id: str):
+    """以 Server-Sent Events 推送任务状态，任务结束后关闭连接"""
+    if not job_service.get(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        last_update = None
+        idle = 0.0
+        while not await request.is_disconnected():
+            job = job_service.get(job_id)
+            if job.updated_at != last_update:
+                last_update = job.updated_at
+                idle = 0.0
+                yield f"event: {job.status}\ndata: {json.dumps(jsonable_encoder(job), ensure_ascii=False)}\n\n"
+                if job.status in FINISHED_STATUSES:
+                    return
+            elif idle >= 15:
+                # 保持连接（代理可能关闭长时间无数据的连接）
+                idle = 0.0
+                yield ": keep-alive\n\n"
+            await asyncio.sleep(0.5)
+            idle += 0.5
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.get("/system/health")
 async def health_check():
     """健康检查"""
@@ -161,6 +243,64 @@ async def start_training(config: TrainingConfig):
     if not yolo_service:
         raise HTTPException(status_code=500, detail="YOLO service not available")
     
+    # 直接从标注项目训练：构建链接视图，无需导出 zip
+    if config.project_id:
+        # 大项目需要链接全部图片并写入标签文件，放到线程池中执行
+        try:
+            data_yaml = await run_in_threadpool(annotation_service.build_training_view, config.project_id)
+        except FileNotFoundError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        if not data_yaml:
+            raise HTTPException(status_code=404, detail="Project not found or has no images")
+        config.dataset_path = str(data_yaml)
+    elif config.shard_dataset:
+        # 分片数据集：在后台任务中顺序读取到 SHARD_VIEW_DIR（同一版本只读取一次），完成后开始训练
+        def start_after_materialize(data_yaml: Path) -> Dict[str, Any]:
+            config.dataset_path = str(data_yaml)
+            return {"task_id": yolo_service.train(config)}
+        
+        try:
+            job = shard_service.submit_training(config.shard_dataset, start_after_materialize)
+        except FileNotFoundError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        return {
+            "success": True,
+            "job_id": job.job_id,
+            "message": "Reading shards; training starts when the shard_materialize job completes"
+        }
+    elif config.dataset_name and not config.dataset_version:
+        # 未指定版本：先在后台任务中为当前内容创建快照，完成后用该版本的硬链接视图开始训练
+        def start_after_snapshot(data_yaml: Path, version: str) -> Dict[str, Any]:
+            config.dataset_path = str(data_yaml)
+            config.dataset_version = version
+            return {"task_id": yolo_service.train(config)}
+        
+        try:
+            job = dataset_version_service.submit_training(config.dataset_name, start_after_snapshot)
+        except FileNotFoundError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        return {
+            "success": True,
+            "job_id": job.job_id,
+            "message": "Snapshotting dataset; training starts when the snapshot job completes"
+        }
+    elif config.dataset_name:
+        # 数据集版本：训练使用该版本的硬链接视图
+        try:
+            data_yaml, version = await run_in_threadpool(
+                dataset_version_service.prepare_training, config.dataset_name, config.dataset_version
+            )
+        except FileNotFoundError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to prepare dataset version: {e}")
+        config.dataset_path = str(data_yaml)
+        config.dataset_version = version
+    elif not config.dataset_path:
+        raise HTTPException(
+            status_code=400, detail="dataset_path, project_id, shard_dataset or dataset_name is required"
+        )
+    
     try:
         task_id = yolo_service.train(config)
         return {
@@ -201,110 +341,511 @@ async def list_models():
     if not yolo_service:
         raise HTTPException(status_code=500, detail="YOLO service not available")
     
-    return yolo_service.list_models()
+    return await run_in_threadpool(yolo_service.list_models)
 
 
 @router.post("/models/export")
 async def export_model(config: ExportConfig):
-    """导出模型"""
+    """导出模型（后台任务，相同模型和配置命中缓存时立即完成）"""
+    if not yolo_service:
+        raise HTTPException(status_code=500, detail="YOLO service not available")
+    
+    try:
+        # 计算模型文件哈希可能较慢，放到线程池中执行
+        job = await run_in_threadpool(export_service.submit, config)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    return {
+        "success": True,
+        "job_id": job.job_id,
+        "status": job.status,
+        "cached": bool(job.result and job.result.get("cached")),
+        "export_path": job.result["export_path"] if job.result else None,
+        "message": "Export served from cache" if job.status == "completed" else "Export started"
+    }
+
+
+@router.get("/models/export/{job_id}", response_model=JobStatus)
+async def get_export_status(job_id: str):
+    """获取导出任务状态"""
+    job = job_service.get(job_id)
+    if not job or job.job_type != "export":
+        raise HTTPException(status_code=404, detail="Export job not found")
+    return job
+
+
+@router.get("/models/export/{job_id}/download")
+async def download_export(job_id: str):
+    """下载导出产物"""
+    job = job_service.get(job_id)
+    if not job or job.job_type != "export":
+        raise HTTPException(status_code=404, detail="Export job not found")
+    
+    file_path = await run_in_threadpool(export_service.get_download_path, job)
+    if not file_path:
+        raise HTTPException(status_code=409, detail=f"Export is {job.status}")
+    
+    return FileResponse(path=str(file_path), filename=file_path.name)
+
+
+@router.post("/models/benchmark")
+async def benchmark_model(request: BenchmarkRequest):
+    """在本机对模型的各推理格式进行基准测试（后台任务）"""
+    if not yolo_service:
+        raise HTTPException(status_code=500, detail="YOLO service not available")
+    
+    job = benchmark_service.submit(request)
+    return {
+        "success": True,
+        "job_id": job.job_id,
+        "status": job.status,
+        "message": "Benchmark started"
+    }
+
+
+@router.get("/models/benchmark/{model_name}")
+async def get_benchmark_results(model_name: str):
+    """获取模型在本机的基准测试结果"""
+    results = benchmark_service.get_results(model_name)
+    if not results:
+        raise HTTPException(status_code=404, detail="No benchmark results for this host")
+    return results
+
+
+@router.post("/models/quantize")
+async def quantize_model(request: QuantizeRequest):
+    """INT8 量化（后台任务）：校准、精度对比、测速并注册"""
     if not yolo_service:
         raise HTTPException(status_code=500, detail="YOLO service not available")
     
-    result = yolo_service.export_model(config)
-    if not result["success"]:
-        raise HTTPException(status_code=500, detail=result["message"])
+    try:
+        job = quantization_service.submit(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    return result
+    return {
+        "success": True,
+        "job_id": job.job_id,
+        "status": job.status,
+        "message": "Quantization started"
+    }
+
+
+@router.get("/models/quantize/{model_name}")
+async def get_quantization_report(model_name: str):
+    """获取模型最近一次的 INT8 量化报告"""
+    report = quantization_service.get_report(model_name)
+    if not report:
+        raise HTTPException(status_code=404, detail="No quantization report for this host")
+    return report
+
+
+@router.get("/models/engines")
+async def list_serving_engines():
+    """列出本机各模型的默认推理引擎"""
+    return {
+        "host": benchmark_service.host,
+        "engines": benchmark_service.list_serving_engines()
+    }
+
+
+@router.delete("/models/engines/{model_name}")
+async def clear_serving_engine(model_name: str):
+    """恢复使用原始 .pt 模型推理"""
+    if not benchmark_service.clear_serving_engine(model_name):
+        raise HTTPException(status_code=404, detail="No serving engine set for this model")
+    return {"success": True, "message": "Serving engine cleared"}
+
+
+def _invalidate_model_caches(filename: str, replaced: bool = False):
+    """模型文件新增或被替换后，清除各服务中的缓存"""
+    model_index_service.invalidate(settings.MODELS_DIR / filename)
+    if yolo_service:
+        yolo_service.models.pop(filename, None)
+    if solutions_service:
+        solutions_service.models.pop(filename, None)
+    if replaced:
+        # 默认推理引擎是由旧权重导出的，已失效
+        benchmark_service.clear_serving_engine(filename)
 
 
 @router.post("/models/upload")
 async def upload_model(file: UploadFile = File(...)):
-    """上传模型文件"""
+    """上传模型文件（小文件；大文件请使用分片上传）"""
     if not file.filename.endswith('.pt'):
         raise HTTPException(status_code=400, detail="Only .pt files are allowed")
     
     try:
         filename = get_unique_filename(str(settings.MODELS_DIR), file.filename)
         file_path = settings.MODELS_DIR / filename
-        save_uploaded_file(file, str(file_path))
+        save_uploaded_file(file, str(file_path), max_size=settings.MAX_MODEL_UPLOAD_SIZE)
+        _invalidate_model_caches(filename)
         
         return {
             "success": True,
             "message": "Model uploaded successfully",
             "filename": filename
         }
+    except FileTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/models/upload/sessions")
+async def create_model_upload_session(data: UploadSessionCreate):
+    """创建分片上传会话"""
+    try:
+        return upload_service.create_session(data.filename, data.size, data.sha256, data.overwrite)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+
+@router.get("/models/upload/sessions/{session_id}")
+async def get_model_upload_session(session_id: str):
+    """查询分片上传进度（断点续传时从 received 处继续）"""
+    try:
+        return upload_service.get_session(session_id)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+
+@router.put("/models/upload/sessions/{session_id}")
+async def upload_model_chunk(session_id: str, request: Request, offset: Optional[int] = None):
+    """
+    上传一个分片（请求体为原始字节）
+    
+    起始位置由 offset 查询参数或 Content-Range 头（bytes start-end/total）指定。
+    """
+    if offset is None:
+        content_range = request.headers.get("content-range", "")
+        try:
+            offset = int(content_range.split()[1].split("-")[0])
+        except (IndexError, ValueError):
+            raise HTTPException(status_code=400, detail="offset or Content-Range header is required")
+    
+    data = bytearray()
+    async for chunk in request.stream():
+        data.extend(chunk)
+        if len(data) > settings.UPLOAD_CHUNK_MAX_SIZE:
+            raise HTTPException(status_code=413, detail="Chunk too large")
+    
+    try:
+        return await run_in_threadpool(upload_service.append_chunk, session_id, offset, bytes(data))
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+
+@router.post("/models/upload/sessions/{session_id}/finalize")
+async def finalize_model_upload(session_id: str):
+    """校验并发布上传的模型"""
+    try:
+        result = await run_in_threadpool(upload_service.finalize, session_id)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    
+    _invalidate_model_caches(result["filename"], replaced=result["replaced"])
+    return {
+        "success": True,
+        "message": "Model uploaded successfully",
+        **result
+    }
+
+
+@router.delete("/models/upload/sessions/{session_id}")
+async def abort_model_upload(session_id: str):
+    """取消分片上传"""
+    try:
+        upload_service.abort(session_id)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return {"success": True, "message": "Upload aborted"}
+
+
 # ==================== 数据集相关 ====================
 @router.get("/datasets/list")
 async def list_datasets():
-    """列出所有数据集"""
-    datasets = []
-    
-    for dataset_dir in settings.DATASETS_DIR.iterdir():
-        if dataset_dir.is_dir():
-            data_yaml = dataset_dir / "data.yaml"
-            if data_yaml.exists():
-                try:
-                    import yaml
-                    with open(data_yaml, 'r') as f:
-                        data = yaml.safe_load(f)
-                    
-                    # 统计图像数量
-                    num_images = 0
-                    images_dir = dataset_dir / "images"
-                    if images_dir.exists():
-                        num_images = len(list(images_dir.rglob("*.jpg"))) + \
-                                    len(list(images_dir.rglob("*.png")))
-                    
-                    dataset_info = {
-                        "name": dataset_dir.name,
-                        "path": str(dataset_dir),
-                        "num_images": num_images,
-                        "num_classes": len(data.get("names", {})),
-                        "classes": list(data.get("names", {}).values()),
-                        "created_at": datetime.fromtimestamp(dataset_dir.stat().st_ctime).isoformat()
-                    }
-                    datasets.append(dataset_info)
-                except Exception as e:
-                    print(f"Error reading dataset {dataset_dir}: {e}")
-    
-    return {"datasets": datasets}
+    """列出所有数据集（读取数据集目录索引，只重新扫描发生变化的划分）"""
+    try:
+        datasets = await run_in_threadpool(dataset_catalog_service.list_datasets)
+        return {"datasets": datasets}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/datasets/{dataset_name}/stats")
+async def get_dataset_stats(dataset_name: str, refresh: bool = False):
+    """获取数据集统计信息（类别分布、框尺寸分布、每图目标数、划分均衡）"""
+    try:
+        stats = await run_in_threadpool(dataset_stats_service.get_stats, dataset_name, refresh)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if stats is None:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    return stats
+
+
+@router.get("/datasets/{dataset_name}/labels")
+async def get_dataset_labels(
+    dataset_name: str,
+    image: Optional[str] = None,
+    split: str = "train",
+    offset: int = 0,
+    limit: int = 100
+):
+    """查询数据集标注：指定 image（相对数据集目录）时返回该图片的标注，否则按划分分页返回"""
+    try:
+        if image:
+            result = await run_in_threadpool(dataset_catalog_service.get_image_labels, dataset_name, image)
+        else:
+            result = await run_in_threadpool(dataset_catalog_service.list_labels, dataset_name, split, offset, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail="Dataset or split not found")
+    return result
+
+
+@router.post("/datasets/{dataset_name}/dedup", response_model=JobStatus)
+async def dedup_dataset(dataset_name: str, request: DedupRequest):
+    """检测数据集中的近似重复图片（后台任务）"""
+    try:
+        return dedup_service.submit_dataset(dataset_name, request)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/datasets/{dataset_name}/dedup")
+async def get_dataset_dedup_report(dataset_name: str):
+    """获取数据集最近一次去重报告"""
+    report = dedup_service.get_report("dataset", dataset_name)
+    if report is None:
+        raise HTTPException(status_code=404, detail="No dedup report for this dataset")
+    return report
+
+
+@router.get("/datasets/{dataset_name}/versions")
+async def list_dataset_versions(dataset_name: str):
+    """列出数据集版本"""
+    return {"versions": await run_in_threadpool(dataset_version_service.list_versions, dataset_name)}
+
+
+@router.post("/datasets/{dataset_name}/versions", response_model=JobStatus)
+async def create_dataset_version(dataset_name: str, request: DatasetSnapshotRequest):
+    """为数据集当前内容创建快照（后台任务，只对变化的文件计算哈希）"""
+    try:
+        return dataset_version_service.submit_snapshot(dataset_name, request)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@router.get("/datasets/{dataset_name}/versions/diff")
+async def diff_dataset_versions(dataset_name: str, from_version: str, to_version: str, limit: int = 1000):
+    """比较两个数据集版本"""
+    result = await run_in_threadpool(
+        dataset_version_service.diff, dataset_name, from_version, to_version, limit
+    )
+    if result is None:
+        raise HTTPException(status_code=404, detail="Version not found")
+    return result
+
+
+@router.get("/datasets/{dataset_name}/versions/{version}")
+async def get_dataset_version(dataset_name: str, version: str):
+    """获取数据集版本信息"""
+    info = await run_in_threadpool(dataset_version_service.get_version, dataset_name, version)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Version not found")
+    return info
+
+
+@router.post("/datasets/{dataset_name}/versions/{version}/checkout", response_model=JobStatus)
+async def checkout_dataset_version(dataset_name: str, version: str, request: DatasetCheckoutRequest):
+    """把数据集版本检出为数据集目录（硬链接，不复制数据）"""
+    try:
+        return dataset_version_service.submit_checkout(dataset_name, version, request)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except FileExistsError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.delete("/datasets/{dataset_name}/versions/{version}")
+async def delete_dataset_version(dataset_name: str, version: str):
+    """删除数据集版本（不再被引用的文件随之清理）"""
+    if not await run_in_threadpool(dataset_version_service.delete_version, dataset_name, version):
+        raise HTTPException(status_code=404, detail="Version not found")
+    return {"success": True, "message": f"Version {version} deleted"}
+
+
+@router.get("/datasets/{dataset_name}/shards")
+async def get_dataset_shards(dataset_name: str):
+    """获取数据集的分片信息"""
+    info = await run_in_threadpool(shard_service.get_info, dataset_name)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Dataset has no shards")
+    return info
+
+
+@router.post("/datasets/{dataset_name}/shards", response_model=JobStatus)
+async def pack_dataset_shards(dataset_name: str, request: ShardPackRequest):
+    """把数据集打包为顺序读取的 tar 分片（后台任务）"""
+    try:
+        return shard_service.submit_pack(dataset_name, request)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@router.post("/datasets/{dataset_name}/shards/unpack", response_model=JobStatus)
+async def unpack_dataset_shards(dataset_name: str, request: ShardUnpackRequest):
+    """把分片还原为普通数据集目录（后台任务）"""
+    try:
+        return shard_service.submit_unpack(dataset_name, request)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except FileExistsError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/datasets/{dataset_name}/shards/predict", response_model=JobStatus)
+async def predict_dataset_shards(dataset_name: str, request: ShardPredictRequest):
+    """对分片数据集批量推理，save_labels=True 时把预测结果写为新的分片数据集（后台任务）"""
+    if not yolo_service:
+        raise HTTPException(status_code=500, detail="YOLO service not available")
+    try:
+        return shard_service.submit_predict(dataset_name, request)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except FileExistsError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def _feed_ingest(session, chunks) -> JobStatus:
+    """把请求体数据块写入导入会话，导入任务提前失败时停止接收"""
+    try:
+        async for chunk in chunks:
+            if chunk and not await run_in_threadpool(session.feed, chunk):
+                break
+        await run_in_threadpool(session.finish)
+    except IngestError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        await run_in_threadpool(session.abort, f"Upload interrupted: {e}")
+        raise HTTPException(status_code=400, detail=f"Upload interrupted: {e}")
+
+    if session.job.status == "failed":
+        raise HTTPException(status_code=400, detail=session.job.error_message)
+    return session.job
+
+
+@router.put("/datasets/ingest", response_model=JobStatus)
+async def ingest_dataset(request: Request, name: str, format: str = "zip", overwrite: bool = False):
+    """
+    流式导入数据集（请求体为原始压缩包：zip / tar / tar.gz / tar.bz2 / tar.xz / tar.zst）
+
+    tar 格式边接收边解压；解压在后台任务中进行，通过 /jobs/{job_id} 查询进度
+    """
+    try:
+        content_length = int(request.headers.get("content-length") or 0) or None
+        session = dataset_ingest_service.start_stream(name, format, overwrite, content_length)
+    except IngestError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    return await _feed_ingest(session, request.stream())
 
 
 @router.post("/datasets/upload")
 async def upload_dataset(file: UploadFile = File(...)):
-    """上传数据集（zip 格式）"""
-    if not file.filename.endswith('.zip'):
-        raise HTTPException(status_code=400, detail="Only .zip files are allowed")
-    
+    """上传数据集（zip / tar 格式），在后台解压"""
     try:
-        import zipfile
-        
-        # 保存上传的 zip 文件
-        zip_path = settings.UPLOADS_DIR / file.filename
-        save_uploaded_file(file, str(zip_path))
-        
-        # 解压到数据集目录
-        dataset_name = file.filename.replace('.zip', '')
-        dataset_path = settings.DATASETS_DIR / dataset_name
-        
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(dataset_path)
-        
-        # 删除 zip 文件
-        zip_path.unlink()
-        
-        return {
-            "success": True,
-            "message": "Dataset uploaded successfully",
-            "dataset_name": dataset_name,
-            "path": str(dataset_path)
-        }
+        archive_format = dataset_ingest_service.detect_format(file.filename)
+        dataset_name = dataset_ingest_service.dataset_name_from_filename(file.filename)
+        session = dataset_ingest_service.start_stream(dataset_name, archive_format, overwrite=True)
+    except IngestError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    async def read_chunks():
+        while True:
+            chunk = await file.read(1024 * 1024)
+            if not chunk:
+                break
+            yield chunk
+
+    job = await _feed_ingest(session, read_chunks())
+    return {
+        "success": True,
+        "message": "Dataset received, extracting in background",
+        "dataset_name": dataset_name,
+        "path": str(settings.DATASETS_DIR / dataset_name),
+        "job_id": job.job_id
+    }
+
+
+# ==================== 图片预览 ====================
+def _etag_matches(request: Request, etag: str) -> bool:
+    """请求的 If-None-Match 是否包含该 ETag（忽略弱校验前缀 W/，* 匹配任意 ETag）"""
+    if_none_match = request.headers.get("if-none-match", "")
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in candidates or "*" in candidates
+
+
+async def _preview_response(request: Request, source: Path, size: str) -> Response:
+    """
+    返回预览图，带 ETag；If-None-Match 命中时返回 304
+
+    URL 中的 v 参数与当前图片版本一致时内容不会再变化，允许浏览器永久缓存
+    """
+    try:
+        preview = await run_in_threadpool(preview_service.get_preview, source, size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=500, detail=f"Failed to render preview: {e}")
+    if preview is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    path, etag = preview
+    version = request.query_params.get("v")
+    headers = {
+        "ETag": etag,
+        "Cache-Control": (
+            IMMUTABLE_CACHE_CONTROL if version and version == source_version(source)
+            else REVALIDATE_CACHE_CONTROL
+        )
+    }
+
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    media_type = "image/jpeg" if path != source else None
+    return FileResponse(path=str(path), media_type=media_type, headers=headers)
+
+
+@router.get("/preview/project/{project_id}/{image_name}")
+async def get_project_preview(request: Request, project_id: str, image_name: str, size: str = "thumb"):
+    """获取标注项目图片的预览图（size: thumb / medium / full）"""
+    image_path = preview_service.resolve_project_image(project_id, image_name)
+    if not image_path:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return await _preview_response(request, image_path, size)
+
+
+@router.get("/preview/dataset/{dataset_name}/{image_path:path}")
+async def get_dataset_preview(request: Request, dataset_name: str, image_path: str, size: str = "thumb"):
+    """获取数据集图片的预览图（image_path 相对数据集目录）"""
+    source = preview_service.resolve_dataset_image(dataset_name, image_path)
+    if not source:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return await _preview_response(request, source, size)
 
 
 # ==================== 本地标注相关 ====================
@@ -351,12 +892,11 @@ async def upload_annotation_images(
     project_id: str = Form(...),
     files: List[UploadFile] = File(...)
 ):
-    """上传标注图片"""
+    """上传标注图片（并行写入，按内容去重，返回每个文件的处理结果）"""
     try:
-        result = annotation_service.upload_images(project_id, files)
-        if not result["success"]:
-            raise HTTPException(status_code=500, detail=result["message"])
-        return result
+        return await run_in_threadpool(annotation_service.upload_images, project_id, files)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -380,34 +920,92 @@ async def save_annotation_data(data: dict):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/annotation/projects/{project_id}/images")
+async def list_annotation_images(
+    project_id: str,
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    sort: str = "name",
+    status: Optional[str] = None,
+    class_name: Optional[str] = None,
+    auto_annotated: Optional[bool] = None,
+    max_confidence: Optional[float] = None
+):
+    """
+    分页获取项目图片及其标注
+
+    sort: name / -name / created_at / -created_at；status: annotated / unannotated；
+    class_name、auto_annotated、max_confidence（含低于该置信度的标注）用于过滤。
+    翻页时传入上一页返回的 next_cursor。
+    """
+    try:
+        return await run_in_threadpool(
+            annotation_service.list_images,
+            project_id, cursor, limit, sort, status, class_name, auto_annotated, max_confidence
+        )
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.patch("/annotation/projects/{project_id}/annotations")
+async def patch_annotation_data(project_id: str, request: AnnotationPatchRequest):
+    """
+    增量保存标注：只替换请求中图片的标注
+    
+    每张图片可带 base_version（读取时的版本号），任一图片已被他人修改时返回 409，
+    detail.conflicts 中为这些图片在服务端的当前版本和标注，此时不写入任何图片。
+    """
+    try:
+        return await run_in_threadpool(
+            annotation_service.patch_annotations,
+            project_id,
+            {name: patch.dict() for name, patch in request.images.items()},
+            request.classes
+        )
+    except AnnotationConflictError as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "conflicts": e.conflicts})
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@router.get("/annotation/projects/{project_id}/images/{image_name}/annotations")
+async def get_image_annotation_data(project_id: str, image_name: str):
+    """获取单张图片的标注及版本号"""
+    try:
+        return await run_in_threadpool(annotation_service.get_image_annotations, project_id, image_name)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
 @router.get("/annotation/export/{project_id}")
 async def export_annotation_project(project_id: str):
-    """导出标注项目为YOLO格式"""
+    """导出标注项目为YOLO格式（边打包边下载，标注未变化时直接返回缓存）"""
     try:
-        zip_path = annotation_service.export_to_yolo(project_id)
-        if not zip_path or not zip_path.exists():
-            raise HTTPException(status_code=500, detail="Failed to export project")
-        
-        return FileResponse(
-            path=str(zip_path),
-            filename=zip_path.name,
-            media_type="application/zip"
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        export = await run_in_threadpool(annotation_service.open_yolo_export, project_id)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    filename = f"{project_id}_yolo.zip"
+    if isinstance(export, Path):
+        return FileResponse(path=str(export), filename=filename, media_type="application/zip")
+    return StreamingResponse(
+        export,
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 
 @router.get("/annotation/image/{project_id}/{image_name}")
-async def get_annotation_image(project_id: str, image_name: str):
-    """获取标注图片"""
-    try:
-        image_path = annotation_service.get_image_path(project_id, image_name)
-        if not image_path or not image_path.exists():
-            raise HTTPException(status_code=404, detail="Image not found")
-        
-        return FileResponse(path=str(image_path))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+async def get_annotation_image(request: Request, project_id: str, image_name: str, size: str = "full"):
+    """获取标注图片（size: thumb / medium / full）"""
+    image_path = preview_service.resolve_project_image(project_id, image_name)
+    if not image_path:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return await _preview_response(request, image_path, size)
 
 
 @router.delete("/annotation/projects/{project_id}")
@@ -423,36 +1021,53 @@ async def delete_annotation_project(project_id: str):
 
 
 
-@router.post("/annotation/auto-annotate/{project_id}")
+@router.post("/annotation/auto-annotate/{project_id}", response_model=JobStatus)
 async def auto_annotate_project(
     project_id: str,
     model_name: Optional[str] = Form("yolov8n.pt"),
     confidence: float = Form(0.25),
     iou_threshold: float = Form(0.45),
     filter_classes: Optional[str] = Form(None),
-    merge_mode: str = Form("replace")
+    merge_mode: str = Form("replace"),
+    batch_size: int = Form(16),
+    match_method: str = Form("greedy")
 ):
-    """使用YOLO模型自动标注项目 (增强版)"""
+    """
+    使用YOLO模型自动标注项目 (增强版，后台任务)
+    
+    进度通过 /jobs/{job_id} 或 /jobs/{job_id}/events（SSE）获取，可通过 /jobs/{job_id}/cancel 取消。
+    """
     try:
         # 解析类别过滤
         filter_classes_list = None
         if filter_classes:
-            import json
             filter_classes_list = json.loads(filter_classes)
         
-        result = annotation_service.auto_annotate_with_model(
+        return annotation_service.submit_auto_annotate(
             project_id=project_id,
             model_path=str(settings.MODELS_DIR / model_name),
             confidence=confidence,
             iou_threshold=iou_threshold,
             filter_classes=filter_classes_list,
-            merge_mode=merge_mode
+            merge_mode=merge_mode,
+            batch_size=batch_size,
+            match_method=match_method
         )
-        if not result["success"]:
-            raise HTTPException(status_code=500, detail=result["message"])
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/annotation/auto-annotate/jobs/{job_id}/resume", response_model=JobStatus)
+async def resume_auto_annotate_job(job_id: str):
+    """从断点继续失败或取消的自动标注任务"""
+    try:
+        return annotation_service.resume_auto_annotate(job_id)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
 
 @router.post("/annotation/batch-annotate/{project_id}")
@@ -466,6 +1081,7 @@ async def batch_auto_annotate(
         model_name = data.get("model_name", "yolov8n.pt")
         confidence = data.get("confidence", 0.25)
         iou_threshold = data.get("iou_threshold", 0.45)
+        batch_size = max(1, int(data.get("batch_size", 16)))
         
         if not image_names:
             raise HTTPException(status_code=400, detail="image_names is required")
@@ -475,7 +1091,8 @@ async def batch_auto_annotate(
             image_names=image_names,
             model_path=str(settings.MODELS_DIR / model_name),
             confidence=confidence,
-            iou_threshold=iou_threshold
+            iou_threshold=iou_threshold,
+            batch_size=batch_size
         )
         
         if not result["success"]:
@@ -485,6 +1102,44 @@ async def batch_auto_annotate(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/annotation/projects/{project_id}/dedup", response_model=JobStatus)
+async def dedup_annotation_project(project_id: str, request: DedupRequest):
+    """检测标注项目中的近似重复图片（后台任务）"""
+    try:
+        return dedup_service.submit_project(project_id, request)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/annotation/projects/{project_id}/dedup")
+async def get_annotation_project_dedup_report(project_id: str):
+    """获取标注项目最近一次去重报告"""
+    report = dedup_service.get_report("project", project_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="No dedup report for this project")
+    return report
+
+
+@router.get("/annotation/projects/{project_id}/compare/{other_project_id}")
+async def compare_annotation_projects(
+    project_id: str,
+    other_project_id: str,
+    iou_threshold: float = 0.5,
+    method: str = "greedy"
+):
+    """以 project_id 为基准比较两个项目中同名图片的标注"""
+    try:
+        return await run_in_threadpool(
+            annotation_service.compare_projects, project_id, other_project_id, iou_threshold, method
+        )
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @router.get("/annotation/statistics/{project_id}")
 async def get_annotation_statistics(project_id: str):
     """获取标注统计信息"""
@@ -497,17 +1152,44 @@ async def get_annotation_statistics(project_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/annotation/statistics/{project_id}/rebuild")
+async def rebuild_annotation_statistics(project_id: str):
+    """按标注数据重新计算统计计数，返回重算前的计数是否一致"""
+    try:
+        return await run_in_threadpool(annotation_service.rebuild_statistics, project_id)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
 @router.get("/annotation/visualize/{project_id}/{image_name}")
-async def visualize_annotations(project_id: str, image_name: str):
-    """可视化标注结果"""
+async def visualize_annotations(
+    request: Request,
+    project_id: str,
+    image_name: str,
+    max_side: Optional[int] = None,
+    quality: int = 85
+):
+    """
+    可视化标注结果（内存中渲染并缓存，max_side 限制输出尺寸，quality 为 JPEG 质量）
+    
+    ETag 在渲染之前计算，If-None-Match 命中时直接返回 304，不渲染
+    """
     try:
-        output_path = annotation_service.visualize_annotations(project_id, image_name)
-        if not output_path or not output_path.exists():
-            raise HTTPException(status_code=500, detail="Failed to visualize annotations")
-        
-        return FileResponse(path=str(output_path))
+        etag, render = await run_in_threadpool(
+            annotation_service.prepare_render, project_id, image_name, max_side, quality
+        )
+        headers = {"ETag": etag, "Cache-Control": REVALIDATE_CACHE_CONTROL}
+        if _etag_matches(request, etag):
+            return Response(status_code=304, headers=headers)
+        data = await run_in_threadpool(render)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=500, detail=f"Failed to visualize annotations: {e}")
+    
+    return Response(content=data, media_type="image/jpeg", headers=headers)
 
 
 
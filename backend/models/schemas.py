@@ -34,7 +34,8 @@ class InferenceResponse(BaseModel):
 class TrainingConfig(BaseModel):
     """训练配置"""
     project_name: str
-    dataset_path: str
+    dataset_path: str = ""  # data.yaml 路径，指定 project_id 时可留空
+    project_id: Optional[str] = None  # 直接使用标注项目训练
     model_type: str = "yolo11n"
     epochs: int = 100
     batch_size: int = 16
@@ -46,6 +47,15 @@ class TrainingConfig(BaseModel):
     optimizer: str = "auto"
     lr0: float = 0.01
     lrf: float = 0.01
+    # CPU 分布式数据并行（gloo）
+    world_size: int = 1  # 总进程数，大于 1 时启用分布式训练
+    nproc_per_node: Optional[int] = None  # 本机进程数，默认等于 world_size
+    node_rank: int = 0  # 本机节点序号（多机训练）
+    master_addr: str = "127.0.0.1"  # rendezvous 地址
+    master_port: int = 29500
+    shard_dataset: Optional[str] = None  # 从分片数据集训练（先顺序读取到本地缓存）
+    dataset_name: Optional[str] = None  # DATASETS_DIR 下的数据集名称，训练前创建快照并记录版本
+    dataset_version: Optional[str] = None  # 使用指定的数据集版本（与 dataset_name 一起使用）
 
 
 class TrainingStatus(BaseModel):
@@ -59,6 +69,8 @@ class TrainingStatus(BaseModel):
     created_at: datetime
     updated_at: datetime
     error_message: Optional[str] = None
+    ranks: Optional[List[Dict[str, Any]]] = None  # 分布式训练各 rank 的吞吐量
+    dataset_version: Optional[str] = None  # 训练使用的数据集版本
 
 
 class ModelInfo(BaseModel):
@@ -92,12 +104,113 @@ class ExportConfig(BaseModel):
     batch_size: int = 1
     optimize: bool = False
     half: bool = False  # FP16 量化
+    int8: bool = False  # INT8 量化（需要校准数据集）
+    data: Optional[str] = None  # INT8 校准数据集 data.yaml
+    fraction: float = 1.0  # 用于校准的数据集比例
     simplify: bool = True  # ONNX 简化
     dynamic: bool = False  # 动态输入
     opset: int = 12  # ONNX opset 版本
 
 
 
+class BenchmarkRequest(BaseModel):
+    """模型格式基准测试请求"""
+    model_name: str
+    formats: List[str] = ["torch", "torchscript", "onnx", "openvino"]
+    batch_sizes: List[int] = [1, 4]  # 始终包含 batch=1（服务候选和精度检查使用）
+    img_sizes: List[int] = [320, 640]
+    iterations: int = 20  # 每个组合的计时次数
+    check_accuracy: bool = True  # 在 coco8 上比较 mAP
+    map_tolerance: float = 0.01  # 与 PyTorch 模型相比允许的 mAP50-95 变化
+    select_engine: bool = False  # 将最快且精度不变的格式设为默认推理引擎
+
+
+class QuantizeRequest(BaseModel):
+    """INT8 量化请求（校准数据来自数据集或标注项目，二选一）"""
+    model_name: str
+    format: str = "openvino"  # openvino, tflite
+    dataset_name: Optional[str] = None
+    project_id: Optional[str] = None
+    img_size: int = 640
+    fraction: float = 1.0  # 用于校准的数据集比例
+    map_tolerance: float = 0.02  # 允许的 mAP50-95 下降
+    register_engine: bool = True  # 精度满足要求时设为该模型的默认推理引擎
+
+
+class DedupRequest(BaseModel):
+    """近似重复图片检测请求"""
+    threshold: int = Field(8, ge=0, le=12)  # 感知哈希（64 位）的最大汉明距离
+    action: str = "report"  # report: 仅报告, drop: 每簇只保留一张, group: 同簇图片放在同一划分
+
+
+class DatasetSnapshotRequest(BaseModel):
+    """创建数据集快照"""
+    message: str = ""
+
+
+class DatasetCheckoutRequest(BaseModel):
+    """把数据集版本检出为数据集目录"""
+    target_name: Optional[str] = None  # 默认 <数据集>_<版本号前 8 位>；与原数据集同名时还原工作目录
+    overwrite: bool = False
+
+
+class ShardPackRequest(BaseModel):
+    """把数据集打包为分片"""
+    shard_size_mb: Optional[int] = Field(None, ge=16)  # 单个分片大小，默认使用 SHARD_SIZE
+
+
+class ShardUnpackRequest(BaseModel):
+    """把分片还原为普通数据集目录"""
+    target_name: Optional[str] = None  # 输出数据集名称，默认还原到原数据集
+    overwrite: bool = False
+
+
+class ShardPredictRequest(BaseModel):
+    """对分片数据集批量推理"""
+    model_name: str
+    split: Optional[str] = None  # 只处理指定划分
+    confidence: float = 0.25
+    iou_threshold: float = 0.45
+    img_size: int = 640
+    batch_size: int = Field(16, ge=1, le=256)
+    save_labels: bool = False  # 自动标注：把预测结果作为标签写入新的分片数据集
+    target_name: Optional[str] = None  # 自动标注输出的数据集名称，默认 <数据集>_auto
+
+
+class ImageAnnotationPatch(BaseModel):
+    """单张图片的标注修改"""
+    annotations: List[Dict[str, Any]] = []  # 该图片的全部标注框，空列表表示清空
+    base_version: Optional[int] = None  # 读取时的版本号，与服务端不一致时返回 409；为空时不检查
+
+
+class AnnotationPatchRequest(BaseModel):
+    """增量保存标注"""
+    images: Dict[str, ImageAnnotationPatch]  # {图片名: 修改}
+    classes: Optional[List[str]] = None  # 同时更新类别列表
+
+
+class UploadSessionCreate(BaseModel):
+    """创建分片上传会话"""
+    filename: str
+    size: int  # 文件总字节数
+    sha256: Optional[str] = None  # 可选，发布前校验
+    overwrite: bool = False  # 是否替换同名模型
+
+
+class JobStatus(BaseModel):
+    """后台任务状态"""
+    job_id: str
+    job_type: str  # export 等
+    status: str  # pending, running, completed, failed, cancelled
+    cancellable: bool = False  # 是否支持 /jobs/{job_id}/cancel
+    progress: float = 0.0
+    message: str = ""
+    result: Optional[Dict[str, Any]] = None
+    created_at: datetime
+    updated_at: datetime
+    error_message: Optional[str] = None
+
+
 class SystemInfo(BaseModel):
     """系统信息"""
     app_name: str
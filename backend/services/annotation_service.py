@@ -3,20 +3,109 @@
 """
 本地数据标注服务 - 集成 Supervision
 """
+import io
 import os
 import json
+import time
 import shutil
 import zipfile
 import cv2
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator, Tuple, Union, Callable
 from datetime import datetime
 import uuid
+import hashlib
+import threading
 import supervision as sv
+from PIL import Image
 
 from config.config import settings
 from backend.services.supervision_service import supervision_service
+from backend.services.preview_service import preview_service, source_version
+from backend.services.render_service import render_service
+from backend.utils.file_utils import link_file
+from backend.services.job_service import job_service, JobContext, JobCancelled
+from backend.models.schemas import JobStatus
+from backend.utils.annotation_store import AnnotationStore
+from backend.utils.box_matching import MATCH_METHODS, SCIPY_AVAILABLE, match_annotations, compare_annotation_sets
+
+
+# 支持的图片格式
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.bmp', '.webp']
+
+# 自动标注的合并模式
+MERGE_MODES = ("replace", "append", "smart_merge")
+
+# 未设置类别时的默认类别
+DEFAULT_CLASSES = ['person', 'car', 'dog', 'cat']
+
+# 导出zip中不再压缩的图片格式（本身已压缩）
+STORED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
+
+# 导出时每次读取的图片字节数
+EXPORT_CHUNK_SIZE = 1024 * 1024
+
+# 上传时每次写入的字节数
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# 训练视图在最后一次使用多久之后可以清理（秒），需长于最长的训练 / 校准任务
+TRAIN_VIEW_RETENTION = 7 * 24 * 3600
+
+# 导出内容变化时递增，使旧的导出缓存失效
+EXPORT_FORMAT_VERSION = 1
+
+
+class _ZipStream(io.RawIOBase):
+    """zipfile 的输出目标：写入的数据同时写入缓存文件并暂存，由 drain() 取出（不可 seek，zip 使用数据描述符）"""
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self.chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        data = bytes(b)
+        self.cache_file.write(data)
+        self.chunks.append(data)
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def _detections_to_annotations(
+    detections: "sv.Detections",
+    width: int,
+    height: int,
+    class_names: Dict[int, str]
+) -> List[Dict[str, Any]]:
+    """把 Detections 转换为标注格式（归一化的左上角坐标和宽高），坐标按数组整体计算"""
+    if len(detections) == 0:
+        return []
+    xyxy = detections.xyxy / np.array([width, height, width, height], dtype=np.float64)
+    boxes = np.column_stack([xyxy[:, :2], xyxy[:, 2:] - xyxy[:, :2]]).tolist()
+    class_ids = detections.class_id.astype(int).tolist()
+    confidences = detections.confidence.astype(float).tolist()
+    return [
+        {
+            'class': class_names[class_id],
+            'class_id': class_id,
+            'x': x,
+            'y': y,
+            'width': w,
+            'height': h,
+            'confidence': score,
+            'auto_annotated': True  # 标记为自动标注
+        }
+        for class_id, (x, y, w, h), score in zip(class_ids, boxes, confidences)
+    ]
 
 
 class AnnotationService:
@@ -25,32 +114,60 @@ class AnnotationService:
     def __init__(self):
         self.projects_dir = Path(settings.DATA_DIR) / "annotation_projects"
         self.projects_dir.mkdir(parents=True, exist_ok=True)
-        self.projects_file = self.projects_dir / "projects.json"
         
-        # 初始化projects文件
-        if not self.projects_file.exists():
-            self._save_projects_index([])
-    
-    def _load_projects_index(self) -> List[Dict[str, Any]]:
-        """加载项目索引"""
-        try:
-            with open(self.projects_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Error loading projects index: {e}")
-            return []
+        # 项目、图片、标注和类别保存在 SQLite 数据库中
+        self.store = AnnotationStore(self.projects_dir / "annotations.db")
+        self._migrate_json_projects()
+        
+        # 正在使用的训练视图目录 -> 占用计数，清理旧视图时跳过
+        self._views_lock = threading.Lock()
+        self._views_in_use: Dict[Path, int] = {}
     
-    def _save_projects_index(self, projects: List[Dict[str, Any]]):
-        """保存项目索引"""
-        try:
-            with open(self.projects_file, 'w', encoding='utf-8') as f:
-                json.dump(projects, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"Error saving projects index: {e}")
+    def _migrate_json_projects(self):
+        """
+        导入旧版以 JSON 文件保存的项目（project.json、annotations.json、classes.json）
+        
+        导入后原文件重命名为 *.migrated，每个项目只会导入一次。
+        """
+        for project_file in sorted(self.projects_dir.glob("*/project.json")):
+            project_dir = project_file.parent
+            annotations_dir = project_dir / "annotations"
+            try:
+                if not self.store.has_project(project_dir.name):
+                    with open(project_file, 'r', encoding='utf-8') as f:
+                        project = json.load(f)
+                    project.update(id=project_dir.name, path=str(project_dir))
+                    
+                    annotations = {}
+                    if (annotations_dir / "annotations.json").exists():
+                        with open(annotations_dir / "annotations.json", 'r', encoding='utf-8') as f:
+                            annotations = json.load(f)
+                    classes = None
+                    if (annotations_dir / "classes.json").exists():
+                        with open(annotations_dir / "classes.json", 'r', encoding='utf-8') as f:
+                            classes = json.load(f)
+                    images_dir = project_dir / "images"
+                    image_names = sorted(
+                        f.name for f in images_dir.iterdir() if f.suffix.lower() in IMAGE_EXTENSIONS
+                    ) if images_dir.exists() else []
+                    
+                    self.store.import_project(project, image_names, annotations, classes)
+                    print(f"已导入标注项目: {project.get('name', project_dir.name)} "
+                          f"({len(image_names)} 张图片, {len(annotations)} 个标注文件条目)")
+                
+                for old_file in (project_file, annotations_dir / "annotations.json", annotations_dir / "classes.json"):
+                    if old_file.exists():
+                        old_file.rename(old_file.with_name(old_file.name + ".migrated"))
+            except Exception as e:
+                print(f"Error migrating project {project_dir.name}: {e}")
+        
+        projects_file = self.projects_dir / "projects.json"
+        if projects_file.exists():
+            projects_file.rename(projects_file.with_name("projects.json.migrated"))
     
     def list_projects(self) -> List[Dict[str, Any]]:
         """列出所有项目"""
-        return self._load_projects_index()
+        return self.store.list_projects()
     
     def create_project(self, name: str, description: str = "") -> Dict[str, Any]:
         """创建新项目"""
@@ -71,58 +188,49 @@ class AnnotationService:
             "path": str(project_dir)
         }
         
-        # 保存项目配置
-        project_config_file = project_dir / "project.json"
-        with open(project_config_file, 'w', encoding='utf-8') as f:
-            json.dump(project, f, ensure_ascii=False, indent=2)
-        
-        # 更新项目索引
-        projects = self._load_projects_index()
-        projects.append(project)
-        self._save_projects_index(projects)
-        
+        self.store.create_project(project)
         return project
     
+    def _image_entry(self, project_id: str, img_path: Path, version: int) -> Dict[str, Any]:
+        """图片列表项（version 为图片标注的版本号，增量保存时用于冲突检查）"""
+        return {
+            "name": img_path.name,
+            "url": preview_service.project_image_url(project_id, img_path, "full"),
+            "thumb_url": preview_service.project_image_url(project_id, img_path, "thumb"),
+            "path": str(img_path),
+            "version": version
+        }
+    
     def get_project(self, project_id: str) -> Optional[Dict[str, Any]]:
-        """获取项目详情"""
-        project_dir = self.projects_dir / project_id
-        project_config_file = project_dir / "project.json"
+        """
+        获取项目详情
         
-        if not project_config_file.exists():
+        图片数不超过 ANNOTATION_FULL_LOAD_LIMIT 时一次返回全部图片和标注；更大的项目
+        只返回项目信息和类别（paginated 为 True），图片和标注通过 list_images 分页获取。
+        """
+        project = self.store.get_project(project_id)
+        if not project:
             return None
         
         try:
-            with open(project_config_file, 'r', encoding='utf-8') as f:
-                project = json.load(f)
-            
-            # 加载图片列表
-            images_dir = project_dir / "images"
             images = []
-            for img_path in images_dir.glob("*"):
-                if img_path.suffix.lower() in ['.jpg', '.jpeg', '.png', '.bmp', '.webp']:
-                    images.append({
-                        "name": img_path.name,
-                        "url": f"/api/v1/annotation/image/{project_id}/{img_path.name}",
-                        "path": str(img_path)
-                    })
-            
-            # 加载标注数据
-            annotations_file = project_dir / "annotations" / "annotations.json"
             annotations = {}
-            if annotations_file.exists():
-                with open(annotations_file, 'r', encoding='utf-8') as f:
-                    annotations = json.load(f)
-            
-            # 加载类别
-            classes_file = project_dir / "annotations" / "classes.json"
-            classes = ['person', 'car', 'dog', 'cat']  # 默认类别
-            if classes_file.exists():
-                with open(classes_file, 'r', encoding='utf-8') as f:
-                    classes = json.load(f)
+            self._sync_images(project_id)
+            num_images = self.store.count_images(project_id)
+            paginated = num_images > settings.ANNOTATION_FULL_LOAD_LIMIT
+            if not paginated:
+                versions = self.store.get_image_versions(project_id)
+                images = [
+                    self._image_entry(project_id, img_path, versions.get(img_path.name, 0))
+                    for img_path in self._list_image_files(project_id)
+                ]
+                annotations = self._load_annotations(project_id)
             
             project['images'] = images
             project['annotations'] = annotations
-            project['classes'] = classes
+            project['classes'] = self._load_classes(project_id)
+            project['num_images'] = num_images
+            project['paginated'] = paginated
             
             return project
         except Exception as e:
@@ -130,37 +238,161 @@ class AnnotationService:
             return None
     
     def upload_images(self, project_id: str, files: List[Any]) -> Dict[str, Any]:
-        """上传图片到项目"""
+        """
+        上传图片到项目
+        
+        各文件在线程池中并行处理：分块写入临时文件并同时计算 SHA256，校验格式和大小，
+        读取图片尺寸后放入图片目录，并预先生成缩略图。内容与项目中已有图片（或同批次中
+        先处理的文件）相同的文件不会保存；与已有图片同名但内容不同的文件自动改名，不会覆盖。
+        
+        Args:
+            project_id: 项目ID
+            files: 上传的文件（UploadFile）
+            
+        Returns:
+            各状态的数量，以及每个文件的处理结果 files：
+            status 为 uploaded / duplicate / rejected，name 为保存后的文件名
+        """
         project_dir = self.projects_dir / project_id
-        if not project_dir.exists():
-            return {"success": False, "message": "Project not found"}
+        if not project_dir.exists() or not self.store.has_project(project_id):
+            raise FileNotFoundError(f"Project not found: {project_id}")
         
         images_dir = project_dir / "images"
-        uploaded = 0
+        images_dir.mkdir(parents=True, exist_ok=True)
+        self._sync_images(project_id)
+        self._backfill_image_metadata(project_id)
+        
+        # 已有内容哈希和文件名；并行处理时在锁内检查和登记，同批次的重复文件也能识别
+        known_hashes = self.store.get_image_hashes(project_id)
+        taken_names = {name.lower() for name in self.store.list_image_names(project_id)}
+        lock = threading.Lock()
+        
+        def process(file) -> Dict[str, Any]:
+            filename = Path(file.filename or "").name
+            result: Dict[str, Any] = {"filename": filename}
+            try:
+                tmp_path, meta = self._receive_image(file, images_dir)
+            except ValueError as e:
+                result.update(status="rejected", error=str(e))
+                return result
+            
+            with lock:
+                duplicate_of = known_hashes.get(meta["sha256"])
+                if duplicate_of is None:
+                    name = self._unique_image_name(filename, taken_names)
+                    taken_names.add(name.lower())
+                    known_hashes[meta["sha256"]] = name
+                    os.replace(tmp_path, images_dir / name)
+            if duplicate_of is not None:
+                tmp_path.unlink(missing_ok=True)
+                result.update(status="duplicate", duplicate_of=duplicate_of, sha256=meta["sha256"])
+                return result
+            
+            # 预先生成缩略图，图片列表首次打开时不需要等待
+            try:
+                preview_service.get_preview(images_dir / name, "thumb")
+            except Exception as e:
+                print(f"Error generating thumbnail for {name}: {e}")
+            result.update(status="uploaded", name=name, **meta)
+            return result
+        
+        with ThreadPoolExecutor(max_workers=max(1, settings.IMAGE_WORKERS)) as pool:
+            results = list(pool.map(process, files))
+        
+        # 登记图片（含哈希和尺寸）并更新项目时间
+        metadata = {
+            r["name"]: {k: r[k] for k in ("sha256", "width", "height", "size")}
+            for r in results if r["status"] == "uploaded"
+        }
+        self.store.add_images(project_id, list(metadata), images_dir.stat().st_mtime_ns, metadata)
         
+        counts = {status: sum(1 for r in results if r["status"] == status)
+                  for status in ("uploaded", "duplicate", "rejected")}
+        return {
+            "success": True,
+            "uploaded": counts["uploaded"],
+            "duplicates": counts["duplicate"],
+            "rejected": counts["rejected"],
+            "files": results,
+            "message": f"Successfully uploaded {counts['uploaded']} images"
+        }
+    
+    def _receive_image(self, file, images_dir: Path) -> Tuple[Path, Dict[str, Any]]:
+        """
+        把上传文件分块写入图片目录中的临时文件，同时计算 SHA256，并校验为可读取的图片
+        
+        Returns:
+            (临时文件路径, {sha256, width, height, size})；类型、大小或内容不合法时抛出 ValueError
+        """
+        suffix = Path(file.filename or "").suffix.lower()
+        if suffix not in IMAGE_EXTENSIONS:
+            raise ValueError(f"Unsupported file type: {suffix or 'none'}")
+        
+        tmp_path = images_dir / f".upload-{uuid.uuid4().hex}.tmp"
+        digest = hashlib.sha256()
+        size = 0
         try:
-            for file in files:
-                # 保存文件
-                file_path = images_dir / file.filename
-                with open(file_path, 'wb') as f:
-                    content = file.file.read()
-                    f.write(content)
-                uploaded += 1
-            
-            # 更新项目时间
-            self._update_project_timestamp(project_id)
-            
-            return {
-                "success": True,
-                "uploaded": uploaded,
-                "message": f"Successfully uploaded {uploaded} images"
-            }
-        except Exception as e:
-            print(f"Error uploading images: {e}")
-            return {
-                "success": False,
-                "message": str(e)
-            }
+            with open(tmp_path, 'wb') as f:
+                for chunk in iter(lambda: file.file.read(UPLOAD_CHUNK_SIZE), b""):
+                    size += len(chunk)
+                    if size > settings.MAX_UPLOAD_SIZE:
+                        raise ValueError(f"File exceeds size limit of {settings.MAX_UPLOAD_SIZE} bytes")
+                    digest.update(chunk)
+                    f.write(chunk)
+            width, height = self._read_image_size(tmp_path)
+        except Exception:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        return tmp_path, {"sha256": digest.hexdigest(), "width": width, "height": height, "size": size}
+    
+    @staticmethod
+    def _read_image_size(path: Path) -> Tuple[int, int]:
+        """读取图片尺寸（只解析文件头并校验结构，不完整解码），不是有效图片时抛出 ValueError"""
+        try:
+            with Image.open(path) as image:
+                width, height = image.size
+                image.verify()
+        except Exception:
+            raise ValueError("Invalid image file")
+        return width, height
+    
+    @staticmethod
+    def _unique_image_name(filename: str, taken: set) -> str:
+        """与已有图片重名（不区分大小写）时在文件名后加序号"""
+        name = filename
+        stem, suffix = Path(filename).stem, Path(filename).suffix
+        counter = 1
+        while name.lower() in taken:
+            name = f"{stem}_{counter}{suffix}"
+            counter += 1
+        return name
+    
+    def _backfill_image_metadata(self, project_id: str):
+        """为尚未记录内容哈希的图片计算哈希和尺寸（每张图片只计算一次），用于上传去重"""
+        names = self.store.list_unhashed_images(project_id)
+        if not names:
+            return
+        images_dir = self.projects_dir / project_id / "images"
+        
+        def measure(name: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+            path = images_dir / name
+            digest = hashlib.sha256()
+            try:
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+                        digest.update(chunk)
+                size = path.stat().st_size
+            except OSError:
+                return None
+            try:
+                width, height = self._read_image_size(path)
+            except ValueError:
+                width, height = None, None
+            return name, {"sha256": digest.hexdigest(), "width": width, "height": height, "size": size}
+        
+        with ThreadPoolExecutor(max_workers=max(1, settings.IMAGE_WORKERS)) as pool:
+            metadata = dict(m for m in pool.map(measure, names) if m is not None)
+        self.store.set_image_metadata(project_id, metadata)
     
     def save_annotations(
         self,
@@ -174,25 +406,13 @@ class AnnotationService:
             return {"success": False, "message": "Project not found"}
         
         try:
-            annotations_dir = project_dir / "annotations"
-            annotations_dir.mkdir(exist_ok=True)
-            
-            # 保存标注数据
-            annotations_file = annotations_dir / "annotations.json"
-            with open(annotations_file, 'w', encoding='utf-8') as f:
-                json.dump(annotations, f, ensure_ascii=False, indent=2)
-            
-            # 保存类别
-            classes_file = annotations_dir / "classes.json"
-            with open(classes_file, 'w', encoding='utf-8') as f:
-                json.dump(classes, f, ensure_ascii=False, indent=2)
-            
-            # 更新项目时间
-            self._update_project_timestamp(project_id)
+            # 只改写标注有变化的图片，同时更新类别和项目时间
+            changed = self.store.replace_annotations(project_id, annotations, classes)
             
             return {
                 "success": True,
-                "message": "Annotations saved successfully"
+                "message": "Annotations saved successfully",
+                "changed_images": changed
             }
         except Exception as e:
             print(f"Error saving annotations: {e}")
@@ -201,92 +421,166 @@ class AnnotationService:
                 "message": str(e)
             }
     
-    def export_to_yolo(self, project_id: str) -> Optional[Path]:
-        """导出为YOLO格式"""
-        project_dir = self.projects_dir / project_id
-        if not project_dir.exists():
-            return None
+    def list_images(
+        self,
+        project_id: str,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+        sort: str = "name",
+        status: Optional[str] = None,
+        class_name: Optional[str] = None,
+        auto_annotated: Optional[bool] = None,
+        max_confidence: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        分页获取图片及其标注
         
-        try:
-            # 创建临时导出目录
-            export_dir = project_dir / "export_yolo"
-            if export_dir.exists():
-                shutil.rmtree(export_dir)
-            export_dir.mkdir(parents=True, exist_ok=True)
-            
-            # 创建YOLO目录结构
-            images_train_dir = export_dir / "images" / "train"
-            images_val_dir = export_dir / "images" / "val"
-            labels_train_dir = export_dir / "labels" / "train"
-            labels_val_dir = export_dir / "labels" / "val"
-            
-            for dir_path in [images_train_dir, images_val_dir, labels_train_dir, labels_val_dir]:
-                dir_path.mkdir(parents=True, exist_ok=True)
-            
-            # 加载标注数据
-            annotations_file = project_dir / "annotations" / "annotations.json"
-            if not annotations_file.exists():
-                return None
-            
-            with open(annotations_file, 'r', encoding='utf-8') as f:
-                annotations = json.load(f)
-            
-            # 加载类别
-            classes_file = project_dir / "annotations" / "classes.json"
-            classes = ['person', 'car', 'dog', 'cat']
-            if classes_file.exists():
-                with open(classes_file, 'r', encoding='utf-8') as f:
-                    classes = json.load(f)
-            
-            # 分割数据集 (80% train, 20% val)
-            images_dir = project_dir / "images"
-            image_files = list(images_dir.glob("*"))
-            image_files = [f for f in image_files if f.suffix.lower() in ['.jpg', '.jpeg', '.png', '.bmp', '.webp']]
-            
-            import random
-            random.shuffle(image_files)
-            split_idx = int(len(image_files) * 0.8)
-            train_images = image_files[:split_idx]
-            val_images = image_files[split_idx:]
+        Args:
+            project_id: 项目ID
+            cursor: 上一页返回的 next_cursor，为空时返回第一页
+            limit: 每页图片数（1-1000）
+            sort: name / -name / created_at / -created_at
+            status: annotated / unannotated
+            class_name: 只返回包含该类别标注的图片
+            auto_annotated: 只返回含（True）或不含（False）自动标注的图片
+            max_confidence: 只返回含置信度低于该值的标注的图片
             
-            # 处理训练集
-            for img_path in train_images:
-                self._process_image_for_yolo(
-                    img_path,
-                    images_train_dir,
-                    labels_train_dir,
-                    annotations.get(img_path.name, []),
-                    classes
-                )
+        Returns:
+            {"images": [...], "annotations": {图片名: [标注框]}, "next_cursor": ..., "total": ...}
             
-            # 处理验证集
-            for img_path in val_images:
-                self._process_image_for_yolo(
-                    img_path,
-                    images_val_dir,
-                    labels_val_dir,
-                    annotations.get(img_path.name, []),
-                    classes
-                )
+        Raises:
+            FileNotFoundError: 项目不存在
+            ValueError: 参数无效
+        """
+        if not self.store.has_project(project_id):
+            raise FileNotFoundError("Project not found")
+        if not 1 <= limit <= 1000:
+            raise ValueError("limit must be between 1 and 1000")
+        self._sync_images(project_id)
+        
+        page = self.store.list_images_page(
+            project_id, cursor, limit, sort, status, class_name, auto_annotated, max_confidence
+        )
+        images_dir = self.projects_dir / project_id / "images"
+        images = []
+        for row in page["images"]:
+            entry = self._image_entry(project_id, images_dir / row["name"], row["version"])
+            entry["num_annotations"] = row["num_annotations"]
+            images.append(entry)
+        
+        return {
+            "images": images,
+            "annotations": self.store.get_annotations(project_id, [image["name"] for image in images]),
+            "next_cursor": page["next_cursor"],
+            "total": page["total"]
+        }
+    
+    def get_image_annotations(self, project_id: str, image_name: str) -> Dict[str, Any]:
+        """
+        获取单张图片的标注及其版本号
+        
+        Raises:
+            FileNotFoundError: 项目或图片不存在
+        """
+        if not self.store.has_project(project_id):
+            raise FileNotFoundError("Project not found")
+        self._sync_images(project_id)
+        versions = self.store.get_image_versions(project_id, [image_name])
+        if image_name not in versions:
+            raise FileNotFoundError(f"Image not found: {image_name}")
+        return {
+            "image": image_name,
+            "version": versions[image_name],
+            "annotations": self.store.get_annotations(project_id, [image_name]).get(image_name, [])
+        }
+    
+    def patch_annotations(
+        self,
+        project_id: str,
+        images: Dict[str, Dict[str, Any]],
+        classes: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """
+        增量保存标注：只替换指定图片的标注
+        
+        Args:
+            project_id: 项目ID
+            images: {图片名: {"annotations": [...], "base_version": 读取时的版本号或 None}}
+            classes: 同时更新的类别列表（可选）
             
-            # 创建data.yaml
-            data_yaml_content = f"""# YOLO Dataset
-path: {export_dir.absolute()}
-train: images/train
-val: images/val
-
-# Classes
-names:
-"""
-            for i, cls in enumerate(classes):
-                data_yaml_content += f"  {i}: {cls}\n"
+        Returns:
+            {"success": True, "versions": {图片名: 新版本号}}
             
-            data_yaml_path = export_dir / "data.yaml"
-            with open(data_yaml_path, 'w', encoding='utf-8') as f:
-                f.write(data_yaml_content)
+        Raises:
+            FileNotFoundError: 项目或图片不存在
+            AnnotationConflictError: 图片标注已被他人修改（不写入任何图片）
+        """
+        if not self.store.has_project(project_id):
+            raise FileNotFoundError("Project not found")
+        self._sync_images(project_id)
+        
+        versions = self.store.patch_annotations(
+            project_id,
+            {name: patch.get("annotations") or [] for name, patch in images.items()},
+            {name: patch.get("base_version") for name, patch in images.items()},
+            classes
+        )
+        return {"success": True, "versions": versions}
+    
+    def _export_fingerprint(
+        self,
+        project_id: str,
+        image_files: List[Path],
+        classes: List[str],
+        groups: Optional[Dict[str, str]]
+    ) -> str:
+        """导出内容的指纹：图片文件（大小、mtime）、各图片标注版本号、类别和划分分组"""
+        versions = self.store.get_image_versions(project_id)
+        h = hashlib.sha256(f"yolo-export:{EXPORT_FORMAT_VERSION}\n".encode('utf-8'))
+        h.update(json.dumps(classes).encode('utf-8'))
+        h.update(json.dumps(groups, sort_keys=True).encode('utf-8'))
+        for img_path in image_files:
+            st = img_path.stat()
+            h.update(f"\n{img_path.name}\0{st.st_size}\0{st.st_mtime_ns}\0{versions.get(img_path.name, 0)}".encode('utf-8'))
+        return h.hexdigest()
+    
+    def open_yolo_export(self, project_id: str) -> Union[Path, Iterator[bytes]]:
+        """
+        导出为YOLO格式的zip
+        
+        标注、类别和图片都未变化时直接返回上次导出的缓存文件；否则返回边打包边输出的字节流，
+        图片直接从项目目录读取（JPEG/PNG 不再压缩），标签文件在打包时生成，
+        流完整输出后写入缓存。
+        
+        Args:
+            project_id: 项目ID
             
-            # 创建README
-            readme_content = f"""# YOLO Dataset Export
+        Returns:
+            缓存的zip路径，或zip字节流
+        """
+        if not self.store.has_project(project_id):
+            raise FileNotFoundError(f"Project not found: {project_id}")
+        
+        # 是否有标注由统计计数判断，命中缓存时不读取标注
+        stats = self.store.get_stats(project_id)
+        if not stats or not stats["auto_annotations"] + stats["manual_annotations"]:
+            raise ValueError("Project has no annotations to export")
+        classes = self._load_classes(project_id)
+        
+        # 分割数据集 (80% train, 20% val)，近似重复的图片放在同一划分
+        image_files = self._list_image_files(project_id)
+        groups = self._load_split_groups(project_id)
+        
+        cache_dir = self.projects_dir / project_id / "exports"
+        cache_path = cache_dir / f"{self._export_fingerprint(project_id, image_files, classes, groups)[:32]}.zip"
+        if cache_path.exists():
+            return cache_path
+        
+        annotations = self._load_annotations(project_id)
+        train_images, val_images = self._split_images(image_files, 0.2, groups)
+        entries = [("train", p) for p in train_images] + [("val", p) for p in val_images]
+        
+        readme_content = f"""# YOLO Dataset Export
 
 Project: {project_id}
 Export Date: {datetime.now().isoformat()}
@@ -310,90 +604,316 @@ model = YOLO('yolov8n.pt')
 results = model.train(data='data.yaml', epochs=100)
 ```
 """
-            readme_path = export_dir / "README.md"
-            with open(readme_path, 'w', encoding='utf-8') as f:
-                f.write(readme_content)
-            
-            # 压缩为zip
-            zip_path = project_dir / f"{project_id}_yolo.zip"
-            if zip_path.exists():
-                zip_path.unlink()
-            
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for root, dirs, files in os.walk(export_dir):
-                    for file in files:
-                        file_path = Path(root) / file
-                        arcname = file_path.relative_to(export_dir)
-                        zipf.write(file_path, arcname)
-            
-            # 清理临时目录
-            shutil.rmtree(export_dir)
-            
-            return zip_path
-            
+        # 压缩包中的 data.yaml 不写 path，由 ultralytics 按 data.yaml 所在目录解析
+        files = {
+            "data.yaml": self._data_yaml_content(classes),
+            "README.md": readme_content
+        }
+        return self._stream_yolo_zip(entries, annotations, classes, files, cache_path)
+    
+    def _stream_yolo_zip(
+        self,
+        entries: List[Tuple[str, Path]],
+        annotations: Dict[str, List[Dict[str, Any]]],
+        classes: List[str],
+        files: Dict[str, str],
+        cache_path: Path
+    ) -> Iterator[bytes]:
+        """逐个条目写入zip并输出已生成的字节，同时写入缓存临时文件，完整结束后替换为缓存"""
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_name(f".{uuid.uuid4().hex}.tmp")
+        try:
+            with open(tmp_path, 'wb') as cache_file:
+                stream = _ZipStream(cache_file)
+                with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                    for arcname, content in files.items():
+                        zipf.writestr(arcname, content)
+                    yield stream.drain()
+                    
+                    for split, img_path in entries:
+                        zinfo = zipfile.ZipInfo.from_file(img_path, f"images/{split}/{img_path.name}")
+                        zinfo.compress_type = (
+                            zipfile.ZIP_STORED if img_path.suffix.lower() in STORED_EXTENSIONS
+                            else zipfile.ZIP_DEFLATED
+                        )
+                        with open(img_path, 'rb') as src, zipf.open(zinfo, 'w') as dst:
+                            while True:
+                                chunk = src.read(EXPORT_CHUNK_SIZE)
+                                if not chunk:
+                                    break
+                                dst.write(chunk)
+                                data = stream.drain()
+                                if data:
+                                    yield data
+                        
+                        zipf.writestr(
+                            f"labels/{split}/{img_path.stem}.txt",
+                            self._yolo_label_text(annotations.get(img_path.name, []), classes)
+                        )
+                yield stream.drain()
+            
+            os.replace(tmp_path, cache_path)
+            # 只保留最新的导出
+            for old in cache_path.parent.glob("*.zip"):
+                if old != cache_path:
+                    old.unlink(missing_ok=True)
+        finally:
+            # 客户端中途断开或出错时丢弃未完成的缓存
+            tmp_path.unlink(missing_ok=True)
+    
+    def export_to_yolo(self, project_id: str) -> Optional[Path]:
+        """导出为YOLO格式，返回缓存的zip路径"""
+        try:
+            export = self.open_yolo_export(project_id)
+            if isinstance(export, Path):
+                return export
+            for _ in export:
+                pass
+            return self.open_yolo_export(project_id)
         except Exception as e:
             print(f"Error exporting to YOLO: {e}")
             import traceback
             traceback.print_exc()
             return None
     
-    def _process_image_for_yolo(
+    def _yolo_label_text(self, annotations: List[Dict[str, Any]], classes: List[str]) -> str:
+        """生成单张图片的YOLO标签文件内容"""
+        lines = []
+        for ann in annotations:
+            class_id = classes.index(ann['class']) if ann['class'] in classes else 0
+            
+            # YOLO格式: class_id center_x center_y width height (归一化坐标)
+            center_x = ann['x'] + ann['width'] / 2
+            center_y = ann['y'] + ann['height'] / 2
+            width = ann['width']
+            height = ann['height']
+            
+            lines.append(f"{class_id} {center_x:.6f} {center_y:.6f} {width:.6f} {height:.6f}\n")
+        return "".join(lines)
+    
+    def _write_yolo_label(
         self,
-        img_path: Path,
-        target_images_dir: Path,
-        target_labels_dir: Path,
+        label_path: Path,
         annotations: List[Dict[str, Any]],
         classes: List[str]
     ):
-        """处理单张图片为YOLO格式"""
-        # 复制图片
-        shutil.copy(img_path, target_images_dir / img_path.name)
+        """写入单张图片的YOLO标签文件（没有标注时为空文件）"""
+        with open(label_path, 'w', encoding='utf-8') as f:
+            f.write(self._yolo_label_text(annotations, classes))
+    
+    def _data_yaml_content(self, classes: List[str], dataset_dir: Optional[Path] = None) -> str:
+        """生成 YOLO 数据集配置 data.yaml 的内容"""
+        data_yaml_content = "# YOLO Dataset\n"
+        if dataset_dir is not None:
+            data_yaml_content += f"path: {dataset_dir.absolute()}\n"
+        data_yaml_content += """train: images/train
+val: images/val
+
+# Classes
+names:
+"""
+        for i, cls in enumerate(classes):
+            data_yaml_content += f"  {i}: {cls}\n"
+        return data_yaml_content
+    
+    def _write_data_yaml(self, dataset_dir: Path, classes: List[str]) -> Path:
+        """写入 YOLO 数据集配置文件 data.yaml"""
+        data_yaml_path = dataset_dir / "data.yaml"
+        with open(data_yaml_path, 'w', encoding='utf-8') as f:
+            f.write(self._data_yaml_content(classes, dataset_dir))
+        return data_yaml_path
+    
+    def _list_image_files(self, project_id: str) -> List[Path]:
+        """列出项目中的所有图片文件"""
+        images_dir = self.projects_dir / project_id / "images"
+        if not images_dir.exists():
+            return []
+        self._sync_images(project_id)
+        return [images_dir / name for name in self.store.list_image_names(project_id)]
+    
+    def _sync_images(self, project_id: str):
+        """
+        图片目录在平台之外被修改时（目录修改时间与数据库记录不一致）重新扫描目录，
+        同步数据库中的图片列表
+        """
+        images_dir = self.projects_dir / project_id / "images"
+        if not images_dir.exists():
+            return
+        mtime = images_dir.stat().st_mtime_ns
+        if self.store.get_images_mtime(project_id) == mtime:
+            return
+        names = [f.name for f in images_dir.iterdir() if f.suffix.lower() in IMAGE_EXTENSIONS]
+        self.store.sync_images(project_id, names, mtime)
+    
+    def _load_annotations(self, project_id: str) -> Dict[str, List[Dict[str, Any]]]:
+        """加载项目标注数据"""
+        return self.store.get_annotations(project_id)
+    
+    def _load_classes(self, project_id: str) -> List[str]:
+        """加载项目类别列表"""
+        return self.store.get_classes(project_id) or list(DEFAULT_CLASSES)
+    
+    def _load_split_groups(self, project_id: str) -> Optional[Dict[str, str]]:
+        """
+        加载划分分组（图片名 -> 所属近似重复簇的代表图片）
         
-        # 创建标签文件
-        label_path = target_labels_dir / f"{img_path.stem}.txt"
+        由去重功能以 group 方式运行后写入，未启用时返回 None。
+        """
+        dedup_file = self.projects_dir / project_id / "annotations" / "dedup.json"
+        if not dedup_file.exists():
+            return None
+        with open(dedup_file, 'r', encoding='utf-8') as f:
+            dedup = json.load(f)
+        if not dedup.get("group_splits"):
+            return None
+        return {
+            member: cluster["keep"]
+            for cluster in dedup.get("clusters", [])
+            for member in cluster["members"]
+        }
+    
+    def _split_images(
+        self,
+        image_files: List[Path],
+        val_ratio: float = 0.2,
+        groups: Optional[Dict[str, str]] = None
+    ):
+        """
+        按文件名哈希稳定划分训练/验证集
         
-        if not annotations:
-            # 创建空标签文件
-            label_path.touch()
-            return
+        同一张图片每次都会落在同一个划分中，重复构建训练视图时验证集保持不变。
+        提供 groups（图片名 -> 分组键）时按分组键划分，同组图片总在同一划分。
+        """
+        train_images, val_images = [], []
+        for img_path in image_files:
+            key = groups.get(img_path.name, img_path.name) if groups else img_path.name
+            digest = hashlib.md5(key.encode('utf-8')).digest()
+            bucket = int.from_bytes(digest[:4], 'big') / 0xFFFFFFFF
+            (val_images if bucket < val_ratio else train_images).append(img_path)
         
-        # 写入YOLO格式标注
-        with open(label_path, 'w', encoding='utf-8') as f:
-            for ann in annotations:
-                class_id = classes.index(ann['class']) if ann['class'] in classes else 0
-                
-                # YOLO格式: class_id center_x center_y width height (归一化坐标)
-                center_x = ann['x'] + ann['width'] / 2
-                center_y = ann['y'] + ann['height'] / 2
-                width = ann['width']
-                height = ann['height']
-                
-                f.write(f"{class_id} {center_x:.6f} {center_y:.6f} {width:.6f} {height:.6f}\n")
+        # 保证两个划分都不为空
+        if not val_images and len(train_images) > 1:
+            val_images.append(train_images.pop())
+        if not train_images and val_images:
+            train_images.append(val_images.pop())
+        return train_images, val_images
     
-    def _update_project_timestamp(self, project_id: str):
-        """更新项目时间戳"""
+    def build_training_view(self, project_id: str, val_ratio: float = 0.2) -> Optional[Path]:
+        """
+        直接从标注项目构建 YOLO 训练目录（不复制图片、不打包 zip）
+        
+        图片通过硬链接（失败时退化为符号链接）放入 images/train 与 images/val，
+        标签文件根据当前标注生成。视图按内容指纹（图片、标注版本、类别、划分）存放在
+        train_views/<指纹>/ 下，构建完成后通过重命名一次性放入，之后不再修改：
+        同一内容的多次训练共用一个视图，标注变化后生成新视图，正在使用旧视图的任务不受影响。
+        超过 TRAIN_VIEW_RETENTION 秒未被使用的旧视图在构建新视图时清理。
+        
+        Args:
+            project_id: 项目ID
+            val_ratio: 验证集比例
+            
+        Returns:
+            data.yaml 路径，项目不存在或没有图片时返回 None
+        """
         project_dir = self.projects_dir / project_id
-        project_config_file = project_dir / "project.json"
+        if not project_dir.exists():
+            return None
+        
+        image_files = self._list_image_files(project_id)
+        if not image_files:
+            return None
+        
+        classes = self._load_classes(project_id)
+        groups = self._load_split_groups(project_id)
+        fingerprint = self._export_fingerprint(project_id, image_files, classes, groups)
+        views_dir = project_dir / "train_views"
+        view_dir = views_dir / hashlib.sha256(f"{fingerprint}:{val_ratio}".encode('utf-8')).hexdigest()[:32]
         
-        if project_config_file.exists():
+        if not (view_dir / "data.yaml").exists():
+            annotations = self._load_annotations(project_id)
+            train_images, val_images = self._split_images(image_files, val_ratio, groups)
+            
+            # 在临时目录中构建，完成后重命名为最终目录（视图只包含链接和标签，删除不会影响原图）
+            tmp_dir = views_dir / f".tmp-{uuid.uuid4().hex}"
             try:
-                with open(project_config_file, 'r', encoding='utf-8') as f:
-                    project = json.load(f)
-                
-                project['updated_at'] = datetime.now().isoformat()
-                
-                with open(project_config_file, 'w', encoding='utf-8') as f:
-                    json.dump(project, f, ensure_ascii=False, indent=2)
-                
-                # 更新索引
-                projects = self._load_projects_index()
-                for i, p in enumerate(projects):
-                    if p['id'] == project_id:
-                        projects[i] = project
-                        break
-                self._save_projects_index(projects)
-            except Exception as e:
-                print(f"Error updating project timestamp: {e}")
+                for split, split_images in (("train", train_images), ("val", val_images)):
+                    images_split_dir = tmp_dir / "images" / split
+                    labels_split_dir = tmp_dir / "labels" / split
+                    images_split_dir.mkdir(parents=True, exist_ok=True)
+                    labels_split_dir.mkdir(parents=True, exist_ok=True)
+                    
+                    for img_path in split_images:
+                        link_file(img_path, images_split_dir / img_path.name)
+                        self._write_yolo_label(
+                            labels_split_dir / f"{img_path.stem}.txt",
+                            annotations.get(img_path.name, []),
+                            classes
+                        )
+                with open(tmp_dir / "data.yaml", 'w', encoding='utf-8') as f:
+                    f.write(self._data_yaml_content(classes, view_dir))
+                try:
+                    os.rename(tmp_dir, view_dir)
+                except OSError:
+                    # 并发构建了同一视图：使用先完成的一个
+                    if not (view_dir / "data.yaml").exists():
+                        raise
+            finally:
+                if tmp_dir.exists():
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+            print(f"训练视图已构建: {view_dir} (train={len(train_images)}, val={len(val_images)})")
+        
+        # 记录使用时间，并清理长时间未使用的旧视图
+        os.utime(view_dir)
+        self._prune_training_views(views_dir, keep=view_dir)
+        return view_dir / "data.yaml"
+    
+    @contextmanager
+    def use_training_view(self, project_id: str, val_ratio: float = 0.2) -> Iterator[Optional[Path]]:
+        """
+        构建（或复用）训练视图并在 with 块内占用：占用中的视图不会被清理
+        
+        Yields:
+            data.yaml 路径，项目不存在或没有图片时为 None
+        """
+        data_yaml = self.build_training_view(project_id, val_ratio)
+        if data_yaml is None:
+            yield None
+            return
+        view_dir = data_yaml.parent
+        with self._views_lock:
+            self._views_in_use[view_dir] = self._views_in_use.get(view_dir, 0) + 1
+        try:
+            yield data_yaml
+        finally:
+            with self._views_lock:
+                self._views_in_use[view_dir] -= 1
+                if not self._views_in_use[view_dir]:
+                    del self._views_in_use[view_dir]
+            try:
+                os.utime(view_dir)
+            except OSError:
+                pass
+    
+    def _prune_training_views(self, views_dir: Path, keep: Path):
+        """删除超过 TRAIN_VIEW_RETENTION 秒未被使用（且当前未被占用）的训练视图"""
+        cutoff = time.time() - TRAIN_VIEW_RETENTION
+        with self._views_lock:
+            in_use = set(self._views_in_use)
+        for path in views_dir.iterdir():
+            if path == keep or path in in_use:
+                continue
+            try:
+                if path.stat().st_mtime < cutoff:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                continue
+    
+    def _update_project_timestamp(self, project_id: str):
+        """更新项目时间戳"""
+        try:
+            self.store.touch_project(project_id)
+        except Exception as e:
+            print(f"Error updating project timestamp: {e}")
     
     def delete_project(self, project_id: str) -> Dict[str, Any]:
         """删除项目"""
@@ -405,11 +925,7 @@ results = model.train(data='data.yaml', epochs=100)
         try:
             # 删除项目目录
             shutil.rmtree(project_dir)
-            
-            # 更新索引
-            projects = self._load_projects_index()
-            projects = [p for p in projects if p['id'] != project_id]
-            self._save_projects_index(projects)
+            self.store.delete_project(project_id)
             
             return {
                 "success": True,
@@ -422,6 +938,25 @@ results = model.train(data='data.yaml', epochs=100)
                 "message": str(e)
             }
     
+    def delete_images(self, project_id: str, image_names: List[str]) -> Dict[str, Any]:
+        """删除项目中的图片及其标注"""
+        project_dir = self.projects_dir / project_id
+        if not project_dir.exists():
+            return {"success": False, "message": "Project not found"}
+        
+        images_dir = project_dir / "images"
+        deleted = 0
+        names = [Path(name).name for name in image_names]
+        for name in names:
+            image_path = images_dir / name
+            if image_path.exists():
+                image_path.unlink()
+                deleted += 1
+        
+        # 删除图片记录及其标注，并更新项目时间
+        self.store.remove_images(project_id, names, images_dir.stat().st_mtime_ns)
+        return {"success": True, "deleted": deleted}
+    
     def get_image_path(self, project_id: str, image_name: str) -> Optional[Path]:
         """获取图片路径"""
         project_dir = self.projects_dir / project_id
@@ -431,23 +966,68 @@ results = model.train(data='data.yaml', epochs=100)
             return image_path
         return None
     
-    def auto_annotate_with_model(
+    def _predict_batches(
+        self,
+        model,
+        image_files: List[Path],
+        confidence: float,
+        iou_threshold: float,
+        batch_size: int
+    ) -> Iterator[Tuple[List[Tuple[Path, Any]], List[Path]]]:
+        """
+        解码线程池 + 批量推理
+        
+        下一批图片在线程池中解码的同时对当前批推理，推理不等待磁盘读取和解码。
+        
+        Yields:
+            ([(图片路径, 推理结果)], 本批无法读取的图片)
+        """
+        batches = [image_files[i:i + batch_size] for i in range(0, len(image_files), batch_size)]
+        if not batches:
+            return
+        
+        def decode(path: Path) -> Optional[np.ndarray]:
+            return cv2.imread(str(path))
+        
+        with ThreadPoolExecutor(max_workers=max(1, settings.IMAGE_WORKERS)) as pool:
+            pending = pool.map(decode, batches[0])
+            for index, batch in enumerate(batches):
+                images = list(pending)
+                if index + 1 < len(batches):
+                    pending = pool.map(decode, batches[index + 1])
+                
+                valid = [i for i, image in enumerate(images) if image is not None]
+                results = model.predict(
+                    [images[i] for i in valid],
+                    conf=confidence,
+                    iou=iou_threshold,
+                    verbose=False
+                ) if valid else []
+                unreadable = [path for path, image in zip(batch, images) if image is None]
+                yield [(batch[i], result) for i, result in zip(valid, results)], unreadable
+    
+    def submit_auto_annotate(
         self,
         project_id: str,
         model_path: str,
         confidence: float = 0.25,
         iou_threshold: float = 0.45,
         filter_classes: Optional[List[str]] = None,
-        merge_mode: str = "replace"  # replace, append, or smart_merge
-    ) -> Dict[str, Any]:
+        merge_mode: str = "replace",  # replace, append, or smart_merge
+        batch_size: int = 16,
+        match_method: str = "greedy"
+    ) -> JobStatus:
         """
-        使用 YOLO 模型自动标注项目图片 (增强版)
+        提交自动标注任务（后台执行，同一项目同时只运行一个）
         
         参考 Roboflow 的自动标注功能:
         - 支持类别过滤
         - 支持多种合并模式
         - 智能去重
-        - 批量处理优化
+        - 批量推理：解码线程池与批量推理流水线执行
+        
+        每批结果与任务进度在同一事务中写入数据库，服务重启后未完成的任务从断点继续
+        （resume_auto_annotate_jobs），已标注的图片不会重复推理。
         
         Args:
             project_id: 项目ID
@@ -456,218 +1036,266 @@ results = model.train(data='data.yaml', epochs=100)
             iou_threshold: IOU 阈值
             filter_classes: 只保留指定类别的检测结果
             merge_mode: 标注合并模式 (replace: 替换, append: 追加, smart_merge: 智能合并)
+            batch_size: 每次推理的图片数
+            match_method: smart_merge 时新旧标注框的匹配方式 (greedy / hungarian，后者需要 scipy)
             
-        Returns:
-            标注结果统计
+        Raises:
+            FileNotFoundError: 项目不存在
+            ValueError: 参数无效
         """
-        project_dir = self.projects_dir / project_id
-        if not project_dir.exists():
-            return {"success": False, "message": "Project not found"}
+        if not self.store.has_project(project_id):
+            raise FileNotFoundError("Project not found")
+        if merge_mode not in MERGE_MODES:
+            raise ValueError(f"Invalid merge_mode: {merge_mode}, expected one of {', '.join(MERGE_MODES)}")
+        if match_method not in MATCH_METHODS:
+            raise ValueError(f"Invalid match_method: {match_method}, expected one of {', '.join(MATCH_METHODS)}")
+        if match_method == "hungarian" and not SCIPY_AVAILABLE:
+            raise ValueError("Hungarian matching requires: pip install scipy")
+        
+        params = {
+            "model_path": model_path,
+            "confidence": confidence,
+            "iou_threshold": iou_threshold,
+            "filter_classes": filter_classes,
+            "merge_mode": merge_mode,
+            "batch_size": max(1, batch_size),
+            "match_method": match_method
+        }
+        return job_service.submit(
+            "auto_annotate", self._auto_annotate_job, project_id, params,
+            dedupe_key=f"auto_annotate:{project_id}", cancellable=True
+        )
+    
+    def resume_auto_annotate(self, job_id: str) -> JobStatus:
+        """
+        从断点继续中断、失败或取消的自动标注任务（沿用原任务ID）
+        
+        Raises:
+            FileNotFoundError: 任务不存在
+            ValueError: 任务已完成
+        """
+        job = self.store.get_annotate_job(job_id)
+        if not job:
+            raise FileNotFoundError("Job not found")
+        if job["status"] == "completed":
+            raise ValueError("Job is already completed")
+        return job_service.submit(
+            "auto_annotate", self._auto_annotate_job, job["project_id"], job["params"],
+            dedupe_key=f"auto_annotate:{job['project_id']}", job_id=job_id, cancellable=True
+        )
+    
+    def resume_auto_annotate_jobs(self) -> List[JobStatus]:
+        """服务启动时恢复上次运行中被中断的自动标注任务"""
+        resumed = []
+        for job in self.store.list_annotate_jobs("running"):
+            print(f"恢复自动标注任务: {job['job_id']} (项目 {job['project_id']})")
+            resumed.append(self.resume_auto_annotate(job["job_id"]))
+        return resumed
+    
+    def _auto_annotate_job(self, ctx: JobContext, project_id: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        from ultralytics import YOLO
+        
+        model = YOLO(params["model_path"])
+        filter_classes = params["filter_classes"]
+        merge_mode = params["merge_mode"]
+        # 早于该参数创建的任务恢复时使用默认的贪心匹配
+        match_method = params.get("match_method", "greedy")
+        
+        # 类别过滤转换为类别编号
+        classes = list(model.names.values())
+        allowed_ids = None
+        if filter_classes:
+            classes = [c for c in classes if c in filter_classes]
+            allowed_ids = np.array([cid for cid, name in model.names.items() if name in filter_classes])
+        
+        job = self.store.get_annotate_job(ctx.job_id)
+        if job is None:
+            stats = {
+                "processed": 0, "unreadable_images": 0, "total_detections": 0,
+                "skipped_detections": 0, "class_statistics": {}
+            }
+            self.store.create_annotate_job(ctx.job_id, project_id, params, stats, classes)
+            done = set()
+        else:
+            stats = job["stats"]
+            done = self.store.get_annotate_done(ctx.job_id)
+            self.store.set_annotate_job_status(ctx.job_id, "running")
+        
+        image_files = [f for f in self._list_image_files(project_id) if f.name not in done]
+        total = len(done) + len(image_files)
+        resumed_from = stats["processed"]
+        start_time = time.time()
+        ctx.update(progress=resumed_from / max(total, 1) * 100, message=f"Annotating {total} images")
         
         try:
-            from ultralytics import YOLO
-            
-            # 加载模型
-            model = YOLO(model_path)
-            
-            # 获取所有图片
-            images_dir = project_dir / "images"
-            image_files = list(images_dir.glob("*"))
-            image_files = [f for f in image_files if f.suffix.lower() in ['.jpg', '.jpeg', '.png', '.bmp', '.webp']]
-            
-            # 加载现有标注（如果需要合并）
-            existing_annotations = {}
-            if merge_mode in ["append", "smart_merge"]:
-                annotations_file = project_dir / "annotations" / "annotations.json"
-                if annotations_file.exists():
-                    with open(annotations_file, 'r', encoding='utf-8') as f:
-                        existing_annotations = json.load(f)
-            
-            annotations_dict = {}
-            total_detections = 0
-            skipped_detections = 0
-            class_stats = {}
-            
-            # 批量推理优化 - 使用更大的batch处理
-            print(f"🚀 开始自动标注 {len(image_files)} 张图片...")
-            
-            # 对每张图片进行推理
-            for idx, img_path in enumerate(image_files):
-                if (idx + 1) % 10 == 0:
-                    print(f"进度: {idx + 1}/{len(image_files)} 张图片已处理")
-                
-                # YOLO 推理
-                results = model.predict(
-                    str(img_path),
-                    conf=confidence,
-                    iou=iou_threshold,
-                    verbose=False
-                )
-                
-                # 转换为 supervision Detections
-                detections, _ = supervision_service.yolo_results_to_detections(
-                    results,
-                    class_names=model.names
-                )
-                
-                # 转换为标注格式
-                image = cv2.imread(str(img_path))
-                h, w = image.shape[:2]
-                
-                image_annotations = []
+            for batch_results, unreadable in self._predict_batches(
+                model, image_files, params["confidence"], params["iou_threshold"], params["batch_size"]
+            ):
+                # 合并模式只需要读取本批图片的现有标注
+                existing_annotations = {}
+                if merge_mode in ("append", "smart_merge"):
+                    existing_annotations = self.store.get_annotations(
+                        project_id, [img_path.name for img_path, _ in batch_results]
+                    )
                 
-                for i in range(len(detections)):
-                    class_id = detections.class_id[i]
-                    class_name = model.names[class_id]
+                annotations_dict = {}
+                for img_path, result in batch_results:
+                    detections = sv.Detections.from_ultralytics(result)
                     
                     # 类别过滤
-                    if filter_classes and class_name not in filter_classes:
-                        skipped_detections += 1
-                        continue
+                    if allowed_ids is not None:
+                        keep = np.isin(detections.class_id, allowed_ids)
+                        stats["skipped_detections"] += int((~keep).sum())
+                        detections = detections[keep]
                     
-                    xyxy = detections.xyxy[i]
-                    confidence_score = detections.confidence[i]
+                    # 转换为标注格式（图片尺寸取自推理结果）
+                    h, w = result.orig_shape[:2]
+                    image_annotations = _detections_to_annotations(detections, w, h, model.names)
+                    stats["total_detections"] += len(image_annotations)
                     
-                    # 转换为归一化坐标
-                    x = float(xyxy[0] / w)
-                    y = float(xyxy[1] / h)
-                    width = float((xyxy[2] - xyxy[0]) / w)
-                    height = float((xyxy[3] - xyxy[1]) / h)
+                    # 统计类别
+                    for class_id, count in zip(*np.unique(detections.class_id, return_counts=True)):
+                        class_name = model.names[int(class_id)]
+                        stats["class_statistics"][class_name] = stats["class_statistics"].get(class_name, 0) + int(count)
                     
-                    annotation = {
-                        'class': class_name,
-                        'class_id': int(class_id),
-                        'x': x,
-                        'y': y,
-                        'width': width,
-                        'height': height,
-                        'confidence': float(confidence_score),
-                        'auto_annotated': True  # 标记为自动标注
-                    }
-                    image_annotations.append(annotation)
-                    total_detections += 1
+                    # 合并模式处理
+                    if merge_mode == "append" and img_path.name in existing_annotations:
+                        # 追加模式：保留现有标注，添加新标注
+                        image_annotations = existing_annotations[img_path.name] + image_annotations
+                    elif merge_mode == "smart_merge" and img_path.name in existing_annotations:
+                        # 智能合并：去除重复的框，保留高置信度的
+                        image_annotations = self._smart_merge_annotations(
+                            existing_annotations[img_path.name],
+                            image_annotations,
+                            iou_threshold=0.5,
+                            method=match_method
+                        )
                     
-                    # 统计类别
-                    class_stats[class_name] = class_stats.get(class_name, 0) + 1
+                    annotations_dict[img_path.name] = image_annotations
                 
-                # 合并模式处理
-                if merge_mode == "append" and img_path.name in existing_annotations:
-                    # 追加模式：保留现有标注，添加新标注
-                    image_annotations = existing_annotations[img_path.name] + image_annotations
-                elif merge_mode == "smart_merge" and img_path.name in existing_annotations:
-                    # 智能合并：去除重复的框，保留高置信度的
-                    image_annotations = self._smart_merge_annotations(
-                        existing_annotations[img_path.name],
-                        image_annotations,
-                        iou_threshold=0.5
-                    )
+                # 检查点：本批标注、已完成图片和累计统计在同一事务中写入（无法读取的图片保留原有标注）
+                stats["processed"] += len(batch_results) + len(unreadable)
+                stats["unreadable_images"] += len(unreadable)
+                self.store.checkpoint_annotate_job(
+                    ctx.job_id, project_id, annotations_dict,
+                    list(annotations_dict) + [img_path.name for img_path in unreadable], stats
+                )
                 
-                annotations_dict[img_path.name] = image_annotations
-            
-            # 保存标注
-            classes = list(model.names.values())
-            if filter_classes:
-                classes = [c for c in classes if c in filter_classes]
-            
-            self.save_annotations(project_id, annotations_dict, classes)
-            
-            return {
-                "success": True,
-                "message": "Auto annotation completed successfully",
-                "total_images": len(image_files),
-                "total_detections": total_detections,
-                "skipped_detections": skipped_detections,
-                "classes": classes,
-                "class_statistics": class_stats,
-                "merge_mode": merge_mode
-            }
-            
-        except Exception as e:
-            print(f"Error in auto annotation: {e}")
-            import traceback
-            traceback.print_exc()
-            return {
-                "success": False,
-                "message": str(e)
-            }
+                elapsed = time.time() - start_time
+                ctx.update(
+                    progress=stats["processed"] / max(total, 1) * 100,
+                    message=f"Processed {stats['processed']}/{total} images "
+                            f"({(stats['processed'] - resumed_from) / max(elapsed, 1e-6):.1f} img/s)"
+                )
+                ctx.check_cancelled()
+        except JobCancelled:
+            self.store.set_annotate_job_status(ctx.job_id, "cancelled")
+            raise
+        except Exception:
+            self.store.set_annotate_job_status(ctx.job_id, "failed")
+            raise
+        
+        self.store.set_annotate_job_status(ctx.job_id, "completed")
+        elapsed = time.time() - start_time
+        return {
+            "project_id": project_id,
+            "message": "Auto annotation completed successfully",
+            "total_images": total,
+            "unreadable_images": stats["unreadable_images"],
+            "total_detections": stats["total_detections"],
+            "skipped_detections": stats["skipped_detections"],
+            "classes": classes,
+            "class_statistics": stats["class_statistics"],
+            "merge_mode": merge_mode,
+            "resumed_from": resumed_from,
+            "elapsed": round(elapsed, 2),
+            "images_per_second": round((stats["processed"] - resumed_from) / max(elapsed, 1e-6), 2)
+        }
     
     def _smart_merge_annotations(
         self,
         existing: List[Dict[str, Any]],
         new: List[Dict[str, Any]],
-        iou_threshold: float = 0.5
+        iou_threshold: float = 0.5,
+        method: str = "greedy"
     ) -> List[Dict[str, Any]]:
         """
         智能合并标注 - 去除重复框，保留高置信度的
         
+        新旧标注按类别一对一匹配（见 backend.utils.box_matching），匹配上的框对保留置信度更高的一个，
+        未匹配的新框追加到末尾。
+        
         Args:
             existing: 现有标注
             new: 新标注
             iou_threshold: IOU阈值，超过此值认为是重复
+            method: 匹配方式，greedy 或 hungarian
             
         Returns:
             合并后的标注列表
         """
-        def calculate_iou(box1: Dict, box2: Dict) -> float:
-            """计算两个框的IOU"""
-            x1_min = box1['x']
-            y1_min = box1['y']
-            x1_max = box1['x'] + box1['width']
-            y1_max = box1['y'] + box1['height']
-            
-            x2_min = box2['x']
-            y2_min = box2['y']
-            x2_max = box2['x'] + box2['width']
-            y2_max = box2['y'] + box2['height']
-            
-            # 计算交集
-            x_min = max(x1_min, x2_min)
-            y_min = max(y1_min, y2_min)
-            x_max = min(x1_max, x2_max)
-            y_max = min(y1_max, y2_max)
-            
-            if x_max < x_min or y_max < y_min:
-                return 0.0
-            
-            intersection = (x_max - x_min) * (y_max - y_min)
-            
-            # 计算并集
-            area1 = box1['width'] * box1['height']
-            area2 = box2['width'] * box2['height']
-            union = area1 + area2 - intersection
-            
-            return intersection / union if union > 0 else 0.0
-        
-        # 合并后的结果
         merged = list(existing)
+        if not existing or not new:
+            return merged + list(new)
         
-        for new_ann in new:
-            # 检查是否与现有标注重复
-            is_duplicate = False
-            for i, exist_ann in enumerate(merged):
-                # 只比较同类别的框
-                if exist_ann['class'] == new_ann['class']:
-                    iou = calculate_iou(exist_ann, new_ann)
-                    if iou > iou_threshold:
-                        is_duplicate = True
-                        # 保留置信度更高的
-                        if new_ann.get('confidence', 0) > exist_ann.get('confidence', 0):
-                            merged[i] = new_ann
-                        break
-            
-            # 如果不是重复的，添加到结果中
-            if not is_duplicate:
-                merged.append(new_ann)
+        exist_idx, new_idx, _ = match_annotations(existing, new, iou_threshold, method)
+        for i, j in zip(exist_idx, new_idx):
+            if new[j].get('confidence', 0) > existing[i].get('confidence', 0):
+                merged[i] = new[j]
         
+        unmatched = np.ones(len(new), dtype=bool)
+        unmatched[new_idx] = False
+        merged.extend(new[j] for j in np.flatnonzero(unmatched))
         return merged
     
+    def compare_projects(
+        self,
+        project_id: str,
+        other_project_id: str,
+        iou_threshold: float = 0.5,
+        method: str = "greedy"
+    ) -> Dict[str, Any]:
+        """
+        以 project_id 的标注为基准，比较另一个项目中同名图片的标注
+        
+        Args:
+            project_id: 基准项目ID
+            other_project_id: 待比较的项目ID
+            iou_threshold: IOU阈值，超过此值的同类别框视为一致
+            method: 匹配方式，greedy 或 hungarian
+            
+        Returns:
+            总体和各类别的匹配数、漏标数、多标数、precision / recall / 平均 IoU，以及存在差异的图片
+        """
+        for pid in (project_id, other_project_id):
+            if not self.store.has_project(pid):
+                raise FileNotFoundError(f"Project not found: {pid}")
+        if method not in MATCH_METHODS:
+            raise ValueError(f"Unsupported match method: {method}")
+        
+        reference = self._load_annotations(project_id)
+        candidate = self._load_annotations(other_project_id)
+        # 只比较两个项目都有的图片，未标注的图片按空标注处理
+        common = (
+            {p.name for p in self._list_image_files(project_id)}
+            & {p.name for p in self._list_image_files(other_project_id)}
+        )
+        result = compare_annotation_sets(
+            {name: reference.get(name, []) for name in common},
+            {name: candidate.get(name, []) for name in common},
+            iou_threshold=iou_threshold,
+            method=method
+        )
+        return {"project_id": project_id, "other_project_id": other_project_id, **result}
+    
     def batch_auto_annotate(
         self,
         project_id: str,
         image_names: List[str],
         model_path: str,
         confidence: float = 0.25,
-        iou_threshold: float = 0.45
+        iou_threshold: float = 0.45,
+        batch_size: int = 16
     ) -> Dict[str, Any]:
         """
         批量自动标注指定图片（增量标注）
@@ -678,6 +1306,7 @@ results = model.train(data='data.yaml', epochs=100)
             model_path: 模型路径
             confidence: 置信度阈值
             iou_threshold: IOU阈值
+            batch_size: 每次推理的图片数
             
         Returns:
             标注结果
@@ -691,71 +1320,33 @@ results = model.train(data='data.yaml', epochs=100)
             
             model = YOLO(model_path)
             images_dir = project_dir / "images"
+            image_files = [images_dir / name for name in image_names if (images_dir / name).exists()]
             
-            # 加载现有标注
-            project = self.get_project(project_id)
-            if not project:
-                return {"success": False, "message": "Failed to load project"}
-            
-            annotations_dict = project.get('annotations', {})
+            annotations_dict = {}
             total_detections = 0
+            start_time = time.time()
             
-            for img_name in image_names:
-                img_path = images_dir / img_name
-                if not img_path.exists():
-                    continue
-                
-                # YOLO推理
-                results = model.predict(
-                    str(img_path),
-                    conf=confidence,
-                    iou=iou_threshold,
-                    verbose=False
-                )
-                
-                detections, _ = supervision_service.yolo_results_to_detections(
-                    results,
-                    class_names=model.names
-                )
-                
-                # 转换标注
-                image = cv2.imread(str(img_path))
-                h, w = image.shape[:2]
-                
-                image_annotations = []
-                for i in range(len(detections)):
-                    class_id = detections.class_id[i]
-                    xyxy = detections.xyxy[i]
-                    confidence_score = detections.confidence[i]
-                    
-                    x = float(xyxy[0] / w)
-                    y = float(xyxy[1] / h)
-                    width = float((xyxy[2] - xyxy[0]) / w)
-                    height = float((xyxy[3] - xyxy[1]) / h)
-                    
-                    annotation = {
-                        'class': model.names[class_id],
-                        'class_id': int(class_id),
-                        'x': x,
-                        'y': y,
-                        'width': width,
-                        'height': height,
-                        'confidence': float(confidence_score),
-                        'auto_annotated': True
-                    }
-                    image_annotations.append(annotation)
-                    total_detections += 1
-                
-                annotations_dict[img_name] = image_annotations
+            for batch_results, _ in self._predict_batches(model, image_files, confidence, iou_threshold, batch_size):
+                for img_path, result in batch_results:
+                    h, w = result.orig_shape[:2]
+                    image_annotations = _detections_to_annotations(
+                        sv.Detections.from_ultralytics(result), w, h, model.names
+                    )
+                    annotations_dict[img_path.name] = image_annotations
+                    total_detections += len(image_annotations)
+            
+            elapsed = time.time() - start_time
             
-            # 保存标注
+            # 只写入本次标注的图片，其他图片的标注保持不变
             classes = list(model.names.values())
-            self.save_annotations(project_id, annotations_dict, classes)
+            self.store.set_image_annotations(project_id, annotations_dict, classes)
             
             return {
                 "success": True,
-                "message": f"Annotated {len(image_names)} images",
-                "total_detections": total_detections
+                "message": f"Annotated {len(annotations_dict)} images",
+                "total_detections": total_detections,
+                "elapsed": round(elapsed, 2),
+                "images_per_second": round(len(image_files) / max(elapsed, 1e-6), 2)
             }
             
         except Exception as e:
@@ -771,143 +1362,155 @@ results = model.train(data='data.yaml', epochs=100)
         """
         获取标注统计信息
         
+        读取数据库中增量维护的计数，不加载标注。
+        
         Args:
             project_id: 项目ID
             
         Returns:
             统计信息
         """
-        project = self.get_project(project_id)
-        if not project:
+        if not self.store.has_project(project_id):
             return {"success": False, "message": "Project not found"}
         
-        annotations = project.get('annotations', {})
-        classes = project.get('classes', [])
-        
-        total_images = len(project.get('images', []))
-        annotated_images = len([k for k, v in annotations.items() if v])
-        total_annotations = sum(len(anns) for anns in annotations.values())
-        
-        # 类别统计
-        class_counts = {cls: 0 for cls in classes}
-        auto_annotated_count = 0
-        manual_annotated_count = 0
-        
-        for anns in annotations.values():
-            for ann in anns:
-                class_name = ann.get('class', 'unknown')
-                if class_name in class_counts:
-                    class_counts[class_name] += 1
-                
-                if ann.get('auto_annotated', False):
-                    auto_annotated_count += 1
-                else:
-                    manual_annotated_count += 1
+        # 图片目录在平台之外被修改时先同步图片列表（只比较目录修改时间）
+        self._sync_images(project_id)
+        stats = self.store.get_stats(project_id)
+        classes = self._load_classes(project_id)
         
+        total_images = stats["total_images"]
+        annotated_images = stats["annotated_images"]
         return {
             "success": True,
             "total_images": total_images,
             "annotated_images": annotated_images,
             "unannotated_images": total_images - annotated_images,
-            "total_annotations": total_annotations,
-            "auto_annotated": auto_annotated_count,
-            "manual_annotated": manual_annotated_count,
-            "class_distribution": class_counts,
+            "total_annotations": stats["auto_annotations"] + stats["manual_annotations"],
+            "auto_annotated": stats["auto_annotations"],
+            "manual_annotated": stats["manual_annotations"],
+            "class_distribution": {cls: stats["class_counts"].get(cls, 0) for cls in classes},
             "completion_rate": f"{(annotated_images / total_images * 100):.1f}%" if total_images > 0 else "0%"
         }
     
-    def visualize_annotations(
+    def rebuild_statistics(self, project_id: str) -> Dict[str, Any]:
+        """
+        重新计算项目的统计计数（一致性检查）
+        
+        Returns:
+            consistent 为重算前的计数是否正确，before / after 为重算前后的计数
+        """
+        if not self.store.has_project(project_id):
+            raise FileNotFoundError(f"Project not found: {project_id}")
+        self._sync_images(project_id)
+        return {"project_id": project_id, **self.store.rebuild_stats(project_id)}
+    
+    def prepare_render(
         self,
         project_id: str,
         image_name: str,
-        output_dir: Optional[str] = None
-    ) -> Optional[Path]:
+        max_side: Optional[int] = None,
+        quality: int = 85
+    ) -> Tuple[str, Callable[[], bytes]]:
         """
-        使用 supervision 可视化标注
+        准备标注可视化（supervision 绘制，渲染为内存中的 JPEG）
+        
+        ETag 只由图片版本、标注版本、类别、输出尺寸和质量计算，不需要渲染：客户端缓存仍有效时
+        调用方可以直接返回 304。调用 render() 时在 render_service 的线程池中渲染，结果以同一个键
+        缓存在内存中（LRU，上限 RENDER_CACHE_SIZE），不写入磁盘。没有标注的图片返回原图。
         
         Args:
             project_id: 项目ID
             image_name: 图片名称
-            output_dir: 输出目录（可选）
+            max_side: 输出图片最长边（可选，默认原尺寸）；JPEG 按 1/2、1/4、1/8 缩放解码
+            quality: JPEG 质量 (1-100)
             
         Returns:
-            可视化图片路径
+            (ETag, render)，render() 返回 JPEG 字节（阻塞直到渲染完成）
         """
-        project = self.get_project(project_id)
-        if not project:
-            return None
+        if max_side is not None and not 16 <= max_side <= 8192:
+            raise ValueError("max_side must be between 16 and 8192")
+        if not 1 <= quality <= 100:
+            raise ValueError("quality must be between 1 and 100")
+        if not self.store.has_project(project_id):
+            raise FileNotFoundError(f"Project not found: {project_id}")
+        image_path = preview_service.resolve_project_image(project_id, image_name)
+        if not image_path:
+            raise FileNotFoundError(f"Image not found: {image_name}")
         
-        try:
-            # 加载图片
-            image_path = self.get_image_path(project_id, image_name)
-            if not image_path:
-                return None
-            
-            image = cv2.imread(str(image_path))
+        classes = self._load_classes(project_id)
+        version = self.store.get_image_versions(project_id, [image_name]).get(image_name, 0)
+        key = hashlib.sha1(
+            f"{project_id}:{image_name}:{source_version(image_path)}:{version}:"
+            f"{json.dumps(classes)}:{max_side}:{quality}".encode('utf-8')
+        ).hexdigest()
+        
+        def render() -> bytes:
+            # 标注在渲染时读取：版本号在读取之后才变化时，新的请求会使用新的缓存键
+            annotations = self.store.get_annotations(project_id, [image_name]).get(image_name, [])
+            return self._render_annotated_jpeg(image_path, annotations, classes, max_side, quality)
+        
+        return f'"{key[:32]}"', lambda: render_service.get(key, render)
+    
+    def _render_annotated_jpeg(
+        self,
+        image_path: Path,
+        annotations: List[Dict[str, Any]],
+        classes: List[str],
+        max_side: Optional[int],
+        quality: int
+    ) -> bytes:
+        """解码图片（按需缩小）、绘制标注框并编码为 JPEG"""
+        flag = cv2.IMREAD_COLOR
+        if max_side is not None:
+            # 尺寸从文件头读取，然后只解码一次：按 2 的幂缩小解码（JPEG 只解码需要的分辨率），结果不小于目标尺寸
+            try:
+                with Image.open(image_path) as header:
+                    longest = max(header.size)
+            except Exception:
+                longest = 0
+            for factor, reduced_flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                                         (2, cv2.IMREAD_REDUCED_COLOR_2)):
+                if longest // factor >= max_side:
+                    flag = reduced_flag
+                    break
+        
+        image = cv2.imread(str(image_path), flag)
+        if image is None:
+            raise ValueError(f"Cannot read image: {image_path.name}")
+        
+        if max_side is not None:
             h, w = image.shape[:2]
-            
-            # 获取标注
-            annotations = project['annotations'].get(image_name, [])
-            if not annotations:
-                return None
-            
-            # 转换为 supervision Detections
-            xyxy_list = []
-            class_ids = []
-            confidences = []
-            
-            for ann in annotations:
-                # 从归一化坐标转换回像素坐标
-                x = ann['x'] * w
-                y = ann['y'] * h
-                width = ann['width'] * w
-                height = ann['height'] * h
-                
-                x1 = x
-                y1 = y
-                x2 = x + width
-                y2 = y + height
-                
-                xyxy_list.append([x1, y1, x2, y2])
-                class_ids.append(ann.get('class_id', 0))
-                confidences.append(ann.get('confidence', 1.0))
-            
-            detections = sv.Detections(
-                xyxy=np.array(xyxy_list),
-                class_id=np.array(class_ids),
-                confidence=np.array(confidences)
-            )
-            
-            # 生成标签
+            scale = max_side / max(h, w)
+            if scale < 1:
+                image = cv2.resize(image, (max(1, round(w * scale)), max(1, round(h * scale))),
+                                   interpolation=cv2.INTER_AREA)
+        
+        if annotations:
+            # 从归一化坐标转换回像素坐标
+            h, w = image.shape[:2]
+            boxes = np.array(
+                [[ann['x'], ann['y'], ann['width'], ann['height']] for ann in annotations], dtype=np.float64
+            ) * np.array([w, h, w, h])
+            boxes[:, 2:] += boxes[:, :2]
+            class_ids = np.array([
+                classes.index(ann['class']) if ann.get('class') in classes else ann.get('class_id') or 0
+                for ann in annotations
+            ], dtype=int)
+            confidences = np.array([
+                ann['confidence'] if ann.get('confidence') is not None else 1.0 for ann in annotations
+            ], dtype=np.float64)
+            
+            detections = sv.Detections(xyxy=boxes, class_id=class_ids, confidence=confidences)
             labels = [
-                f"{project['classes'][class_id]} {conf:.2f}"
-                for class_id, conf in zip(class_ids, confidences)
+                f"{ann.get('class', 'unknown')} {conf:.2f}"
+                for ann, conf in zip(annotations, confidences)
             ]
-            
-            # 可视化
-            annotated_image = supervision_service.annotate_image(
-                image,
-                detections,
-                labels
-            )
-            
-            # 保存
-            if output_dir is None:
-                output_dir = self.projects_dir / project_id / "visualizations"
-            else:
-                output_dir = Path(output_dir)
-            
-            output_dir.mkdir(parents=True, exist_ok=True)
-            output_path = output_dir / f"annotated_{image_name}"
-            cv2.imwrite(str(output_path), annotated_image)
-            
-            return output_path
-            
-        except Exception as e:
-            print(f"Error visualizing annotations: {e}")
-            import traceback
-            traceback.print_exc()
-            return None
+            image = supervision_service.annotate_image(image, detections, labels)
+        
+        ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ok:
+            raise ValueError(f"Failed to encode image: {image_path.name}")
+        return encoded.tobytes()
 
 
 # 全局服务实例
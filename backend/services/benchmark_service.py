@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+模型格式基准测试服务
+
+在当前主机上把模型导出为各个 CPU 推理格式，使用 datasets/coco8 测量：
+- 冷启动时间（加载模型 + 首次推理）
+- 预热后的单批延迟 p50 / p99
+- 不同 batch size 和图像尺寸下的吞吐量
+- 与 PyTorch 原始模型相比的 mAP 变化
+
+结果按主机名保存，可选择把最快且精度不变的格式设为该模型的默认推理引擎。
+"""
+import json
+import time
+import socket
+import threading
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+from datetime import datetime
+
+import numpy as np
+
+from config.config import settings
+from backend.models.schemas import ExportConfig, BenchmarkRequest, JobStatus
+from backend.services.job_service import job_service, JobContext
+from backend.services.export_service import export_service
+from backend.services.model_index_service import model_index_service
+
+
+# CPU 上可用的推理格式（torch 为原始 .pt 模型，作为精度基准）
+CPU_FORMATS = ["torch", "torchscript", "onnx", "openvino"]
+
+# 推理服务逐张处理请求：服务候选始终以 batch=1 导出和测量，精度也在 batch=1 下验证
+SERVING_BATCH_SIZE = 1
+
+
+class BenchmarkService:
+    """模型格式基准测试与推理引擎选择"""
+
+    def __init__(self):
+        self.host = socket.gethostname()
+        self.results_dir = settings.DATA_DIR / "benchmarks" / self.host
+        self.results_dir.mkdir(parents=True, exist_ok=True)
+        self.engines_file = self.results_dir / "engines.json"
+        self.dataset_dir = settings.BENCHMARK_DATASET_DIR
+        self._lock = threading.Lock()
+        self._engines = self._load_engines()
+
+    # ==================== 推理引擎 ====================
+
+    def _load_engines(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.engines_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"Error loading serving engines: {e}")
+            return {}
+
+    def _save_engines(self):
+        tmp_file = self.engines_file.with_suffix(".tmp")
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self._engines, f, ensure_ascii=False, indent=2)
+        tmp_file.replace(self.engines_file)
+
+    def get_serving_engine(self, model_name: str) -> Optional[Dict[str, Any]]:
+        """获取模型在本机的默认推理引擎（产物已被删除时返回 None）"""
+        engine = self._engines.get(model_name)
+        if engine and Path(engine["artifact"]).exists():
+            return engine
+        return None
+
+    def list_serving_engines(self) -> Dict[str, Dict[str, Any]]:
+        """列出本机所有默认推理引擎"""
+        return dict(self._engines)
+
+    def set_serving_engine(self, model_name: str, engine: Dict[str, Any]):
+        """设置模型的默认推理引擎"""
+        with self._lock:
+            self._engines[model_name] = {**engine, "selected_at": datetime.now().isoformat()}
+            self._save_engines()
+
+    def clear_serving_engine(self, model_name: str) -> bool:
+        """恢复使用原始 .pt 模型推理"""
+        with self._lock:
+            if self._engines.pop(model_name, None) is None:
+                return False
+            self._save_engines()
+            return True
+
+    # ==================== 基准测试 ====================
+
+    def get_results(self, model_name: str) -> Optional[Dict[str, Any]]:
+        """读取本机的基准测试结果"""
+        result_file = self.results_dir / f"{Path(model_name).stem}.json"
+        if not result_file.exists():
+            return None
+        with open(result_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def submit(self, request: BenchmarkRequest) -> JobStatus:
+        """提交基准测试任务（同一模型同时只运行一个）"""
+        return job_service.submit(
+            "benchmark",
+            self._benchmark_job,
+            request,
+            dedupe_key=f"benchmark:{request.model_name}"
+        )
+
+    def load_images(self) -> List[np.ndarray]:
+        """加载基准测试图片（coco8 验证集）"""
+        import cv2
+
+        images = []
+        for img_path in sorted((self.dataset_dir / "images" / "val").glob("*.jpg")):
+            image = cv2.imread(str(img_path))
+            if image is not None:
+                images.append(image)
+        if not images:
+            raise FileNotFoundError(f"No benchmark images found in {self.dataset_dir}")
+        return images
+
+    def _write_data_yaml(self, classes: List[str]) -> Path:
+        """生成 coco8 的 data.yaml（类别名取自被测模型）"""
+        data_yaml = self.results_dir / "coco8.yaml"
+        content = f"path: {self.dataset_dir}\ntrain: images/train\nval: images/val\n\nnames:\n"
+        for i, name in enumerate(classes):
+            content += f"  {i}: {json.dumps(name, ensure_ascii=False)}\n"
+        with open(data_yaml, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return data_yaml
+
+    def measure(
+        self,
+        model_path: str,
+        task: Optional[str],
+        images: List[np.ndarray],
+        img_size: int,
+        batch_size: int,
+        iterations: int,
+        data_yaml: Optional[Path] = None
+    ) -> Dict[str, Any]:
+        """测量单个 (格式, 图像尺寸, batch) 组合"""
+        from ultralytics import YOLO
+
+        batch = [images[i % len(images)] for i in range(batch_size)]
+
+        # 冷启动：加载模型并完成第一次推理
+        start = time.perf_counter()
+        model = YOLO(model_path, task=task)
+        model.predict(batch, imgsz=img_size, device="cpu", verbose=False)
+        cold_start = time.perf_counter() - start
+
+        # 预热
+        for _ in range(2):
+            model.predict(batch, imgsz=img_size, device="cpu", verbose=False)
+
+        latencies = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            model.predict(batch, imgsz=img_size, device="cpu", verbose=False)
+            latencies.append(time.perf_counter() - start)
+        latencies = np.array(latencies) * 1000  # ms
+
+        result = {
+            "cold_start_s": round(cold_start, 4),
+            "latency_p50_ms": round(float(np.percentile(latencies, 50)), 3),
+            "latency_p99_ms": round(float(np.percentile(latencies, 99)), 3),
+            "throughput_ips": round(batch_size / (float(latencies.mean()) / 1000), 2),
+        }
+
+        # 精度只需在 batch=1 时验证一次
+        if data_yaml is not None:
+            metrics = model.val(
+                data=str(data_yaml),
+                imgsz=img_size,
+                batch=1,
+                device="cpu",
+                plots=False,
+                verbose=False
+            )
+            result["map50"] = round(float(metrics.box.map50), 4)
+            result["map50_95"] = round(float(metrics.box.map), 4)
+        return result
+
+    def _benchmark_job(self, ctx: JobContext, request: BenchmarkRequest) -> Dict[str, Any]:
+        """后台基准测试任务"""
+        model_path = export_service.resolve_model_path(request.model_name)
+        if not model_path.exists():
+            raise FileNotFoundError(f"Model not found: {request.model_name}")
+
+        metadata = model_index_service.get_metadata(model_path) or {}
+        task = metadata.get("task")
+        images = self.load_images()
+        data_yaml = self._write_data_yaml(metadata.get("classes") or []) if request.check_accuracy else None
+
+        formats = [f for f in request.formats if f in CPU_FORMATS]
+        batch_sizes = sorted(set(request.batch_sizes) | {SERVING_BATCH_SIZE})
+        combos = [(f, s, b) for f in formats for s in request.img_sizes for b in batch_sizes]
+        runs = []
+
+        for idx, (fmt, img_size, batch_size) in enumerate(combos):
+            ctx.update(
+                progress=idx / len(combos) * 100,
+                message=f"Benchmarking {fmt} imgsz={img_size} batch={batch_size}"
+            )
+            run = {"format": fmt, "img_size": img_size, "batch_size": batch_size}
+            try:
+                if fmt == "torch":
+                    artifact = str(model_path)
+                else:
+                    exported = export_service.export(ExportConfig(
+                        model_path=str(model_path),
+                        format=fmt,
+                        img_size=[img_size, img_size],
+                        batch_size=batch_size
+                    ))
+                    artifact = exported["export_path"]
+                run["artifact"] = artifact
+                run.update(self.measure(
+                    artifact, task, images, img_size, batch_size, request.iterations,
+                    data_yaml if batch_size == SERVING_BATCH_SIZE else None
+                ))
+            except Exception as e:
+                print(f"Benchmark {fmt} imgsz={img_size} batch={batch_size} failed: {e}")
+                run["error"] = str(e)
+            runs.append(run)
+
+        self._check_accuracy(runs, request.map_tolerance)
+
+        result = {
+            "model_name": request.model_name,
+            "model_sha256": model_index_service.file_sha256(model_path),
+            "host": self.host,
+            "task": task,
+            "created_at": datetime.now().isoformat(),
+            "runs": runs,
+            "winner": self._pick_winner(runs, request)
+        }
+
+        if request.select_engine and result["winner"]:
+            self.set_serving_engine(request.model_name, {**result["winner"], "task": task})
+            result["engine_selected"] = True
+
+        with open(self.results_dir / f"{model_path.stem}.json", 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        return result
+
+    def _check_accuracy(self, runs: List[Dict[str, Any]], tolerance: float):
+        """与同尺寸的 PyTorch 基准比较 mAP"""
+        baseline = {
+            r["img_size"]: r["map50_95"]
+            for r in runs if r["format"] == "torch" and "map50_95" in r
+        }
+        accuracy_by_key = {}
+        for r in runs:
+            if "map50_95" in r and r["img_size"] in baseline:
+                r["map_delta"] = round(r["map50_95"] - baseline[r["img_size"]], 4)
+                accuracy_by_key[(r["format"], r["img_size"])] = abs(r["map_delta"]) <= tolerance
+
+        # 其他 batch size 沿用同格式同尺寸的精度结论
+        for r in runs:
+            if "error" not in r:
+                r["accuracy_ok"] = accuracy_by_key.get((r["format"], r["img_size"]), r["format"] == "torch")
+
+    def _pick_winner(self, runs: List[Dict[str, Any]], request: BenchmarkRequest) -> Optional[Dict[str, Any]]:
+        """选出服务尺寸下 batch=1 延迟最低且精度不变的格式"""
+        serve_size = settings.DEFAULT_IMG_SIZE if settings.DEFAULT_IMG_SIZE in request.img_sizes \
+            else max(request.img_sizes)
+        candidates = [
+            r for r in runs
+            if "error" not in r and r.get("accuracy_ok")
+            and r["img_size"] == serve_size and r["batch_size"] == SERVING_BATCH_SIZE
+        ]
+        if not candidates:
+            return None
+        best = min(candidates, key=lambda r: r["latency_p50_ms"])
+        return {
+            "format": best["format"],
+            "artifact": best["artifact"],
+            "img_size": best["img_size"],
+            "batch_size": best["batch_size"],
+            "latency_p50_ms": best["latency_p50_ms"]
+        }
+
+
+# 全局服务实例
+benchmark_service = BenchmarkService()
@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+数据集目录索引服务
+
+/datasets/list 不再在每次请求时递归扫描所有图片，而是读取持久化的目录索引
+（CACHE_DIR/dataset_catalog.json）。索引记录每个数据集的类别、各划分的图片数量
+和总字节数，以及扫描过的每个目录的 mtime。
+
+目录中新增或删除文件会改变该目录的 mtime，因此检查是否需要更新时只需 stat
+目录（而不是每个文件），只有发生变化的划分才会重新扫描。
+"""
+import os
+import json
+import hashlib
+import threading
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime
+
+import yaml
+
+from config.config import settings
+from backend.utils.label_store import sync_labels, label_path_for, PackedLabels
+
+
+# 统计的图片格式
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tif', '.tiff'}
+
+# 数据集划分
+SPLITS = ("train", "val", "test")
+
+
+def _scan_images(root: Path) -> Tuple[int, int, Dict[str, int]]:
+    """
+    统计目录下的图片数量和总字节数
+
+    Returns:
+        (图片数量, 总字节数, {目录路径: mtime_ns})
+    """
+    count = 0
+    total_bytes = 0
+    dirs: Dict[str, int] = {}
+    stack = [root]
+
+    while stack:
+        directory = stack.pop()
+        try:
+            dirs[str(directory)] = directory.stat().st_mtime_ns
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(Path(entry.path))
+                    elif os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+                        count += 1
+                        total_bytes += entry.stat().st_size
+        except OSError:
+            continue
+
+    return count, total_bytes, dirs
+
+
+def mtimes_unchanged(dirs: Dict[str, int]) -> bool:
+    """检查记录的目录（或文件）mtime 是否都没有变化"""
+    for path, mtime_ns in dirs.items():
+        try:
+            if os.stat(path).st_mtime_ns != mtime_ns:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+class DatasetCatalogService:
+    """数据集目录索引"""
+
+    def __init__(self):
+        self.catalog_file = settings.CACHE_DIR / "dataset_catalog.json"
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = self._load_catalog()
+
+    def _load_catalog(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.catalog_file, 'r', encoding='utf-8') as f:
+                return json.load(f).get("datasets", {})
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"Error loading dataset catalog: {e}")
+            return {}
+
+    def _save_catalog(self):
+        try:
+            tmp_file = self.catalog_file.with_suffix(".tmp")
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({"datasets": self._entries}, f, ensure_ascii=False)
+            tmp_file.replace(self.catalog_file)
+        except Exception as e:
+            print(f"Error saving dataset catalog: {e}")
+
+    def _resolve_splits(self, dataset_dir: Path, data: Dict[str, Any]) -> Dict[str, List[Path]]:
+        """根据 data.yaml 解析各划分的图片目录（或图片列表文件）"""
+        root = Path(data.get("path") or dataset_dir)
+        if not root.is_absolute():
+            root = dataset_dir / root
+        if not root.exists():
+            root = dataset_dir
+
+        splits = {}
+        for split in SPLITS:
+            value = data.get(split)
+            if not value:
+                continue
+            values = value if isinstance(value, list) else [value]
+            splits[split] = [root / v for v in values]
+
+        # 未声明划分的数据集按 images/ 目录整体统计
+        if not splits and (dataset_dir / "images").is_dir():
+            splits["all"] = [dataset_dir / "images"]
+        return splits
+
+    def _scan_split(self, sources: List[Path]) -> Dict[str, Any]:
+        """统计单个划分"""
+        count, total_bytes, dirs, files = 0, 0, {}, {}
+        for source in sources:
+            if source.is_file():
+                # 图片列表文件（每行一个路径）
+                with open(source, 'r', encoding='utf-8') as f:
+                    count += sum(1 for line in f if line.strip())
+                files[str(source)] = source.stat().st_mtime_ns
+            elif source.is_dir():
+                c, b, d = _scan_images(source)
+                count += c
+                total_bytes += b
+                dirs.update(d)
+        return {"count": count, "bytes": total_bytes, "dirs": {**dirs, **files}}
+
+    def _refresh_dataset(self, dataset_dir: Path, force: bool = False) -> bool:
+        """检查并更新单个数据集条目，返回是否有变化"""
+        name = dataset_dir.name
+        data_yaml = dataset_dir / "data.yaml"
+        yaml_mtime = data_yaml.stat().st_mtime_ns
+        entry = self._entries.get(name)
+
+        if entry and not force and entry["yaml_mtime_ns"] == yaml_mtime:
+            # 配置未变化：只重新扫描目录发生变化的划分
+            changed = False
+            for split, info in entry["splits"].items():
+                if not mtimes_unchanged(info["dirs"]):
+                    entry["splits"][split] = self._scan_split([Path(p) for p in info["sources"]])
+                    entry["splits"][split]["sources"] = info["sources"]
+                    changed = True
+            if changed:
+                self._finish_entry(entry)
+            return changed
+
+        with open(data_yaml, 'r', encoding='utf-8') as f:
+            data = yaml.safe_load(f) or {}
+
+        names = data.get("names", {})
+        classes = [names[k] for k in sorted(names)] if isinstance(names, dict) else list(names)
+
+        splits = {}
+        for split, sources in self._resolve_splits(dataset_dir, data).items():
+            splits[split] = self._scan_split(sources)
+            splits[split]["sources"] = [str(s) for s in sources]
+
+        self._entries[name] = {
+            "name": name,
+            "path": str(dataset_dir),
+            "yaml_mtime_ns": yaml_mtime,
+            "classes": [str(c) for c in classes],
+            "splits": splits,
+            "created_at": datetime.fromtimestamp(dataset_dir.stat().st_ctime).isoformat()
+        }
+        self._finish_entry(self._entries[name])
+        return True
+
+    def _finish_entry(self, entry: Dict[str, Any]):
+        entry["num_images"] = sum(info["count"] for info in entry["splits"].values())
+        entry["size_bytes"] = sum(info["bytes"] for info in entry["splits"].values())
+        entry["updated_at"] = datetime.now().isoformat()
+
+    def _public(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "name": entry["name"],
+            "path": entry["path"],
+            "num_images": entry["num_images"],
+            "num_classes": len(entry["classes"]),
+            "classes": entry["classes"],
+            "split": {split: info["count"] for split, info in entry["splits"].items()},
+            "size_bytes": entry["size_bytes"],
+            "created_at": entry["created_at"],
+            "updated_at": entry["updated_at"]
+        }
+
+    def list_datasets(self) -> List[Dict[str, Any]]:
+        """列出所有数据集（只更新发生变化的条目）"""
+        datasets = []
+        with self._lock:
+            changed = False
+            seen = set()
+            for dataset_dir in sorted(settings.DATASETS_DIR.iterdir()):
+                if not dataset_dir.is_dir() or not (dataset_dir / "data.yaml").exists():
+                    continue
+                try:
+                    changed |= self._refresh_dataset(dataset_dir)
+                except Exception as e:
+                    print(f"Error reading dataset {dataset_dir}: {e}")
+                    continue
+                seen.add(dataset_dir.name)
+                datasets.append(self._public(self._entries[dataset_dir.name]))
+
+            for name in list(self._entries):
+                if name not in seen:
+                    del self._entries[name]
+                    changed = True
+
+            if changed:
+                self._save_catalog()
+        return datasets
+
+    def get_dataset(self, name: str) -> Optional[Dict[str, Any]]:
+        """获取单个数据集信息"""
+        dataset_dir = settings.DATASETS_DIR / name
+        if not (dataset_dir / "data.yaml").exists():
+            return None
+        with self._lock:
+            if self._refresh_dataset(dataset_dir):
+                self._save_catalog()
+            return self._public(self._entries[name])
+
+    def get_splits(self, name: str) -> Optional[Dict[str, Dict[str, Any]]]:
+        """获取各划分的图片来源（目录或列表文件）和图片数量"""
+        if not self.get_dataset(name):
+            return None
+        with self._lock:
+            return {
+                split: {"sources": list(info["sources"]), "count": info["count"]}
+                for split, info in self._entries[name]["splits"].items()
+            }
+
+    def list_images(self, name: str) -> List[Tuple[str, str, Optional[str]]]:
+        """列出数据集图片：[(路径, 划分, 所在的划分图片目录（来自列表文件时为 None）)]"""
+        images = []
+        for split, info in (self.get_splits(name) or {}).items():
+            for source in info["sources"]:
+                if os.path.isfile(source):
+                    base = os.path.dirname(source)
+                    with open(source, 'r', encoding='utf-8') as f:
+                        for line in f:
+                            if line.strip():
+                                images.append((os.path.normpath(os.path.join(base, line.strip())), split, None))
+                    continue
+
+                stack = [source]
+                while stack:
+                    directory = stack.pop()
+                    try:
+                        with os.scandir(directory) as it:
+                            for entry in it:
+                                if entry.is_dir(follow_symlinks=False):
+                                    stack.append(entry.path)
+                                elif os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+                                    images.append((entry.path, split, source))
+                    except OSError:
+                        continue
+        images.sort()
+        return images
+
+    def get_labels(self, name: str, full: bool = False) -> Optional[PackedLabels]:
+        """
+        获取数据集的打包标签（与 .txt 标签文件同步）
+
+        Args:
+            name: 数据集名称
+            full: 逐个检查标签文件的 mtime / 大小（可发现原地修改）
+        """
+        splits = self.get_splits(name)
+        if splits is None:
+            return None
+        return sync_labels(
+            settings.DATASETS_DIR / name,
+            {split: info["sources"] for split, info in splits.items()},
+            workers=max(1, settings.LABEL_WORKERS),
+            full=full
+        )
+
+    def _label_rows(self, boxes, classes: List[str]) -> List[Dict[str, Any]]:
+        return [
+            {
+                "class_id": int(row[0]),
+                "class_name": classes[int(row[0])] if 0 <= int(row[0]) < len(classes) else str(int(row[0])),
+                "x_center": float(row[1]),
+                "y_center": float(row[2]),
+                "width": float(row[3]),
+                "height": float(row[4])
+            }
+            for row in boxes
+        ]
+
+    def get_image_labels(self, name: str, image: str) -> Optional[Dict[str, Any]]:
+        """按图片路径（相对数据集目录）查询标注框"""
+        labels = self.get_labels(name)
+        if labels is None:
+            return None
+        dataset_dir = settings.DATASETS_DIR / name
+        label_file = label_path_for(str(dataset_dir / image))
+        label_file = os.path.relpath(label_file, dataset_dir)
+        boxes = labels.get(label_file)
+        return {
+            "image": image,
+            "label_file": label_file,
+            "labels": self._label_rows(boxes if boxes is not None else [], self._entries[name]["classes"])
+        }
+
+    def list_labels(self, name: str, split: str, offset: int = 0, limit: int = 100) -> Optional[Dict[str, Any]]:
+        """按标签文件顺序分页读取一个划分的标注框"""
+        labels = self.get_labels(name)
+        if labels is None or split not in labels.splits:
+            return None
+        info = labels.splits[split]
+        start = min(info["start"] + max(offset, 0), info["end"])
+        end = min(start + max(limit, 0), info["end"])
+        classes = self._entries[name]["classes"]
+        items = [
+            {
+                "label_file": labels.files[i],
+                "labels": self._label_rows(labels.boxes[labels.offsets[i]:labels.offsets[i + 1]], classes)
+            }
+            for i in range(start, end)
+        ]
+        return {"split": split, "total": info["end"] - info["start"], "offset": offset, "items": items}
+
+    def get_version(self, name: str) -> Optional[str]:
+        """数据集版本标识：任何划分目录或 data.yaml 变化都会改变该值"""
+        info = self.get_dataset(name)
+        if not info:
+            return None
+        entry = self._entries[name]
+        parts = [str(entry["yaml_mtime_ns"])]
+        for split in sorted(entry["splits"]):
+            parts.extend(f"{p}:{m}" for p, m in sorted(entry["splits"][split]["dirs"].items()))
+        return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+    def refresh(self, name: str) -> Optional[Dict[str, Any]]:
+        """强制重新扫描数据集（上传或导出完成后调用）"""
+        dataset_dir = settings.DATASETS_DIR / name
+        with self._lock:
+            if not (dataset_dir / "data.yaml").exists():
+                if self._entries.pop(name, None) is not None:
+                    self._save_catalog()
+                return None
+            self._refresh_dataset(dataset_dir, force=True)
+            self._save_catalog()
+            return self._public(self._entries[name])
+
+
+# 全局服务实例
+dataset_catalog_service = DatasetCatalogService()
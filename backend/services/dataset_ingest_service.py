@@ -0,0 +1,551 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+数据集流式导入服务
+
+请求体一边到达一边交给后台任务处理，不再先把整个压缩包写入 UPLOADS_DIR：
+- tar / tar.gz / tar.bz2 / tar.xz / tar.zst：按流顺序读取成员，边接收边解压，
+  小文件交给线程池并行写盘
+- zip：目录表位于文件末尾，无法边接收边解压，先写入暂存目录，
+  接收完成后检查全部条目，再由多个线程各自打开压缩包并行解压
+
+任何条目违反限制（路径穿越、链接、目录结构不符、大小或数量超限）时立即停止，
+并通知上传方停止发送。解压在 DATASETS_DIR/.staging 中进行，完成后原子重命名发布。
+"""
+import io
+import os
+import re
+import stat
+import queue
+import shutil
+import tarfile
+import zipfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Tuple
+
+from config.config import settings
+from backend.models.schemas import JobStatus
+from backend.services.job_service import job_service, JobContext
+from backend.services.dataset_catalog_service import dataset_catalog_service, IMAGE_EXTENSIONS
+from backend.utils.label_store import PACK_DIR_NAME
+from backend.utils.shard_store import SHARD_DIR_NAME, INDEX_FILE
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+
+# 支持的压缩包格式（文件名后缀 -> 格式）
+ARCHIVE_FORMATS = {
+    ".zip": "zip",
+    ".tar": "tar",
+    ".tar.gz": "tar.gz",
+    ".tgz": "tar.gz",
+    ".tar.bz2": "tar.bz2",
+    ".tar.xz": "tar.xz",
+    ".tar.zst": "tar.zst",
+    ".tzst": "tar.zst",
+}
+
+# 数据集目录结构：顶层只允许这些目录
+LAYOUT_DIRS = {"images", "labels", SHARD_DIR_NAME}
+# 按划分组织的目录结构（Roboflow 等导出的 train/images、valid/labels ...），其下只允许 images/ 和 labels/
+SPLIT_DIRS = {"train", "valid", "val", "test"}
+SPLIT_LAYOUT_DIRS = {"images", "labels"}
+# 顶层允许的文件类型（data.yaml、README、LICENSE、图片列表等）
+TOP_LEVEL_SUFFIXES = {".yaml", ".yml", ".txt", ".md", ".json", ""}
+# 标注文件类型（.cache 为 ultralytics 生成的缓存，直接跳过）
+LABEL_SUFFIXES = {".txt"}
+
+# 小于该大小的 tar 成员读入内存后交给线程池写盘，更大的直接流式写入
+SMALL_MEMBER_SIZE = 8 * 1024 * 1024
+# 上传队列中最多缓存的数据块数量（用于背压）
+PIPE_MAX_CHUNKS = 64
+
+DATASET_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]*$")
+
+
+class IngestError(Exception):
+    """导入错误，status_code 对应 HTTP 状态码"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class _ChunkPipe(io.RawIOBase):
+    """
+    上传数据块管道：请求处理协程写入，后台任务以文件方式读取
+
+    队列有上限，解压跟不上时写入方阻塞，从而对上传形成背压。
+    任意一方失败都会让另一方尽快停止。
+    """
+
+    def __init__(self, max_chunks: int = PIPE_MAX_CHUNKS):
+        super().__init__()
+        self._queue: "queue.Queue[Optional[bytes]]" = queue.Queue(maxsize=max_chunks)
+        self._buffer = memoryview(b"")
+        self._eof = False
+        self._writer_error: Optional[IngestError] = None
+        self._reader_closed = threading.Event()
+        self.bytes_read = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def _put(self, item: Optional[bytes]) -> bool:
+        while not self._reader_closed.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def write_chunk(self, data: bytes) -> bool:
+        """写入数据块，读取方已停止时返回 False"""
+        return self._put(data)
+
+    def finish(self):
+        """写入结束"""
+        self._put(None)
+
+    def fail(self, error: IngestError):
+        """写入方出错（例如上传中断），读取方随后抛出该错误"""
+        self._writer_error = error
+        self._put(None)
+
+    def close_reader(self):
+        """读取方停止，后续写入立即返回 False"""
+        self._reader_closed.set()
+
+    def readinto(self, b) -> int:
+        while not self._buffer:
+            if self._eof:
+                return 0
+            chunk = self._queue.get()
+            if chunk is None:
+                self._eof = True
+                if self._writer_error:
+                    raise self._writer_error
+                return 0
+            self._buffer = memoryview(chunk)
+
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        self.bytes_read += n
+        return n
+
+
+class _LayoutGuard:
+    """检查条目路径和数据集目录结构，并统计文件数量和解压大小"""
+
+    def __init__(self):
+        # 压缩包常见的外层目录（例如 mydataset/images/...），由第一个条目确定
+        self.prefix: Optional[str] = None
+        self.entries = 0
+        self.total_bytes = 0
+
+    def check(self, name: str, is_dir: bool) -> Optional[Path]:
+        """
+        返回条目在数据集中的相对路径，应跳过的条目返回 None，违规时抛出 IngestError
+        """
+        name = name.replace("\\", "/")
+        if name.startswith("/") or re.match(r"^[A-Za-z]:", name):
+            raise IngestError(f"Absolute path in archive: {name}")
+        parts = [p for p in name.split("/") if p not in ("", ".")]
+        if ".." in parts:
+            raise IngestError(f"Path traversal in archive: {name}")
+        if not parts:
+            return None
+
+        # macOS 打包时附带的元数据
+        if parts[0] == "__MACOSX" or parts[-1] == ".DS_Store" or parts[-1].startswith("._"):
+            return None
+
+        if self.prefix is None:
+            if parts[0] in LAYOUT_DIRS or parts[0] in SPLIT_DIRS or (len(parts) == 1 and not is_dir):
+                self.prefix = ""
+            else:
+                self.prefix = parts[0]
+        if self.prefix:
+            if parts[0] != self.prefix:
+                raise IngestError(f"Archive has more than one top-level folder: {name}")
+            parts = parts[1:]
+            if not parts:
+                return None
+
+        if parts[0] == PACK_DIR_NAME or parts[0].startswith(f".{PACK_DIR_NAME}"):
+            # 打包标签由服务端根据 .txt 标签重新生成
+            return None
+
+        top = parts[0]
+        suffix = os.path.splitext(parts[-1])[1].lower()
+        if top in SPLIT_DIRS:
+            # <split>/images/...、<split>/labels/... 按 images/、labels/ 的规则检查
+            if len(parts) == 1:
+                if not is_dir:
+                    raise IngestError(f"Unexpected file in dataset root: {name}")
+            elif len(parts) == 2 and not is_dir:
+                if suffix != ".cache":
+                    raise IngestError(f"Unexpected file in {top}/: {name}")
+                return None
+            elif parts[1] not in SPLIT_LAYOUT_DIRS:
+                raise IngestError(f"Unexpected folder in {top}/: {name}")
+            elif not is_dir:
+                top = parts[1]
+
+        if is_dir:
+            if top not in LAYOUT_DIRS and top not in SPLIT_DIRS:
+                raise IngestError(f"Unexpected folder in dataset: {name}")
+        elif len(parts) == 1:
+            if suffix == ".cache":
+                return None
+            if suffix not in TOP_LEVEL_SUFFIXES:
+                raise IngestError(f"Unexpected file in dataset root: {name}")
+        elif top == "images":
+            if suffix not in IMAGE_EXTENSIONS:
+                raise IngestError(f"Unexpected file in images/: {name}")
+        elif top == "labels":
+            if suffix == ".cache":
+                return None
+            if suffix not in LABEL_SUFFIXES:
+                raise IngestError(f"Unexpected file in labels/: {name}")
+        elif top == SHARD_DIR_NAME:
+            # 分片数据集（backend/utils/shard_store.py）
+            if len(parts) != 2 or (suffix != ".tar" and parts[1] != INDEX_FILE):
+                raise IngestError(f"Unexpected file in {SHARD_DIR_NAME}/: {name}")
+        else:
+            raise IngestError(f"Unexpected folder in dataset: {name}")
+
+        if not is_dir:
+            self.entries += 1
+            if self.entries > settings.MAX_DATASET_ENTRIES:
+                raise IngestError(
+                    f"Archive has more than {settings.MAX_DATASET_ENTRIES} files", 413
+                )
+        return Path(*parts)
+
+    def add_bytes(self, size: int):
+        """累计解压大小"""
+        self.total_bytes += size
+        if self.total_bytes > settings.MAX_DATASET_EXTRACTED_SIZE:
+            raise IngestError(
+                f"Extracted size exceeds {settings.MAX_DATASET_EXTRACTED_SIZE} bytes", 413
+            )
+
+
+def _write_file(target: Path, data: bytes):
+    with open(target, 'wb') as f:
+        f.write(data)
+
+
+class IngestSession:
+    """一次流式导入：请求处理方通过 feed() 写入数据块"""
+
+    def __init__(self, job: JobStatus, pipe: _ChunkPipe):
+        self.job = job
+        self._pipe = pipe
+        self.received = 0
+
+    def feed(self, data: bytes) -> bool:
+        """
+        写入一个数据块（可能因背压阻塞，应在线程池中调用）
+
+        Returns:
+            False 表示导入任务已停止，应停止读取请求体
+        """
+        self.received += len(data)
+        if self.received > settings.MAX_DATASET_UPLOAD_SIZE:
+            error = IngestError(
+                f"Archive too large (limit {settings.MAX_DATASET_UPLOAD_SIZE} bytes)", 413
+            )
+            self._pipe.fail(error)
+            raise error
+        return self._pipe.write_chunk(data)
+
+    def finish(self):
+        """请求体接收完毕"""
+        self._pipe.finish()
+
+    def abort(self, message: str):
+        """上传中断"""
+        self._pipe.fail(IngestError(message))
+
+
+class DatasetIngestService:
+    """数据集导入服务"""
+
+    def __init__(self):
+        self.staging_dir = settings.DATASETS_DIR / ".staging"
+        self.workers = max(1, settings.INGEST_WORKERS)
+        self._active = set()
+        self._lock = threading.Lock()
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+    def detect_format(self, filename: str) -> str:
+        """根据文件名判断压缩包格式"""
+        lower = filename.lower()
+        for suffix in sorted(ARCHIVE_FORMATS, key=len, reverse=True):
+            if lower.endswith(suffix):
+                return ARCHIVE_FORMATS[suffix]
+        raise IngestError(f"Unsupported archive type: {filename}")
+
+    def dataset_name_from_filename(self, filename: str) -> str:
+        """去掉压缩包后缀得到数据集名称"""
+        name = Path(filename).name
+        lower = name.lower()
+        for suffix in sorted(ARCHIVE_FORMATS, key=len, reverse=True):
+            if lower.endswith(suffix):
+                return name[:-len(suffix)]
+        return name
+
+    def _check_request(self, name: str, fmt: str, overwrite: bool):
+        if not DATASET_NAME_PATTERN.match(name):
+            raise IngestError(f"Invalid dataset name: {name}")
+        if fmt not in ARCHIVE_FORMATS.values():
+            raise IngestError(f"Unsupported archive format: {fmt}")
+        if fmt == "tar.zst" and not ZSTD_AVAILABLE:
+            raise IngestError("tar.zst support requires: pip install zstandard")
+        if not overwrite and (settings.DATASETS_DIR / name).exists():
+            raise IngestError(f"Dataset already exists: {name}", 409)
+
+    def start_stream(
+        self,
+        name: str,
+        fmt: str,
+        overwrite: bool = False,
+        total_size: Optional[int] = None
+    ) -> IngestSession:
+        """
+        开始流式导入
+
+        Args:
+            name: 数据集名称
+            fmt: 压缩包格式（zip / tar / tar.gz / tar.bz2 / tar.xz / tar.zst）
+            overwrite: 是否替换同名数据集
+            total_size: 请求体总大小（Content-Length），用于计算进度
+
+        Returns:
+            导入会话，调用方通过 feed() 写入数据
+        """
+        self._check_request(name, fmt, overwrite)
+        if total_size and total_size > settings.MAX_DATASET_UPLOAD_SIZE:
+            raise IngestError(
+                f"Archive too large (limit {settings.MAX_DATASET_UPLOAD_SIZE} bytes)", 413
+            )
+
+        # 同名数据集同时只允许一个导入任务（不能合并：每个任务读取各自的请求体）
+        with self._lock:
+            if name in self._active:
+                raise IngestError(f"Dataset {name} is already being imported", 409)
+            self._active.add(name)
+
+        pipe = _ChunkPipe()
+        try:
+            job = job_service.submit(
+                "dataset_ingest",
+                self._ingest_job,
+                name,
+                fmt,
+                pipe,
+                overwrite,
+                total_size
+            )
+        except Exception:
+            with self._lock:
+                self._active.discard(name)
+            raise
+        return IngestSession(job, pipe)
+
+    def _ingest_job(
+        self,
+        ctx: JobContext,
+        name: str,
+        fmt: str,
+        source: _ChunkPipe,
+        overwrite: bool,
+        total_size: Optional[int]
+    ) -> Dict[str, Any]:
+        """后台导入任务"""
+        staging = self.staging_dir / ctx.job_id
+        content_dir = staging / "content"
+        content_dir.mkdir(parents=True, exist_ok=True)
+        guard = _LayoutGuard()
+
+        try:
+            if fmt == "zip":
+                archive = self._spool(ctx, source, staging / "upload.zip", total_size)
+                self._extract_zip(ctx, archive, content_dir, guard)
+                archive.unlink()
+            else:
+                self._extract_tar_stream(ctx, source, fmt, content_dir, guard, total_size)
+
+            if not (content_dir / "data.yaml").exists():
+                raise IngestError("data.yaml not found in dataset root")
+
+            ctx.update(progress=98, message="Publishing dataset")
+            dataset_path = self._publish(content_dir, name, overwrite, staging)
+        finally:
+            source.close_reader()
+            shutil.rmtree(staging, ignore_errors=True)
+            with self._lock:
+                self._active.discard(name)
+
+        dataset_info = dataset_catalog_service.refresh(name)
+        return {
+            "dataset_name": name,
+            "path": str(dataset_path),
+            "num_files": guard.entries,
+            "extracted_bytes": guard.total_bytes,
+            "dataset": dataset_info
+        }
+
+    def _spool(self, ctx: JobContext, source: _ChunkPipe, target: Path, total_size: Optional[int]) -> Path:
+        """zip 需要随机访问，先把上传数据写入暂存文件"""
+        ctx.update(progress=0, message="Receiving archive")
+        with open(target, 'wb') as f:
+            while True:
+                chunk = source.read(1024 * 1024)
+                if not chunk:
+                    break
+                f.write(chunk)
+                if total_size:
+                    ctx.update(progress=source.bytes_read / total_size * 50)
+        return target
+
+    def _extract_zip(self, ctx: JobContext, archive: Path, content_dir: Path, guard: _LayoutGuard):
+        """检查全部条目后并行解压 zip"""
+        ctx.update(progress=50, message="Checking archive entries")
+        try:
+            zf = zipfile.ZipFile(archive)
+        except zipfile.BadZipFile as e:
+            raise IngestError(f"Invalid zip archive: {e}")
+
+        plan: List[Tuple[zipfile.ZipInfo, Path]] = []
+        with zf:
+            for info in zf.infolist():
+                rel = guard.check(info.filename, info.is_dir())
+                if rel is None:
+                    continue
+                if stat.S_ISLNK(info.external_attr >> 16):
+                    raise IngestError(f"Symlinks are not allowed: {info.filename}")
+                if info.is_dir():
+                    (content_dir / rel).mkdir(parents=True, exist_ok=True)
+                    continue
+                guard.add_bytes(info.file_size)
+                plan.append((info, rel))
+
+        for parent in {rel.parent for _, rel in plan}:
+            (content_dir / parent).mkdir(parents=True, exist_ok=True)
+
+        ctx.update(message=f"Extracting {len(plan)} files")
+        done = [0]
+        done_lock = threading.Lock()
+
+        def extract_batch(batch: List[Tuple[zipfile.ZipInfo, Path]]):
+            # 每个线程使用独立的文件句柄，解压（zlib 释放 GIL）可以真正并行
+            with zipfile.ZipFile(archive) as local_zf:
+                for info, rel in batch:
+                    with local_zf.open(info) as src, open(content_dir / rel, 'wb') as dst:
+                        shutil.copyfileobj(src, dst, 1024 * 1024)
+                    with done_lock:
+                        done[0] += 1
+
+        batches = [plan[i::self.workers] for i in range(self.workers)]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(extract_batch, b) for b in batches if b]
+            pending = set(futures)
+            while pending:
+                finished, pending = wait(pending, timeout=1.0, return_when=FIRST_EXCEPTION)
+                for future in finished:
+                    future.result()
+                if plan:
+                    ctx.update(progress=50 + done[0] / len(plan) * 48)
+
+    def _extract_tar_stream(
+        self,
+        ctx: JobContext,
+        source: _ChunkPipe,
+        fmt: str,
+        content_dir: Path,
+        guard: _LayoutGuard,
+        total_size: Optional[int]
+    ):
+        """按流顺序解压 tar，边接收边写盘"""
+        ctx.update(progress=0, message="Extracting archive stream")
+        try:
+            if fmt == "tar.zst":
+                fileobj = zstandard.ZstdDecompressor().stream_reader(source)
+                mode = "r|"
+            else:
+                fileobj = source
+                mode = "r|*"
+
+            try:
+                tar = tarfile.open(fileobj=fileobj, mode=mode)
+            except tarfile.TarError as e:
+                raise IngestError(f"Invalid tar archive: {e}")
+
+            pending = deque()
+            created_dirs = set()
+            with tar, ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for member in tar:
+                    rel = guard.check(member.name, member.isdir())
+                    if rel is None:
+                        continue
+                    target = content_dir / rel
+                    if member.isdir():
+                        target.mkdir(parents=True, exist_ok=True)
+                        created_dirs.add(rel)
+                        continue
+                    if not member.isfile():
+                        raise IngestError(f"Links and special files are not allowed: {member.name}")
+
+                    guard.add_bytes(member.size)
+                    if rel.parent not in created_dirs:
+                        target.parent.mkdir(parents=True, exist_ok=True)
+                        created_dirs.add(rel.parent)
+
+                    src = tar.extractfile(member)
+                    if member.size <= SMALL_MEMBER_SIZE:
+                        pending.append(pool.submit(_write_file, target, src.read()))
+                    else:
+                        with open(target, 'wb') as dst:
+                            shutil.copyfileobj(src, dst, 1024 * 1024)
+
+                    # 限制待写盘的数据量，同时尽早发现写盘错误
+                    while len(pending) > self.workers * 4:
+                        pending.popleft().result()
+
+                    if guard.entries % 200 == 0:
+                        ctx.update(
+                            progress=source.bytes_read / total_size * 95 if total_size else None,
+                            message=f"Extracted {guard.entries} files"
+                        )
+
+                for future in pending:
+                    future.result()
+        except (tarfile.TarError, EOFError) as e:
+            raise IngestError(f"Corrupt tar archive: {e}")
+
+    def _publish(self, content_dir: Path, name: str, overwrite: bool, staging: Path) -> Path:
+        """把解压结果原子重命名为正式数据集目录"""
+        target = settings.DATASETS_DIR / name
+        if target.exists():
+            if not overwrite:
+                raise IngestError(f"Dataset already exists: {name}", 409)
+            # 旧数据集先移入暂存目录，随暂存目录一起删除
+            target.rename(staging / "previous")
+        content_dir.rename(target)
+        return target
+
+
+# 全局服务实例
+dataset_ingest_service = DatasetIngestService()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+数据集统计服务
+
+从打包的标签存储（backend/utils/label_store.py，首次使用时多进程并行解析全部
+YOLO 标签文件生成）读取 numpy 数组 boxes[N, 5]（class, x, y, w, h）和每个标签文件的
+目标数，再以向量化方式计算：
+- 类别分布（目标数、包含该类别的图片数）
+- 框尺寸 / 宽高比分布，小/中/大目标数量
+- 每张图片的目标数分布
+- 各划分之间的类别均衡情况
+
+结果按数据集版本（目录索引版本 + 标签包版本）缓存在 CACHE_DIR/stats/ 下。
+"""
+import json
+import threading
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from config.config import settings
+from backend.services.dataset_catalog_service import dataset_catalog_service
+
+# 直方图分箱
+SIZE_BINS = np.linspace(0.0, 1.0, 11)
+ASPECT_BINS = np.array([0.0, 1 / 4, 1 / 3, 1 / 2, 2 / 3, 1.0, 3 / 2, 2.0, 3.0, 4.0, np.inf])
+MAX_OBJECTS_BIN = 20
+
+# 小/中/大目标阈值：sqrt(w*h) 的相对值（对应 640 输入下 COCO 的 32 / 96 像素）
+SMALL_OBJECT = 32 / 640
+MEDIUM_OBJECT = 96 / 640
+
+
+def _histogram(values: np.ndarray, bins: np.ndarray) -> Dict[str, List]:
+    counts, _ = np.histogram(values, bins=bins)
+    edges = [None if np.isinf(b) else round(float(b), 4) for b in bins]
+    return {"bins": edges, "counts": counts.tolist()}
+
+
+def compute_stats(
+    boxes: np.ndarray,
+    counts: np.ndarray,
+    num_images: int,
+    classes: List[str]
+) -> Dict[str, Any]:
+    """
+    计算一组标签的统计信息
+
+    Args:
+        boxes: [N, 5]，class, x, y, w, h（归一化坐标）
+        counts: 每个标签文件的目标数
+        num_images: 图片总数（没有标签文件的图片视为背景图片）
+        classes: 类别名称
+    """
+    cls = boxes[:, 0].astype(np.int64)
+    xywh = boxes[:, 1:]
+    w, h = xywh[:, 2], xywh[:, 3]
+    num_classes = max(len(classes), int(cls.max()) + 1 if len(cls) else 0)
+    names = [classes[i] if i < len(classes) else str(i) for i in range(num_classes)]
+
+    valid = cls >= 0
+    class_counts = np.bincount(cls[valid], minlength=num_classes)
+
+    # 包含每个类别的图片数：对 (图片, 类别) 去重后计数
+    image_idx = np.repeat(np.arange(len(counts)), counts)
+    pairs = np.unique(image_idx[valid] * num_classes + cls[valid]) if num_classes else np.array([], dtype=np.int64)
+    images_per_class = np.bincount(pairs % max(num_classes, 1), minlength=num_classes)
+
+    # 每张图片的目标数（缺少标签文件的图片目标数为 0）
+    per_image = np.concatenate([
+        counts.astype(np.int64),
+        np.zeros(max(num_images - len(counts), 0), dtype=np.int64)
+    ])
+    objects_hist = np.bincount(np.minimum(per_image, MAX_OBJECTS_BIN), minlength=MAX_OBJECTS_BIN + 1)
+
+    rel_size = np.sqrt(np.clip(w * h, 0, None))
+    aspect = w / np.maximum(h, 1e-9)
+
+    return {
+        "num_images": int(max(num_images, len(counts))),
+        "num_label_files": int(len(counts)),
+        "num_background_images": int((per_image == 0).sum()),
+        "num_objects": int(len(boxes)),
+        "classes": {
+            names[i]: {"objects": int(class_counts[i]), "images": int(images_per_class[i])}
+            for i in range(num_classes) if i < len(classes) or class_counts[i]
+        },
+        "unknown_class_objects": int(((cls < 0) | (cls >= len(classes))).sum()),
+        "out_of_range_boxes": int(((xywh < 0) | (xywh > 1)).any(axis=1).sum()),
+        "objects_per_image": {
+            "mean": round(float(per_image.mean()), 3) if len(per_image) else 0.0,
+            "max": int(per_image.max()) if len(per_image) else 0,
+            "p50": float(np.percentile(per_image, 50)) if len(per_image) else 0.0,
+            "p95": float(np.percentile(per_image, 95)) if len(per_image) else 0.0,
+            "histogram": {
+                (str(i) if i < MAX_OBJECTS_BIN else f"{MAX_OBJECTS_BIN}+"): int(c)
+                for i, c in enumerate(objects_hist)
+            }
+        },
+        "box_width": _histogram(w, SIZE_BINS),
+        "box_height": _histogram(h, SIZE_BINS),
+        "box_area": _histogram(w * h, SIZE_BINS),
+        "aspect_ratio": _histogram(aspect, ASPECT_BINS),
+        "object_size": {
+            "small": int((rel_size < SMALL_OBJECT).sum()),
+            "medium": int(((rel_size >= SMALL_OBJECT) & (rel_size < MEDIUM_OBJECT)).sum()),
+            "large": int((rel_size >= MEDIUM_OBJECT).sum())
+        }
+    }
+
+
+class DatasetStatsService:
+    """数据集统计服务"""
+
+    def __init__(self):
+        self.cache_dir = settings.CACHE_DIR / "stats"
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _cache_file(self, name: str) -> Path:
+        return self.cache_dir / f"{name}.json"
+
+    def _load_cached(self, name: str, version: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._cache_file(name), 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cached.get("version") != version:
+            return None
+        return cached["stats"]
+
+    def get_stats(self, name: str, refresh: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        获取数据集统计信息
+
+        Args:
+            name: 数据集名称
+            refresh: 忽略缓存重新计算
+
+        Returns:
+            统计信息，数据集不存在时返回 None
+        """
+        dataset = dataset_catalog_service.get_dataset(name)
+        if not dataset:
+            return None
+
+        with self._lock:
+            # refresh 时逐个检查标签文件，可发现原地修改的内容
+            labels = dataset_catalog_service.get_labels(name, full=refresh)
+            version = f"{dataset_catalog_service.get_version(name)}:{labels.generation}"
+            if not refresh:
+                cached = self._load_cached(name, version)
+                if cached:
+                    return cached
+
+            split_stats: Dict[str, Any] = {}
+            all_images, invalid_lines = 0, 0
+            for split, info in labels.splits.items():
+                boxes, counts, invalid = labels.split_arrays(split)
+                num_images = info["num_images"] if info["num_images"] is not None else dataset["split"].get(split, 0)
+                split_stats[split] = compute_stats(boxes, counts, num_images, dataset["classes"])
+                all_images += num_images
+                invalid_lines += invalid
+
+            overall = compute_stats(
+                np.asarray(labels.boxes),
+                np.diff(np.asarray(labels.offsets)),
+                all_images,
+                dataset["classes"]
+            )
+            overall["invalid_lines"] = invalid_lines
+
+            # 各类别目标在不同划分中的占比
+            balance = {}
+            for class_name, total in overall["classes"].items():
+                if total["objects"]:
+                    balance[class_name] = {
+                        split: round(s["classes"].get(class_name, {}).get("objects", 0) / total["objects"], 4)
+                        for split, s in split_stats.items()
+                    }
+
+            stats = {
+                "dataset": name,
+                "version": version,
+                "overall": overall,
+                "splits": split_stats,
+                "split_balance": balance
+            }
+
+            tmp_file = self._cache_file(name).with_suffix(".tmp")
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({"version": version, "stats": stats}, f, ensure_ascii=False)
+            tmp_file.replace(self._cache_file(name))
+            return stats
+
+
+# 全局服务实例
+dataset_stats_service = DatasetStatsService()
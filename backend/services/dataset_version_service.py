@@ -0,0 +1,387 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+数据集版本服务
+
+数据集文件按内容（sha256）存放在 DATA_DIR/blobs/ 中（backend/utils/blob_store.py），
+工作目录中的文件是 blob 的硬链接：
+- 快照：只对新增或变化的文件计算哈希（按 inode / mtime / 大小缓存），新内容硬链接为 blob，
+  与已有 blob 内容相同的副本（例如重新上传的图片）替换为硬链接；最后写入版本清单
+  DATA_DIR/versions/<dataset>/<version>.json（{相对路径: [sha256, 大小]}）
+- 检出：按清单把 blob 硬链接为新的目录树，不复制数据
+- 比较：两个清单的字典比较，不需要读取文件
+
+版本号由清单内容计算，内容相同的快照得到同一个版本。
+"""
+import os
+import json
+import shutil
+import hashlib
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple, Callable
+
+import yaml
+
+from config.config import settings
+from backend.models.schemas import DatasetSnapshotRequest, DatasetCheckoutRequest, JobStatus
+from backend.services.job_service import job_service, JobContext
+from backend.services.dataset_catalog_service import dataset_catalog_service
+from backend.services.dataset_ingest_service import DATASET_NAME_PATTERN
+from backend.utils.blob_store import BlobStore, BlobIntegrityError, file_sha256
+from backend.utils.label_store import PACK_DIR_NAME
+from backend.utils.shard_store import SHARD_DIR_NAME
+
+# 不纳入版本的目录（派生数据或已移出数据集的文件）
+EXCLUDED_DIRS = {PACK_DIR_NAME, SHARD_DIR_NAME, "duplicates"}
+EXCLUDED_SUFFIXES = {".cache", ".tmp"}
+
+# 版本号长度（清单内容 sha256 的前缀）
+VERSION_ID_LENGTH = 12
+
+
+def _walk_files(root: Path) -> List[str]:
+    """列出数据集中纳入版本的文件（相对路径，/ 分隔）"""
+    files = []
+    stack = [str(root)]
+    while stack:
+        directory = stack.pop()
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    if directory == str(root) and entry.name in EXCLUDED_DIRS:
+                        continue
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    if os.path.splitext(entry.name)[1] in EXCLUDED_SUFFIXES:
+                        continue
+                    files.append(os.path.relpath(entry.path, root).replace(os.sep, "/"))
+    files.sort()
+    return files
+
+
+def version_id_for(files: Dict[str, List[Any]]) -> str:
+    """由清单内容计算版本号"""
+    canonical = json.dumps(sorted(files.items()), separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:VERSION_ID_LENGTH]
+
+
+class DatasetVersionService:
+    """数据集版本服务"""
+
+    def __init__(self):
+        self.blobs = BlobStore(settings.BLOBS_DIR)
+        self.versions_dir = settings.VERSIONS_DIR
+        self.views_dir = settings.CACHE_DIR / "dataset_versions"
+        self.views_dir.mkdir(parents=True, exist_ok=True)
+        # 按数据集加锁，不同数据集的快照可以并行
+        self._locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+
+    def _dataset_versions_dir(self, name: str) -> Path:
+        return self.versions_dir / name
+
+    def _manifest_file(self, name: str, version: str) -> Path:
+        return self._dataset_versions_dir(name) / f"{version}.json"
+
+    def _write_json(self, path: Path, data: Dict[str, Any]):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = path.with_suffix(".tmp")
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        tmp_file.replace(path)
+
+    def load_manifest(self, name: str, version: str) -> Optional[Dict[str, Any]]:
+        """读取版本清单，版本不存在时返回 None"""
+        if not DATASET_NAME_PATTERN.match(version):
+            return None
+        try:
+            with open(self._manifest_file(name, version), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _summary(self, manifest: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: v for k, v in manifest.items() if k != "files"}
+
+    def list_versions(self, name: str) -> List[Dict[str, Any]]:
+        """列出数据集的所有版本（按创建时间倒序，不含文件列表）"""
+        versions = []
+        for path in self._dataset_versions_dir(name).glob("*.json"):
+            if path.name == "hashes.json":
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                versions.append(self._summary(json.load(f)))
+        versions.sort(key=lambda v: v["created_at"], reverse=True)
+        return versions
+
+    def get_version(self, name: str, version: str) -> Optional[Dict[str, Any]]:
+        """获取版本信息（不含文件列表）"""
+        manifest = self.load_manifest(name, version)
+        return self._summary(manifest) if manifest else None
+
+    # ==================== 快照 ====================
+
+    def submit_snapshot(self, name: str, request: DatasetSnapshotRequest) -> JobStatus:
+        """提交快照任务"""
+        if not dataset_catalog_service.get_dataset(name):
+            raise FileNotFoundError(f"Dataset not found: {name}")
+        return job_service.submit(
+            "dataset_snapshot", self._snapshot_job, name, request.message, dedupe_key=f"snapshot:{name}"
+        )
+
+    def _snapshot_job(self, ctx: JobContext, name: str, message: str) -> Dict[str, Any]:
+        return self.snapshot(name, message, ctx)
+
+    def _load_hashes(self, name: str) -> Dict[str, List[Any]]:
+        try:
+            with open(self._dataset_versions_dir(name) / "hashes.json", 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def snapshot(self, name: str, message: str = "", ctx: Optional[JobContext] = None) -> Dict[str, Any]:
+        """
+        为数据集当前内容创建快照
+
+        Args:
+            name: 数据集名称
+            message: 版本说明
+            ctx: 后台任务上下文（用于汇报进度）
+
+        Returns:
+            版本信息；内容与已有版本相同时直接返回该版本
+        """
+        dataset_dir = settings.DATASETS_DIR / name
+        if not (dataset_dir / "data.yaml").exists():
+            raise FileNotFoundError(f"Dataset not found: {name}")
+
+        with self._locks[name]:
+            rel_paths = _walk_files(dataset_dir)
+            cached = self._load_hashes(name)
+            hashes: Dict[str, List[Any]] = {}
+            files: Dict[str, List[Any]] = {}
+            todo: List[Tuple[str, os.stat_result]] = []
+
+            # inode / mtime / 大小都未变化（且 blob 仍在）的文件直接复用缓存的哈希
+            for rel in rel_paths:
+                st = os.stat(dataset_dir / rel)
+                entry = cached.get(rel)
+                if entry and entry[:3] == [st.st_ino, st.st_mtime_ns, st.st_size] and self.blobs.has(entry[3]):
+                    hashes[rel] = entry
+                    continue
+                if entry and entry[0] == st.st_ino and self.blobs.is_linked(entry[3], st):
+                    # 同一个 inode 的内容变了：文件被原地写入，历史版本中的 blob 已被一起修改
+                    raise BlobIntegrityError(
+                        f"{name}/{rel} was modified in place and blob {entry[3]} shared with earlier "
+                        f"versions is corrupted; write a new file and replace it instead"
+                    )
+                todo.append((rel, st))
+
+            new_blobs = 0
+            with ThreadPoolExecutor(max_workers=max(1, settings.INGEST_WORKERS)) as pool:
+                shas = pool.map(lambda item: file_sha256(str(dataset_dir / item[0])), todo)
+                for n, ((rel, st), sha) in enumerate(zip(todo, shas), 1):
+                    new_blobs += self.blobs.adopt(str(dataset_dir / rel), sha)
+                    # adopt 可能把文件替换为 blob 的硬链接，重新读取 inode
+                    st = os.stat(dataset_dir / rel)
+                    hashes[rel] = [st.st_ino, st.st_mtime_ns, st.st_size, sha]
+                    if ctx and n % 1000 == 0:
+                        ctx.update(progress=n / len(todo) * 100, message=f"Hashed {n}/{len(todo)} changed files")
+
+            for rel in rel_paths:
+                files[rel] = [hashes[rel][3], hashes[rel][2]]
+            self._write_json(self._dataset_versions_dir(name) / "hashes.json", hashes)
+
+            version = version_id_for(files)
+            existing = self.load_manifest(name, version)
+            if existing:
+                return self._summary(existing)
+
+            latest = self.list_versions(name)
+            manifest = {
+                "version": version,
+                "dataset": name,
+                "parent": latest[0]["version"] if latest else None,
+                "message": message,
+                "created_at": datetime.now().isoformat(),
+                "num_files": len(files),
+                "size_bytes": sum(size for _, size in files.values()),
+                "new_blobs": new_blobs,
+                "files": files
+            }
+            self._write_json(self._manifest_file(name, version), manifest)
+            return self._summary(manifest)
+
+    # ==================== 比较 ====================
+
+    def diff(self, name: str, from_version: str, to_version: str, limit: int = 1000) -> Optional[Dict[str, Any]]:
+        """
+        比较两个版本
+
+        Returns:
+            新增 / 删除 / 修改的文件（各自最多 limit 个）及数量，版本不存在时返回 None
+        """
+        a = self.load_manifest(name, from_version)
+        b = self.load_manifest(name, to_version)
+        if a is None or b is None:
+            return None
+        old, new = a["files"], b["files"]
+
+        added = sorted(new.keys() - old.keys())
+        removed = sorted(old.keys() - new.keys())
+        modified = sorted(p for p in new.keys() & old.keys() if new[p][0] != old[p][0])
+
+        def count_by_kind(paths: List[str]) -> Dict[str, int]:
+            kinds = {"images": 0, "labels": 0, "other": 0}
+            for p in paths:
+                top = p.split("/", 1)[0]
+                kinds[top if top in ("images", "labels") else "other"] += 1
+            return kinds
+
+        return {
+            "dataset": name,
+            "from_version": from_version,
+            "to_version": to_version,
+            "summary": {
+                "added": count_by_kind(added),
+                "removed": count_by_kind(removed),
+                "modified": count_by_kind(modified),
+                "bytes_added": sum(new[p][1] for p in added),
+                "bytes_removed": sum(old[p][1] for p in removed)
+            },
+            "added": added[:limit],
+            "removed": removed[:limit],
+            "modified": modified[:limit]
+        }
+
+    # ==================== 检出 ====================
+
+    def _link_tree(self, manifest: Dict[str, Any], target_dir: Path):
+        """按清单把 blob 硬链接为目录树"""
+        created = set()
+        for rel, (sha, size) in manifest["files"].items():
+            path = target_dir / rel
+            if path.parent not in created:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                created.add(path.parent)
+            self.blobs.checkout(sha, str(path), size)
+
+    def submit_checkout(self, name: str, version: str, request: DatasetCheckoutRequest) -> JobStatus:
+        """提交检出任务：把版本检出为数据集目录（默认 <数据集>_<版本号>）"""
+        if self.load_manifest(name, version) is None:
+            raise FileNotFoundError(f"Version not found: {name}@{version}")
+        target = request.target_name or f"{name}_{version[:8]}"
+        if not DATASET_NAME_PATTERN.match(target):
+            raise ValueError(f"Invalid dataset name: {target}")
+        if (settings.DATASETS_DIR / target).exists() and not request.overwrite:
+            raise FileExistsError(f"Dataset already exists: {target}")
+        return job_service.submit(
+            "dataset_checkout", self._checkout_job, name, version, target, dedupe_key=f"checkout:{target}"
+        )
+
+    def _checkout_job(self, ctx: JobContext, name: str, version: str, target: str) -> Dict[str, Any]:
+        manifest = self.load_manifest(name, version)
+        staging = settings.DATASETS_DIR / ".staging" / ctx.job_id
+        content_dir = staging / "content"
+        try:
+            self._link_tree(manifest, content_dir)
+            target_dir = settings.DATASETS_DIR / target
+            if target_dir.exists():
+                target_dir.rename(staging / "previous")
+            content_dir.rename(target_dir)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+        dataset_catalog_service.refresh(target)
+        return {"dataset_name": target, "source": name, "version": version, "num_files": manifest["num_files"]}
+
+    # ==================== 训练 ====================
+
+    def submit_training(self, name: str, start: Callable[[Path, str], Dict[str, Any]]) -> JobStatus:
+        """
+        为数据集当前内容创建快照（dataset_snapshot 后台任务），完成后用该版本开始训练
+
+        快照需要遍历数据集并计算变化文件的哈希，不能在请求线程中执行。
+
+        Args:
+            name: 数据集名称
+            start: 快照完成后调用 start(data.yaml 路径, 版本号) 开始训练，返回值合并到任务结果
+        """
+        if not (settings.DATASETS_DIR / name / "data.yaml").exists():
+            raise FileNotFoundError(f"Dataset not found: {name}")
+        return job_service.submit("dataset_snapshot", self._snapshot_and_train_job, name, start)
+
+    def _snapshot_and_train_job(
+        self,
+        ctx: JobContext,
+        name: str,
+        start: Callable[[Path, str], Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        summary = self.snapshot(name, message="training", ctx=ctx)
+        ctx.update(message="Preparing training view")
+        data_yaml, version = self.prepare_training(name, summary["version"])
+        ctx.update(message="Starting training")
+        return {**summary, "dataset_path": str(data_yaml), **start(data_yaml, version)}
+
+    def prepare_training(self, name: str, version: str) -> Tuple[Path, str]:
+        """
+        准备训练用的只读数据集视图（只链接已有版本，不创建快照）
+
+        Args:
+            name: 数据集名称
+            version: 版本号
+
+        Returns:
+            (视图中的 data.yaml 路径, 版本号)
+        """
+        manifest = self.load_manifest(name, version)
+        if manifest is None:
+            raise FileNotFoundError(f"Version not found: {name}@{version}")
+
+        view_dir = self.views_dir / f"{name}-{version}"
+        data_yaml = view_dir / "data.yaml"
+        with self._locks[name]:
+            if not data_yaml.exists():
+                tmp_dir = self.views_dir / f".{view_dir.name}.tmp"
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                self._link_tree(manifest, tmp_dir)
+
+                # data.yaml 是 blob 的硬链接，改写前先断开链接
+                tmp_yaml = tmp_dir / "data.yaml"
+                with open(tmp_yaml, 'r', encoding='utf-8') as f:
+                    data = yaml.safe_load(f) or {}
+                data["path"] = str(view_dir)
+                tmp_yaml.unlink()
+                with open(tmp_yaml, 'w', encoding='utf-8') as f:
+                    yaml.safe_dump(data, f, allow_unicode=True, sort_keys=False)
+                tmp_dir.rename(view_dir)
+        return data_yaml, version
+
+    # ==================== 删除 ====================
+
+    def delete_version(self, name: str, version: str) -> bool:
+        """删除版本清单和训练视图，并清理不再被引用的 blob"""
+        with self._locks[name]:
+            manifest_file = self._manifest_file(name, version)
+            if not DATASET_NAME_PATTERN.match(version) or not manifest_file.exists():
+                return False
+            manifest_file.unlink()
+            shutil.rmtree(self.views_dir / f"{name}-{version}", ignore_errors=True)
+
+            referenced = set()
+            for path in self.versions_dir.glob("*/*.json"):
+                if path.name == "hashes.json":
+                    continue
+                with open(path, 'r', encoding='utf-8') as f:
+                    referenced.update(sha for sha, _ in json.load(f)["files"].values())
+            self.blobs.remove_unreferenced(referenced)
+            return True
+
+
+# 全局服务实例
+dataset_version_service = DatasetVersionService()
@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+近似重复图片检测服务
+
+1. 多线程计算所有图片的 64 位感知哈希（pHash：32x32 灰度图 DCT 的低频 8x8 系数与中位数比较），
+   哈希按文件 mtime / 大小缓存，重复运行只计算新增或变化的图片
+2. 用多索引哈希（multi-index hashing）查找汉明距离不超过阈值的图片对：
+   64 位哈希分为 4 段，距离 <= r 的两个哈希至少有一段距离 <= r // 4，
+   只需在每段的哈希表中查找少量邻近值，无需两两比较
+3. 并查集合并为近似重复簇，每簇保留文件最大的一张
+
+处理方式：
+- report：只生成报告
+- drop：数据集中的重复图片（及标签）移到 duplicates/ 目录；标注项目中直接删除图片和标注
+- group：同簇图片放在同一划分（数据集中移动文件；标注项目在导出 / 训练时按簇划分）
+"""
+import os
+import json
+import shutil
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from itertools import combinations
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from config.config import settings
+from backend.models.schemas import DedupRequest, JobStatus
+from backend.services.job_service import job_service, JobContext
+from backend.services.dataset_catalog_service import dataset_catalog_service
+from backend.utils.label_store import label_path_for, expand_ranges
+
+
+# 多索引哈希的分段数（64 位 -> 4 x 16 位）
+HASH_CHUNKS = 4
+CHUNK_BITS = 64 // HASH_CHUNKS
+# 每次批量查询的哈希数量，限制候选对数组的内存
+QUERY_BLOCK = 50000
+
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def compute_phash(image_path: str) -> Optional[int]:
+    """计算图片的 64 位感知哈希，无法读取时返回 None"""
+    # 以 1/4 尺寸解码灰度图，JPEG 解码速度快很多，对 32x32 的哈希没有影响
+    image = cv2.imread(image_path, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if image is None:
+        return None
+    small = cv2.resize(image, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:])
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def hamming(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """逐元素计算两个 uint64 数组的汉明距离"""
+    x = np.ascontiguousarray(np.bitwise_xor(a, b), dtype=np.uint64)
+    return _POPCOUNT8[x.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def _probe_masks(radius: int) -> np.ndarray:
+    """一段内所有汉明距离 <= radius 的异或掩码"""
+    masks = [0]
+    for r in range(1, radius + 1):
+        for bits in combinations(range(CHUNK_BITS), r):
+            masks.append(sum(1 << b for b in bits))
+    return np.array(masks, dtype=np.int64)
+
+
+def find_near_duplicate_pairs(hashes: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    用多索引哈希查找汉明距离 <= threshold 的哈希对
+
+    Args:
+        hashes: uint64 数组（应已去除完全相同的哈希）
+        threshold: 最大汉明距离
+
+    Returns:
+        [K, 2] 下标对（i < j）
+    """
+    n = len(hashes)
+    if n < 2:
+        return np.zeros((0, 2), dtype=np.int64)
+
+    masks = _probe_masks(threshold // HASH_CHUNKS)
+    pairs = []
+    for c in range(HASH_CHUNKS):
+        sub = ((hashes >> np.uint64(c * CHUNK_BITS)) & np.uint64((1 << CHUNK_BITS) - 1)).astype(np.int64)
+        order = np.argsort(sub, kind='stable')
+        sorted_sub = sub[order]
+
+        for start in range(0, n, QUERY_BLOCK):
+            query = np.arange(start, min(start + QUERY_BLOCK, n), dtype=np.int64)
+            for mask in masks:
+                target = sub[query] ^ mask
+                lo = np.searchsorted(sorted_sub, target, side='left')
+                hi = np.searchsorted(sorted_sub, target, side='right')
+                lengths = hi - lo
+                if not lengths.any():
+                    continue
+                i = np.repeat(query, lengths)
+                j = order[expand_ranges(lo, lengths)]
+                keep = i < j
+                i, j = i[keep], j[keep]
+                close = hamming(hashes[i], hashes[j]) <= threshold
+                if close.any():
+                    pairs.append(np.stack([i[close], j[close]], axis=1))
+
+    if not pairs:
+        return np.zeros((0, 2), dtype=np.int64)
+    # 同一对可能在多个分段中被找到
+    return np.unique(np.concatenate(pairs), axis=0)
+
+
+def _union_find(n: int, pairs: np.ndarray) -> np.ndarray:
+    """并查集，返回每个元素所属簇的根"""
+    parent = np.arange(n)
+
+    def find(x: int) -> int:
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for a, b in pairs:
+        ra, rb = find(int(a)), find(int(b))
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+    return np.array([find(i) for i in range(n)])
+
+
+def cluster_hashes(hashes: np.ndarray, threshold: int) -> List[List[int]]:
+    """把哈希聚成近似重复簇（只返回包含 2 个及以上元素的簇）"""
+    # 完全相同的哈希（静止镜头的连续帧很常见）先合并，避免候选对数量爆炸
+    unique, inverse = np.unique(hashes, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    roots = _union_find(len(unique), find_near_duplicate_pairs(unique, threshold))
+    labels = roots[inverse]
+
+    order = np.argsort(labels, kind='stable')
+    sorted_labels = labels[order]
+    boundaries = np.flatnonzero(np.diff(sorted_labels)) + 1
+    return [group.tolist() for group in np.split(order, boundaries) if len(group) > 1]
+
+
+class DedupService:
+    """近似重复图片检测服务"""
+
+    def __init__(self):
+        self.cache_dir = settings.CACHE_DIR / "dedup"
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.workers = max(1, settings.IMAGE_WORKERS)
+
+    # ==================== 哈希计算 ====================
+
+    def _hash_cache_file(self, scope: str, name: str) -> Path:
+        return self.cache_dir / f"{scope}_{name}.hashes.json"
+
+    def compute_hashes(self, ctx: JobContext, scope: str, name: str, paths: List[str]) -> List[Optional[int]]:
+        """并行计算感知哈希（未变化的图片直接使用缓存），无法读取的图片哈希为 None"""
+        cache_file = self._hash_cache_file(scope, name)
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+
+        results: Dict[str, Any] = {}
+        todo: List[Tuple[str, List[int]]] = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            stamp = [st.st_mtime_ns, st.st_size]
+            cached = cache.get(path)
+            if cached and cached[:2] == stamp:
+                results[path] = cached
+            else:
+                todo.append((path, stamp))
+
+        if todo:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for idx, ((path, stamp), phash) in enumerate(
+                    zip(todo, pool.map(compute_phash, [p for p, _ in todo]))
+                ):
+                    results[path] = stamp + [phash]
+                    if idx % 200 == 0:
+                        ctx.update(
+                            progress=idx / len(todo) * 80,
+                            message=f"Hashed {idx}/{len(todo)} images"
+                        )
+
+        tmp_file = cache_file.with_suffix(".tmp")
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(results, f)
+        tmp_file.replace(cache_file)
+
+        return [results[p][2] if p in results else None for p in paths]
+
+    def _find_clusters(
+        self,
+        ctx: JobContext,
+        scope: str,
+        name: str,
+        paths: List[str],
+        threshold: int
+    ) -> Tuple[List[List[int]], int]:
+        """返回 (簇列表（paths 下标，第一个为保留的图片）, 无法读取的图片数)"""
+        hashes = self.compute_hashes(ctx, scope, name, paths)
+        valid = [i for i, h in enumerate(hashes) if h is not None]
+        ctx.update(progress=85, message="Searching near-duplicates")
+
+        clusters = []
+        for group in cluster_hashes(np.array([hashes[i] for i in valid], dtype=np.uint64), threshold):
+            members = [valid[k] for k in group]
+            # 保留文件最大的一张（通常质量最好），其余按路径排序
+            keep = max(members, key=lambda i: (os.path.getsize(paths[i]), -i))
+            clusters.append([keep] + sorted(i for i in members if i != keep))
+        clusters.sort(key=len, reverse=True)
+        return clusters, len(paths) - len(valid)
+
+    # ==================== 报告 ====================
+
+    def _report_file(self, scope: str, name: str) -> Path:
+        return self.cache_dir / f"{scope}_{name}.json"
+
+    def get_report(self, scope: str, name: str) -> Optional[Dict[str, Any]]:
+        """读取最近一次去重报告"""
+        report_file = self._report_file(scope, name)
+        if not report_file.exists():
+            return None
+        with open(report_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_report(self, scope: str, name: str, report: Dict[str, Any]):
+        with open(self._report_file(scope, name), 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    # ==================== 任务 ====================
+
+    def submit_dataset(self, name: str, request: DedupRequest) -> JobStatus:
+        """提交数据集去重任务"""
+        if request.action not in ("report", "drop", "group"):
+            raise ValueError(f"Unsupported action: {request.action}")
+        if not dataset_catalog_service.get_dataset(name):
+            raise FileNotFoundError(f"Dataset not found: {name}")
+        return job_service.submit("dedup", self._dataset_job, name, request, dedupe_key=f"dedup:dataset:{name}")
+
+    def submit_project(self, project_id: str, request: DedupRequest) -> JobStatus:
+        """提交标注项目去重任务"""
+        from backend.services.annotation_service import annotation_service
+
+        if request.action not in ("report", "drop", "group"):
+            raise ValueError(f"Unsupported action: {request.action}")
+        if not (annotation_service.projects_dir / project_id).exists():
+            raise FileNotFoundError(f"Project not found: {project_id}")
+        return job_service.submit("dedup", self._project_job, project_id, request, dedupe_key=f"dedup:project:{project_id}")
+
+    def _move_with_label(self, image_path: str, target_image: str) -> bool:
+        """移动图片及其 YOLO 标签文件（目标已存在时跳过）"""
+        if os.path.exists(target_image):
+            return False
+        os.makedirs(os.path.dirname(target_image), exist_ok=True)
+        shutil.move(image_path, target_image)
+
+        label_path = label_path_for(image_path)
+        if os.path.exists(label_path):
+            target_label = label_path_for(target_image)
+            os.makedirs(os.path.dirname(target_label), exist_ok=True)
+            shutil.move(label_path, target_label)
+        return True
+
+    def _dataset_job(self, ctx: JobContext, name: str, request: DedupRequest) -> Dict[str, Any]:
+        """数据集去重任务"""
+        dataset_dir = settings.DATASETS_DIR / name
+        images = dataset_catalog_service.list_images(name)
+        paths = [p for p, _, _ in images]
+        clusters, unreadable = self._find_clusters(ctx, "dataset", name, paths, request.threshold)
+
+        moved = 0
+        if request.action == "drop":
+            # 移到 duplicates/ 而不是直接删除，误判时可以恢复
+            ctx.update(progress=90, message="Moving duplicates out of the dataset")
+            for cluster in clusters:
+                for i in cluster[1:]:
+                    rel = os.path.relpath(paths[i], dataset_dir)
+                    if rel.startswith(".."):
+                        continue
+                    if self._move_with_label(paths[i], str(dataset_dir / "duplicates" / rel)):
+                        moved += 1
+        elif request.action == "group":
+            # 同簇图片移到保留图片所在的划分目录
+            ctx.update(progress=90, message="Moving cluster members into one split")
+            for cluster in clusters:
+                _, keep_split, keep_root = images[cluster[0]]
+                if keep_root is None:
+                    continue
+                for i in cluster[1:]:
+                    path, split, root = images[i]
+                    if split == keep_split or root is None:
+                        continue
+                    target = os.path.join(keep_root, os.path.relpath(path, root))
+                    if self._move_with_label(path, target):
+                        moved += 1
+
+        if moved:
+            dataset_catalog_service.refresh(name)
+
+        report = self._build_report(
+            request, len(paths), unreadable, clusters,
+            lambda i: os.path.relpath(paths[i], dataset_dir), lambda i: images[i][1]
+        )
+        report.update({"dataset_name": name, "moved": moved})
+        self._save_report("dataset", name, report)
+        return report
+
+    def _project_job(self, ctx: JobContext, project_id: str, request: DedupRequest) -> Dict[str, Any]:
+        """标注项目去重任务"""
+        from backend.services.annotation_service import annotation_service
+
+        image_files = annotation_service._list_image_files(project_id)
+        paths = [str(p) for p in image_files]
+        clusters, unreadable = self._find_clusters(ctx, "project", project_id, paths, request.threshold)
+        report = self._build_report(
+            request, len(paths), unreadable, clusters, lambda i: image_files[i].name, None
+        )
+        report["project_id"] = project_id
+
+        deleted = 0
+        if request.action == "drop":
+            ctx.update(progress=90, message="Deleting duplicates")
+            duplicates = [image_files[i].name for cluster in clusters for i in cluster[1:]]
+            deleted = annotation_service.delete_images(project_id, duplicates).get("deleted", 0)
+        report["deleted"] = deleted
+
+        # 项目的划分在导出 / 构建训练视图时按簇进行（report 不改变已有的分组设置）
+        dedup_file = annotation_service.projects_dir / project_id / "annotations" / "dedup.json"
+        group_splits = request.action == "group"
+        if request.action == "report" and dedup_file.exists():
+            with open(dedup_file, 'r', encoding='utf-8') as f:
+                group_splits = json.load(f).get("group_splits", False)
+        dedup_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(dedup_file, 'w', encoding='utf-8') as f:
+            json.dump({
+                "group_splits": group_splits,
+                "threshold": request.threshold,
+                "clusters": [] if request.action == "drop" else report["clusters"],
+                "created_at": report["created_at"]
+            }, f, ensure_ascii=False, indent=2)
+
+        report["group_splits"] = group_splits
+        self._save_report("project", project_id, report)
+        return report
+
+    def _build_report(self, request: DedupRequest, total: int, unreadable: int, clusters, name_of, split_of):
+        return {
+            "action": request.action,
+            "threshold": request.threshold,
+            "total_images": total,
+            "unreadable_images": unreadable,
+            "num_clusters": len(clusters),
+            "num_duplicates": sum(len(c) - 1 for c in clusters),
+            "cross_split_clusters": sum(
+                1 for c in clusters if len({split_of(i) for i in c}) > 1
+            ) if split_of else None,
+            "clusters": [
+                {
+                    "keep": name_of(c[0]),
+                    "members": [name_of(i) for i in c],
+                    **({"splits": sorted({split_of(i) for i in c})} if split_of else {})
+                }
+                for c in clusters
+            ],
+            "created_at": datetime.now().isoformat()
+        }
+
+
+# 全局服务实例
+dedup_service = DedupService()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+CPU 分布式数据并行训练 - 基于 PyTorch gloo 后端
+
+每个 rank 是一个独立进程：数据集按 rank 切分（DistributedSampler），
+每步反向传播后对梯度做 all-reduce 求平均，再执行优化器更新。
+仅 rank 0 负责验证和保存权重（由 Ultralytics 按 RANK 环境变量处理）。
+
+单机多进程由 YOLOService 自动拉起；多机训练时，在其他节点上执行:
+
+    python -m backend.services.distributed_training --config <job.json> --node-rank 1
+
+job.json 由主节点在训练输出目录中生成，各节点需能访问相同的数据集路径。
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+from pathlib import Path
+from datetime import datetime, timedelta
+from typing import List, Dict, Any
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).resolve().parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+
+def _write_json(path: Path, data: Dict[str, Any]):
+    """原子写入 JSON 文件（监控线程可能同时读取）"""
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _make_gloo_trainer(base_trainer):
+    """在 Ultralytics 训练器基础上增加 gloo 梯度同步"""
+    import torch
+    import torch.distributed as dist
+
+    class GlooTrainer(base_trainer):
+        def _setup_train(self, world_size):
+            super()._setup_train(world_size)
+            # 所有 rank 从 rank 0 的初始权重出发
+            for tensor in self.model.state_dict().values():
+                dist.broadcast(tensor, src=0)
+
+        def optimizer_step(self):
+            # 将所有梯度拼接为一个缓冲区，一次 all-reduce 完成同步
+            grads = [p.grad for p in self.model.parameters() if p.grad is not None]
+            if grads:
+                flat = torch.cat([g.reshape(-1) for g in grads])
+                dist.all_reduce(flat, op=dist.ReduceOp.SUM)
+                flat.div_(dist.get_world_size())
+                offset = 0
+                for g in grads:
+                    numel = g.numel()
+                    g.copy_(flat[offset:offset + numel].view_as(g))
+                    offset += numel
+            super().optimizer_step()
+
+    return GlooTrainer
+
+
+def run_worker(job: Dict[str, Any], rank: int, local_rank: int):
+    """运行单个训练 rank"""
+    job_dir = Path(job["job_dir"])
+    world_size = job["world_size"]
+    rank_file = job_dir / f"rank_{rank}.json"
+
+    # Ultralytics 在导入时读取 RANK / LOCAL_RANK，必须先设置环境变量
+    os.environ.update({
+        "RANK": str(rank),
+        "LOCAL_RANK": str(local_rank),
+        "WORLD_SIZE": str(world_size),
+        "MASTER_ADDR": job["master_addr"],
+        "MASTER_PORT": str(job["master_port"]),
+    })
+
+    import torch
+    import torch.distributed as dist
+
+    torch.set_num_threads(job["threads_per_rank"])
+    dist.init_process_group(
+        backend="gloo",
+        init_method=f"tcp://{job['master_addr']}:{job['master_port']}",
+        rank=rank,
+        world_size=world_size,
+        timeout=timedelta(minutes=30)
+    )
+
+    from ultralytics import YOLO
+
+    stats = {
+        "rank": rank,
+        "host": socket.gethostname(),
+        "state": "running",
+        "epoch": 0,
+        "images": 0,
+        "elapsed": 0.0,
+        "images_per_sec": 0.0,
+        "updated_at": datetime.now().isoformat()
+    }
+    start_time = time.time()
+    last_write = 0.0
+
+    def on_train_batch_end(trainer):
+        nonlocal last_write
+        now = time.time()
+        stats["epoch"] = trainer.epoch + 1
+        stats["images"] += job["batch_per_rank"]
+        stats["elapsed"] = now - start_time
+        stats["images_per_sec"] = stats["images"] / stats["elapsed"] if stats["elapsed"] > 0 else 0.0
+        stats["updated_at"] = datetime.now().isoformat()
+        if now - last_write >= 1.0:
+            _write_json(rank_file, stats)
+            last_write = now
+
+    def on_train_epoch_end(trainer):
+        # 汇总所有 rank 的吞吐量，远程节点的统计也能在主节点看到
+        gathered = [None] * world_size
+        dist.all_gather_object(gathered, dict(stats))
+        if rank == 0:
+            _write_json(job_dir / "ranks.json", {"ranks": gathered})
+
+    try:
+        model_type = job["model_type"]
+        model = YOLO(f"{model_type}.pt" if job["pretrained"] else f"{model_type}.yaml")
+        trainer_cls = _make_gloo_trainer(model.task_map[model.task]["trainer"])
+        model.add_callback("on_train_batch_end", on_train_batch_end)
+        model.add_callback("on_train_epoch_end", on_train_epoch_end)
+
+        results = model.train(
+            trainer=trainer_cls,
+            data=job["dataset_path"],
+            epochs=job["epochs"],
+            batch=job["batch_per_rank"],
+            imgsz=job["img_size"],
+            device="cpu",
+            patience=job["patience"],
+            save_period=job["save_period"],
+            project=job["project"],
+            name="train",
+            exist_ok=True,
+            pretrained=job["pretrained"],
+            optimizer=job["optimizer"],
+            lr0=job["lr0"],
+            lrf=job["lrf"],
+            verbose=rank == 0
+        )
+
+        stats["state"] = "completed"
+        if rank == 0 and results is not None and hasattr(results, 'results_dict'):
+            stats["final_metrics"] = results.results_dict
+    except Exception as e:
+        stats["state"] = "failed"
+        stats["error"] = str(e)
+        raise
+    finally:
+        stats["updated_at"] = datetime.now().isoformat()
+        _write_json(rank_file, stats)
+        if dist.is_initialized():
+            dist.destroy_process_group()
+
+
+def launch_local_workers(job_file: Path, job: Dict[str, Any], node_rank: int) -> List[subprocess.Popen]:
+    """在本机拉起 node_rank 对应的所有 rank 进程"""
+    processes = []
+    for local_rank in range(job["nproc_per_node"]):
+        cmd = [
+            sys.executable, "-m", "backend.services.distributed_training",
+            "--config", str(job_file),
+            "--node-rank", str(node_rank),
+            "--local-rank", str(local_rank)
+        ]
+        log_file = open(Path(job["job_dir"]) / f"node{node_rank}_local{local_rank}.log", 'w')
+        processes.append(subprocess.Popen(
+            cmd,
+            cwd=str(project_root),
+            stdout=log_file,
+            stderr=subprocess.STDOUT
+        ))
+        log_file.close()
+    return processes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU distributed (gloo) YOLO training worker")
+    parser.add_argument("--config", required=True, help="job.json generated by the master node")
+    parser.add_argument("--node-rank", type=int, default=0)
+    parser.add_argument("--local-rank", type=int, default=None)
+    args = parser.parse_args()
+
+    job_file = Path(args.config)
+    with open(job_file, 'r', encoding='utf-8') as f:
+        job = json.load(f)
+    Path(job["job_dir"]).mkdir(parents=True, exist_ok=True)
+
+    if args.local_rank is None:
+        # 远程节点入口：拉起本节点全部 rank 并等待结束
+        processes = launch_local_workers(job_file, job, args.node_rank)
+        sys.exit(max(p.wait() for p in processes))
+
+    rank = args.node_rank * job["nproc_per_node"] + args.local_rank
+    run_worker(job, rank, args.local_rank)
+
+
+if __name__ == "__main__":
+    main()
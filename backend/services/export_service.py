@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+模型导出服务 - 后台导出任务 + 导出产物缓存
+
+导出产物缓存在 EXPORTS_DIR/<cache_key>/ 下，cache_key 由模型文件 SHA256 和
+完整的导出配置共同决定。相同模型、相同配置的重复请求直接返回缓存结果，
+并发的相同请求合并为同一个后台任务。
+"""
+import json
+import uuid
+import shutil
+import hashlib
+import zipfile
+import threading
+from pathlib import Path
+from typing import Dict, Any, Optional
+from datetime import datetime
+
+from config.config import settings
+from backend.models.schemas import ExportConfig, JobStatus
+from backend.services.job_service import job_service, JobContext
+from backend.services.model_index_service import model_index_service
+from backend.utils.file_utils import link_file
+
+
+class ExportService:
+    """模型导出服务"""
+
+    def __init__(self):
+        self.cache_dir = settings.EXPORTS_DIR
+        self.work_dir = settings.EXPORTS_DIR / ".work"
+        # 导出非常耗 CPU / 内存，限制同时执行的导出数量
+        self._semaphore = threading.Semaphore(settings.EXPORT_WORKERS)
+
+    def resolve_model_path(self, model_path: str) -> Path:
+        """将模型名称或路径解析为本地文件路径"""
+        path = Path(model_path)
+        if not path.is_absolute() and not path.exists():
+            candidate = settings.MODELS_DIR / model_path
+            if candidate.exists():
+                return candidate
+        return path
+
+    def cache_key(self, config: ExportConfig) -> str:
+        """由模型文件哈希和导出配置计算缓存键"""
+        model_path = self.resolve_model_path(config.model_path)
+        if model_path.exists():
+            model_id = model_index_service.file_sha256(model_path)
+        else:
+            # 尚未下载的预训练模型，以名称区分
+            model_id = f"name:{config.model_path}"
+
+        options = config.dict()
+        options.pop("model_path")
+        if config.int8 and config.data and Path(config.data).exists():
+            # 校准数据集变化时 INT8 结果也会变化
+            options["data_mtime_ns"] = Path(config.data).stat().st_mtime_ns
+        payload = json.dumps({"model": model_id, "options": options}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:24]
+
+    def get_cached(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """读取缓存的导出结果"""
+        meta_file = self.cache_dir / cache_key / "export.json"
+        if not meta_file.exists():
+            return None
+        try:
+            with open(meta_file, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except Exception as e:
+            print(f"Error reading export cache {cache_key}: {e}")
+            return None
+        if not (self.cache_dir / cache_key / meta["artifact"]).exists():
+            return None
+        return self._result(cache_key, meta, cached=True)
+
+    def _result(self, cache_key: str, meta: Dict[str, Any], cached: bool) -> Dict[str, Any]:
+        return {
+            "cache_key": cache_key,
+            "cached": cached,
+            "format": meta["config"]["format"],
+            "task": meta.get("task"),
+            "export_path": str(self.cache_dir / cache_key / meta["artifact"]),
+            "created_at": meta["created_at"]
+        }
+
+    def submit(self, config: ExportConfig) -> JobStatus:
+        """提交导出任务：命中缓存时返回已完成的任务"""
+        cache_key = self.cache_key(config)
+
+        cached = self.get_cached(cache_key)
+        if cached:
+            return job_service.add_completed("export", cached, message="Export served from cache")
+
+        return job_service.submit(
+            "export",
+            self._export_job,
+            config,
+            cache_key,
+            dedupe_key=f"export:{cache_key}"
+        )
+
+    def export(self, config: ExportConfig) -> Dict[str, Any]:
+        """在当前线程中导出（供其他后台任务调用），命中缓存时直接返回"""
+        cache_key = self.cache_key(config)
+        return self.get_cached(cache_key) or self._export_job(None, config, cache_key)
+
+    def _export_job(self, ctx: Optional[JobContext], config: ExportConfig, cache_key: str) -> Dict[str, Any]:
+        """后台导出任务"""
+        from ultralytics import YOLO
+
+        if ctx:
+            ctx.update(progress=0, message="Waiting for export slot")
+        with self._semaphore:
+            # 等待期间可能已有其他任务完成了相同导出
+            cached = self.get_cached(cache_key)
+            if cached:
+                return cached
+
+            if ctx:
+                ctx.update(progress=10, message=f"Exporting to {config.format}")
+            work_dir = self.work_dir / f"{cache_key}_{uuid.uuid4().hex[:8]}"
+            work_dir.mkdir(parents=True, exist_ok=True)
+
+            try:
+                # 在独立目录中导出，避免产物写到模型旁边并互相覆盖
+                model_path = self.resolve_model_path(config.model_path)
+                if model_path.exists():
+                    work_model = work_dir / model_path.name
+                    link_file(model_path, work_model)
+                    model = YOLO(str(work_model))
+                else:
+                    work_model = None
+                    model = YOLO(config.model_path)
+
+                export_kwargs = dict(
+                    format=config.format,
+                    imgsz=config.img_size,
+                    batch=config.batch_size,
+                    optimize=config.optimize,
+                    half=config.half,
+                    simplify=config.simplify,
+                    dynamic=config.dynamic,
+                    opset=config.opset
+                )
+                if config.int8:
+                    export_kwargs.update(int8=True, data=config.data, fraction=config.fraction)
+                export_path = Path(model.export(**export_kwargs))
+                if work_dir.resolve() not in export_path.resolve().parents:
+                    # 预训练模型导出到当前目录，移入工作目录
+                    target = work_dir / export_path.name
+                    shutil.move(str(export_path), str(target))
+                    export_path = target
+                if work_model is not None and work_model.exists():
+                    work_model.unlink()
+
+                if ctx:
+                    ctx.update(progress=90, message="Publishing export artifact")
+                meta = {
+                    "cache_key": cache_key,
+                    "model_path": str(model_path),
+                    "config": config.dict(),
+                    "task": model.task,
+                    "artifact": str(export_path.relative_to(work_dir)),
+                    "created_at": datetime.now().isoformat()
+                }
+                with open(work_dir / "export.json", 'w', encoding='utf-8') as f:
+                    json.dump(meta, f, ensure_ascii=False, indent=2)
+
+                target_dir = self.cache_dir / cache_key
+                if target_dir.exists():
+                    shutil.rmtree(target_dir)
+                work_dir.rename(target_dir)
+                return self._result(cache_key, meta, cached=False)
+            finally:
+                if work_dir.exists():
+                    shutil.rmtree(work_dir, ignore_errors=True)
+
+    def get_download_path(self, job: JobStatus) -> Optional[Path]:
+        """获取可下载的导出文件，目录形式的产物（如 OpenVINO）打包为 zip"""
+        if job.status != "completed" or not job.result:
+            return None
+
+        artifact = Path(job.result["export_path"])
+        if not artifact.exists():
+            return None
+        if artifact.is_file():
+            return artifact
+
+        zip_path = artifact.with_name(artifact.name + ".zip")
+        if not zip_path.exists():
+            tmp_path = zip_path.with_suffix(".zip.tmp")
+            with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                for file_path in artifact.rglob("*"):
+                    if file_path.is_file():
+                        zipf.write(file_path, file_path.relative_to(artifact.parent))
+            tmp_path.replace(zip_path)
+        return zip_path
+
+
+# 全局服务实例
+export_service = ExportService()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+后台任务服务 - 导出等耗时操作在后台线程中执行，通过 job_id 轮询状态
+
+每种任务类型只保留最近 JOB_HISTORY_SIZE 个已结束的任务（提交新任务时清理更早的任务及其结果）。
+
+取消是协作式的：cancel() 只设置标记，任务函数在合适的位置调用 ctx.check_cancelled() 退出。
+只有提交时声明 cancellable=True（任务函数会检查取消标记）的任务可以取消。
+"""
+import uuid
+import threading
+import traceback
+from typing import Callable, Dict, Any, List, Optional
+from datetime import datetime
+
+from config.config import settings
+from backend.models.schemas import JobStatus
+
+
+# 任务结束后的状态
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    """任务被取消（由 JobContext.check_cancelled 抛出）"""
+
+
+class JobContext:
+    """传给任务函数的上下文，用于汇报进度"""
+
+    def __init__(self, service: "JobService", job_id: str):
+        self._service = service
+        self.job_id = job_id
+
+    def update(self, progress: Optional[float] = None, message: Optional[str] = None):
+        """更新任务进度（0-100）和提示信息"""
+        self._service._update(self.job_id, progress=progress, message=message)
+
+    @property
+    def cancelled(self) -> bool:
+        """是否已请求取消"""
+        return self._service._cancel_events[self.job_id].is_set()
+
+    def check_cancelled(self):
+        """已请求取消时抛出 JobCancelled"""
+        if self.cancelled:
+            raise JobCancelled()
+
+
+class JobService:
+    """后台任务管理"""
+
+    def __init__(self):
+        self.history_size = max(0, settings.JOB_HISTORY_SIZE)
+        self.jobs: Dict[str, JobStatus] = {}
+        # dedupe_key -> job_id，相同任务并发提交时合并为一个
+        self._active_keys: Dict[str, str] = {}
+        self._cancel_events: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        job_type: str,
+        func: Callable[..., Dict[str, Any]],
+        *args,
+        dedupe_key: Optional[str] = None,
+        job_id: Optional[str] = None,
+        cancellable: bool = False,
+        **kwargs
+    ) -> JobStatus:
+        """
+        提交后台任务
+
+        Args:
+            job_type: 任务类型
+            func: 任务函数，签名为 func(ctx, *args, **kwargs)，返回结果字典
+            dedupe_key: 去重键，相同键的任务正在执行时直接返回该任务
+            job_id: 指定任务ID（恢复中断的任务时沿用原ID），默认自动生成
+            cancellable: 任务函数是否会调用 ctx.check_cancelled()，否则 cancel() 拒绝取消
+
+        Returns:
+            任务状态
+        """
+        with self._lock:
+            if dedupe_key and dedupe_key in self._active_keys:
+                return self.jobs[self._active_keys[dedupe_key]]
+            self._prune(job_type)
+
+            job_id = job_id or f"{job_type}_{uuid.uuid4().hex[:12]}"
+            now = datetime.now()
+            job = JobStatus(
+                job_id=job_id,
+                job_type=job_type,
+                status="pending",
+                cancellable=cancellable,
+                created_at=now,
+                updated_at=now
+            )
+            self.jobs[job_id] = job
+            self._cancel_events[job_id] = threading.Event()
+            if dedupe_key:
+                self._active_keys[dedupe_key] = job_id
+
+        thread = threading.Thread(
+            target=self._run,
+            args=(job_id, dedupe_key, func, args, kwargs),
+            daemon=True
+        )
+        thread.start()
+        return job
+
+    def add_completed(self, job_type: str, result: Dict[str, Any], message: str = "") -> JobStatus:
+        """登记一个已完成的任务（例如命中缓存），便于客户端统一轮询"""
+        now = datetime.now()
+        job = JobStatus(
+            job_id=f"{job_type}_{uuid.uuid4().hex[:12]}",
+            job_type=job_type,
+            status="completed",
+            progress=100.0,
+            message=message,
+            result=result,
+            created_at=now,
+            updated_at=now
+        )
+        with self._lock:
+            self._prune(job_type)
+            self.jobs[job.job_id] = job
+        return job
+
+    def _prune(self, job_type: str):
+        """删除该类型中超出保留数量的最早的已结束任务（调用方持有锁）"""
+        finished = [
+            j for j in self.jobs.values()
+            if j.job_type == job_type and j.status in FINISHED_STATUSES
+        ]
+        excess = len(finished) - self.history_size
+        if excess <= 0:
+            return
+        finished.sort(key=lambda j: j.updated_at)
+        for job in finished[:excess]:
+            del self.jobs[job.job_id]
+            self._cancel_events.pop(job.job_id, None)
+
+    def _run(self, job_id: str, dedupe_key: Optional[str], func, args, kwargs):
+        """执行任务"""
+        job = self.jobs[job_id]
+        job.status = "running"
+        job.updated_at = datetime.now()
+
+        try:
+            result = func(JobContext(self, job_id), *args, **kwargs)
+            job.result = result
+            job.status = "completed"
+            job.progress = 100.0
+        except JobCancelled:
+            print(f"[{job_id}] 任务已取消")
+            job.status = "cancelled"
+            job.message = "Cancelled"
+        except Exception as e:
+            print(f"[{job_id}] 任务失败: {e}")
+            traceback.print_exc()
+            job.status = "failed"
+            job.error_message = str(e)
+        finally:
+            job.updated_at = datetime.now()
+            with self._lock:
+                if dedupe_key and self._active_keys.get(dedupe_key) == job_id:
+                    del self._active_keys[dedupe_key]
+
+    def _update(self, job_id: str, progress: Optional[float] = None, message: Optional[str] = None):
+        job = self.jobs.get(job_id)
+        if not job:
+            return
+        if progress is not None:
+            job.progress = max(0.0, min(float(progress), 100.0))
+        if message is not None:
+            job.message = message
+        job.updated_at = datetime.now()
+
+    def cancel(self, job_id: str) -> Optional[JobStatus]:
+        """
+        请求取消任务（任务函数检查到后退出）
+
+        Returns:
+            任务状态，任务不存在时返回 None
+
+        Raises:
+            ValueError: 任务已结束或不支持取消
+        """
+        job = self.jobs.get(job_id)
+        if not job:
+            return None
+        if job.status in FINISHED_STATUSES:
+            raise ValueError(f"Job is already {job.status}")
+        if not job.cancellable:
+            raise ValueError(f"{job.job_type} jobs cannot be cancelled")
+        self._cancel_events[job_id].set()
+        self._update(job_id, message="Cancelling")
+        return job
+
+    def get(self, job_id: str) -> Optional[JobStatus]:
+        """获取任务状态"""
+        return self.jobs.get(job_id)
+
+    def list(self, job_type: Optional[str] = None) -> List[JobStatus]:
+        """列出任务"""
+        return [j for j in self.jobs.values() if job_type is None or j.job_type == job_type]
+
+
+# 全局服务实例
+job_service = JobService()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+模型元数据索引服务
+
+/models/list 和 /system/info 只需要模型的任务类型和类别名称，没有必要为每个
+.pt 文件构建完整的 YOLO 模型。本服务直接解析 checkpoint 中的 pickle 元数据
+（不读取任何权重张量），并以 (路径, 大小, 修改时间) 为键持久化缓存结果。
+"""
+import json
+import pickle
+import hashlib
+import zipfile
+import threading
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+from datetime import datetime
+
+from config.config import settings
+from backend.models.schemas import ModelInfo
+
+
+# 反序列化时允许使用真实实现的对象，其余一律替换为占位对象（不会执行任何代码）
+_SAFE_GLOBALS = {
+    ("builtins", "dict"), ("builtins", "list"), ("builtins", "tuple"),
+    ("builtins", "set"), ("builtins", "frozenset"), ("builtins", "str"),
+    ("builtins", "int"), ("builtins", "float"), ("builtins", "bool"),
+    ("builtins", "bytes"), ("builtins", "bytearray"), ("builtins", "complex"),
+    ("builtins", "slice"), ("builtins", "object"),
+    ("collections", "OrderedDict"),
+    ("copyreg", "_reconstructor"),
+    ("_codecs", "encode"),
+}
+
+# 模型类名 -> 任务类型
+_TASK_BY_MODEL_CLASS = {
+    "DetectionModel": "detect",
+    "SegmentationModel": "segment",
+    "PoseModel": "pose",
+    "ClassificationModel": "classify",
+    "OBBModel": "obb",
+    "WorldModel": "detect",
+    "RTDETRDetectionModel": "detect",
+}
+
+
+class _Stub:
+    """占位对象：接受任意构造参数，只保留反序列化得到的属性字典"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple):
+            state = next((s for s in state if isinstance(s, dict)), {})
+        if isinstance(state, dict):
+            self.__dict__.update(state)
+
+
+class _MetadataUnpickler(pickle.Unpickler):
+    """只解析 checkpoint 结构，不加载张量数据"""
+
+    _stub_classes: Dict[tuple, type] = {}
+
+    def find_class(self, module, name):
+        if (module, name) in _SAFE_GLOBALS:
+            return super().find_class(module, name)
+        key = (module, name)
+        if key not in self._stub_classes:
+            self._stub_classes[key] = type(name, (_Stub,), {"__module__": module})
+        return self._stub_classes[key]
+
+    def persistent_load(self, pid):
+        # 张量存储引用，元数据读取不需要
+        return None
+
+
+def read_checkpoint_metadata(model_path: Path) -> Dict[str, Any]:
+    """
+    读取 YOLO checkpoint 的任务类型、类别和输入尺寸，不构建模型
+
+    Args:
+        model_path: .pt 文件路径（PyTorch zip 格式）
+
+    Returns:
+        {"task": str, "classes": List[str], "input_shape": Optional[List[int]]}
+    """
+    with zipfile.ZipFile(model_path) as zf:
+        pkl_name = next(n for n in zf.namelist() if n.endswith("data.pkl"))
+        with zf.open(pkl_name) as f:
+            ckpt = _MetadataUnpickler(f).load()
+
+    if not isinstance(ckpt, dict):
+        raise ValueError("Unsupported checkpoint layout")
+
+    model = ckpt.get("ema") or ckpt.get("model")
+    model_attrs = getattr(model, "__dict__", {})
+    train_args = ckpt.get("train_args") if isinstance(ckpt.get("train_args"), dict) else {}
+
+    names = model_attrs.get("names") or {}
+    if isinstance(names, dict):
+        classes = [str(names[k]) for k in sorted(names)]
+    else:
+        classes = [str(n) for n in names]
+
+    task = train_args.get("task") or model_attrs.get("task")
+    if not task:
+        task = _TASK_BY_MODEL_CLASS.get(type(model).__name__, "detect" if classes else "unknown")
+
+    input_shape = None
+    imgsz = train_args.get("imgsz")
+    if isinstance(imgsz, int):
+        input_shape = [imgsz, imgsz]
+    elif isinstance(imgsz, (list, tuple)) and len(imgsz) == 2:
+        input_shape = [int(imgsz[0]), int(imgsz[1])]
+
+    return {"task": task, "classes": classes, "input_shape": input_shape}
+
+
+def _read_metadata_with_yolo(model_path: Path) -> Dict[str, Any]:
+    """解析失败时的回退方案：完整加载模型"""
+    from ultralytics import YOLO
+
+    model = YOLO(str(model_path))
+    classes = list(model.names.values()) if hasattr(model, 'names') else []
+    return {"task": model.task, "classes": classes, "input_shape": None}
+
+
+class ModelIndexService:
+    """模型元数据索引（持久化到 CACHE_DIR/model_index.json）"""
+
+    def __init__(self):
+        self.index_file = settings.CACHE_DIR / "model_index.json"
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = self._load_index()
+
+    def _load_index(self) -> Dict[str, Dict[str, Any]]:
+        """加载索引文件"""
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                return json.load(f).get("models", {})
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"Error loading model index: {e}")
+            return {}
+
+    def _save_index(self):
+        """保存索引文件（先写临时文件再替换）"""
+        try:
+            tmp_file = self.index_file.with_suffix(".tmp")
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({"models": self._entries}, f, ensure_ascii=False)
+            tmp_file.replace(self.index_file)
+        except Exception as e:
+            print(f"Error saving model index: {e}")
+
+    def _refresh_entry(self, model_file: Path, stat) -> bool:
+        """按大小和修改时间检查条目，必要时重新读取元数据。返回是否有变化"""
+        key = str(model_file)
+        entry = self._entries.get(key)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return False
+
+        try:
+            metadata = read_checkpoint_metadata(model_file)
+        except Exception:
+            try:
+                metadata = _read_metadata_with_yolo(model_file)
+            except Exception as e:
+                print(f"Error reading model {model_file}: {e}")
+                metadata = {"task": "unknown", "classes": [], "input_shape": None}
+
+        self._entries[key] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            **metadata
+        }
+        return True
+
+    def list_models(self) -> List[ModelInfo]:
+        """列出 MODELS_DIR 下的所有模型，只对新增或变化的文件读取元数据"""
+        models = []
+        with self._lock:
+            changed = False
+            seen = set()
+
+            for model_file in settings.MODELS_DIR.glob("**/*.pt"):
+                try:
+                    stat = model_file.stat()
+                except OSError:
+                    continue
+
+                key = str(model_file)
+                seen.add(key)
+                changed |= self._refresh_entry(model_file, stat)
+                entry = self._entries[key]
+
+                models.append(ModelInfo(
+                    name=model_file.name,
+                    path=key,
+                    size=stat.st_size,
+                    created_at=datetime.fromtimestamp(stat.st_ctime),
+                    model_type="yolo",
+                    task=entry["task"],
+                    input_shape=entry.get("input_shape"),
+                    classes=entry["classes"]
+                ))
+
+            # 清理已删除的模型（MODELS_DIR 之外的条目由 get_metadata/file_sha256 维护）
+            models_dir = str(settings.MODELS_DIR)
+            for key in list(self._entries):
+                if key.startswith(models_dir) and key not in seen:
+                    del self._entries[key]
+                    changed = True
+
+            if changed:
+                self._save_index()
+
+        return models
+
+    def get_metadata(self, model_path: Path) -> Optional[Dict[str, Any]]:
+        """获取单个模型的元数据"""
+        model_path = Path(model_path)
+        try:
+            stat = model_path.stat()
+        except OSError:
+            return None
+
+        with self._lock:
+            if self._refresh_entry(model_path, stat):
+                self._save_index()
+            return dict(self._entries[str(model_path)])
+
+    def file_sha256(self, model_path: Path) -> str:
+        """
+        获取模型文件的 SHA256（按大小和修改时间缓存，文件不变时不重复计算）
+        """
+        model_path = Path(model_path)
+        stat = model_path.stat()
+        key = str(model_path)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if (entry and entry.get("sha256") and entry["size"] == stat.st_size
+                    and entry["mtime_ns"] == stat.st_mtime_ns):
+                return entry["sha256"]
+
+        sha = hashlib.sha256()
+        with open(model_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+
+        with self._lock:
+            self._refresh_entry(model_path, stat)
+            self._entries[key]["sha256"] = digest
+            self._save_index()
+        return digest
+
+    def invalidate(self, model_path: Path):
+        """模型文件被替换或删除时清除缓存条目"""
+        with self._lock:
+            if self._entries.pop(str(model_path), None) is not None:
+                self._save_index()
+
+
+# 全局服务实例
+model_index_service = ModelIndexService()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+图片预览服务
+
+按需为标注项目和数据集中的图片生成缩放后的预览图：
+- thumb：最长边 256，用于列表 / 网格缩略图
+- medium：最长边 1024，用于预览和标注画布
+- full：原图，不重新编码
+
+预览图在线程池中生成（JPEG 使用 Pillow 的 draft 模式按 1/2、1/4、1/8 缩放解码，
+大图生成缩略图时不需要完整解码），缓存在 CACHE_DIR/previews/ 下，总大小超过
+PREVIEW_CACHE_SIZE 时按最近访问时间淘汰。
+
+缓存键和 ETag 由源文件路径、mtime 和大小得到，图片被替换后自动失效。URL 中带上
+?v=<版本> 时响应可以被浏览器永久缓存（Cache-Control: immutable）。
+"""
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from urllib.parse import quote
+
+from PIL import Image, ImageOps
+
+from config.config import settings
+
+
+# 预览尺寸（最长边像素），None 表示原图
+VARIANTS: Dict[str, Optional[int]] = {
+    "thumb": 256,
+    "medium": 1024,
+    "full": None
+}
+
+JPEG_QUALITY = 85
+
+# 版本化 URL 的缓存头：内容由版本号决定，永不变化
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# 未带版本号的 URL：允许缓存，但每次使用前用 ETag 重新验证
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+def source_version(path: Path) -> Optional[str]:
+    """源图片的版本标识（路径 + mtime + 大小），文件不存在时返回 None"""
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    key = f"{path.resolve()}:{st.st_mtime_ns}:{st.st_size}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def render_preview(source: Path, target: Path, max_side: int):
+    """生成最长边不超过 max_side 的 JPEG 预览图（原子写入）"""
+    with Image.open(source) as image:
+        # JPEG 按 2 的幂缩放解码，保证结果不小于目标尺寸
+        image.draft("RGB", (max_side, max_side))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "L"):
+            # 透明图片铺白底
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.getchannel("A"))
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        tmp_file = target.with_name(f".{target.name}.{threading.get_ident()}.tmp")
+        image.save(tmp_file, "JPEG", quality=JPEG_QUALITY, optimize=True)
+    tmp_file.replace(target)
+
+
+class PreviewService:
+    """图片预览服务"""
+
+    def __init__(self):
+        self.cache_dir = settings.CACHE_DIR / "previews"
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_cache_bytes = settings.PREVIEW_CACHE_SIZE
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, settings.IMAGE_WORKERS),
+            thread_name_prefix="preview"
+        )
+        self._lock = threading.Lock()
+        # 正在生成的预览：同一张图片的并发请求共用一次编码
+        self._pending: Dict[str, Future] = {}
+        # 缓存文件 -> 大小，按最近访问排序（最早的在前）
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._cache_bytes = 0
+        self._load_entries()
+
+    def _load_entries(self):
+        """启动时按 mtime 恢复 LRU 顺序（命中缓存时会更新文件 mtime）"""
+        files = []
+        for path in self.cache_dir.glob("*/*.jpg"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime_ns, str(path), st.st_size))
+        for _, path, size in sorted(files):
+            self._entries[path] = size
+            self._cache_bytes += size
+
+    # ==================== 源图片 ====================
+
+    def resolve_project_image(self, project_id: str, image_name: str) -> Optional[Path]:
+        """标注项目中的图片路径"""
+        return self._resolve(settings.DATA_DIR / "annotation_projects" / project_id / "images", image_name)
+
+    def resolve_dataset_image(self, dataset_name: str, image_path: str) -> Optional[Path]:
+        """数据集中的图片路径（相对数据集目录）"""
+        return self._resolve(settings.DATASETS_DIR / dataset_name, image_path)
+
+    def _resolve(self, root: Path, relative: str) -> Optional[Path]:
+        root = root.resolve()
+        path = (root / relative).resolve()
+        # 不允许通过 .. 访问根目录之外的文件
+        if root not in path.parents or not path.is_file():
+            return None
+        return path
+
+    def project_image_url(self, project_id: str, image_path: Path, size: str = "thumb") -> str:
+        """带版本号的项目图片预览 URL"""
+        version = source_version(image_path) or "0"
+        return (
+            f"/api/v1/preview/project/{quote(project_id)}/{quote(image_path.name)}"
+            f"?size={size}&v={version}"
+        )
+
+    # ==================== 预览图 ====================
+
+    def get_preview(self, source: Path, size: str) -> Optional[Tuple[Path, str]]:
+        """
+        获取预览图文件（阻塞直到生成完成）
+
+        Args:
+            source: 源图片路径
+            size: thumb / medium / full
+
+        Returns:
+            (文件路径, ETag)，源图片不存在时返回 None
+        """
+        if size not in VARIANTS:
+            raise ValueError(f"Unknown preview size: {size}")
+
+        version = source_version(source)
+        if version is None:
+            return None
+        etag = f'"{version}-{size}"'
+
+        max_side = VARIANTS[size]
+        if max_side is None:
+            return source, etag
+
+        key = hashlib.sha1(f"{version}:{size}".encode("utf-8")).hexdigest()
+        target = self.cache_dir / key[:2] / f"{key}.jpg"
+
+        with self._lock:
+            if str(target) in self._entries and self._touch(target):
+                return target, etag
+            future = self._pending.get(key)
+            if future is None:
+                future = self._executor.submit(self._generate, key, source, target, max_side)
+                self._pending[key] = future
+
+        future.result()
+        return target, etag
+
+    def _touch(self, target: Path) -> bool:
+        """标记为最近访问（调用方持有锁），缓存文件已不存在时返回 False"""
+        try:
+            os.utime(target)
+        except OSError:
+            # 文件被外部删除：从索引中移除并重新生成
+            self._cache_bytes -= self._entries.pop(str(target))
+            return False
+        self._entries.move_to_end(str(target))
+        return True
+
+    def _generate(self, key: str, source: Path, target: Path, max_side: int):
+        try:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            render_preview(source, target, max_side)
+            size = target.stat().st_size
+            with self._lock:
+                self._entries[str(target)] = size
+                self._entries.move_to_end(str(target))
+                self._cache_bytes += size
+                self._evict(keep=str(target))
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def _evict(self, keep: str):
+        """删除最久未访问的预览图直到缓存大小不超过上限（调用方持有锁）"""
+        while self._cache_bytes > self.max_cache_bytes and len(self._entries) > 1:
+            path, size = next(iter(self._entries.items()))
+            if path == keep:
+                break
+            del self._entries[path]
+            self._cache_bytes -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def get_cache_info(self) -> Dict[str, int]:
+        """预览缓存使用情况"""
+        with self._lock:
+            return {
+                "files": len(self._entries),
+                "size_bytes": self._cache_bytes,
+                "max_size_bytes": self.max_cache_bytes
+            }
+
+
+# 全局服务实例
+preview_service = PreviewService()
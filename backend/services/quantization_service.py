@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+INT8 量化服务
+
+使用已注册的数据集或标注项目作为校准数据，将模型导出为 INT8（OpenVINO / TFLite），
+随后在同一数据集的验证集上比较 INT8 与 FP32 模型的 mAP，并测量 CPU 推理加速比。
+精度损失在允许范围内时，量化模型会被设为该模型在本机的默认推理引擎。
+"""
+import json
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Any, Optional, Iterator
+from datetime import datetime
+
+from config.config import settings
+from backend.models.schemas import ExportConfig, QuantizeRequest, JobStatus
+from backend.services.job_service import job_service, JobContext
+from backend.services.export_service import export_service
+from backend.services.benchmark_service import benchmark_service
+from backend.services.model_index_service import model_index_service
+
+
+# 支持 INT8 校准导出的 CPU 格式
+INT8_FORMATS = ["openvino", "tflite"]
+
+
+class QuantizationService:
+    """INT8 量化服务"""
+
+    def __init__(self):
+        self.reports_dir = benchmark_service.results_dir
+
+    @contextmanager
+    def calibration_data(self, request: QuantizeRequest) -> Iterator[Path]:
+        """
+        获取校准数据集的 data.yaml
+        
+        标注项目使用不可变的版本化训练视图，并在 with 块内占用，
+        期间项目被修改或重新构建视图都不会影响正在进行的校准和验证。
+        """
+        if request.project_id:
+            from backend.services.annotation_service import annotation_service
+
+            with annotation_service.use_training_view(request.project_id) as data_yaml:
+                if not data_yaml:
+                    raise FileNotFoundError(f"Annotation project not found or empty: {request.project_id}")
+                yield data_yaml
+            return
+
+        if request.dataset_name:
+            data_yaml = settings.DATASETS_DIR / request.dataset_name / "data.yaml"
+            if not data_yaml.exists():
+                raise FileNotFoundError(f"Dataset not found: {request.dataset_name}")
+            yield data_yaml
+            return
+
+        raise ValueError("dataset_name or project_id is required for calibration")
+
+    def get_report(self, model_name: str) -> Optional[Dict[str, Any]]:
+        """读取最近一次量化报告"""
+        report_file = self.reports_dir / f"{Path(model_name).stem}.int8.json"
+        if not report_file.exists():
+            return None
+        with open(report_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def submit(self, request: QuantizeRequest) -> JobStatus:
+        """提交量化任务"""
+        if request.format not in INT8_FORMATS:
+            raise ValueError(f"INT8 export is supported for: {', '.join(INT8_FORMATS)}")
+        if not (request.dataset_name or request.project_id):
+            raise ValueError("dataset_name or project_id is required for calibration")
+
+        return job_service.submit(
+            "quantize",
+            self._quantize_job,
+            request,
+            dedupe_key=f"quantize:{request.model_name}:{request.format}"
+        )
+
+    def _validate(self, model_path: str, task: Optional[str], data_yaml: Path, img_size: int) -> Dict[str, float]:
+        """在校准数据集的验证集上计算 mAP"""
+        from ultralytics import YOLO
+
+        metrics = YOLO(model_path, task=task).val(
+            data=str(data_yaml),
+            imgsz=img_size,
+            batch=1,
+            device="cpu",
+            plots=False,
+            verbose=False
+        )
+        return {
+            "map50": round(float(metrics.box.map50), 4),
+            "map50_95": round(float(metrics.box.map), 4)
+        }
+
+    def _quantize_job(self, ctx: JobContext, request: QuantizeRequest) -> Dict[str, Any]:
+        """后台量化任务"""
+        model_path = export_service.resolve_model_path(request.model_name)
+        if not model_path.exists():
+            raise FileNotFoundError(f"Model not found: {request.model_name}")
+
+        task = (model_index_service.get_metadata(model_path) or {}).get("task")
+        with self.calibration_data(request) as data_yaml:
+            # 1. FP32 与 INT8 导出（同一格式，便于比较加速比）
+            ctx.update(progress=5, message=f"Exporting FP32 {request.format}")
+            fp32 = export_service.export(ExportConfig(
+                model_path=str(model_path),
+                format=request.format,
+                img_size=[request.img_size, request.img_size]
+            ))
+
+            ctx.update(progress=20, message=f"Calibrating INT8 {request.format}")
+            int8 = export_service.export(ExportConfig(
+                model_path=str(model_path),
+                format=request.format,
+                img_size=[request.img_size, request.img_size],
+                int8=True,
+                data=str(data_yaml),
+                fraction=request.fraction
+            ))
+
+            # 2. 精度对比
+            ctx.update(progress=50, message="Validating FP32 model")
+            fp32_metrics = self._validate(str(model_path), task, data_yaml, request.img_size)
+            ctx.update(progress=65, message="Validating INT8 model")
+            int8_metrics = self._validate(int8["export_path"], task, data_yaml, request.img_size)
+        map_drop = round(fp32_metrics["map50_95"] - int8_metrics["map50_95"], 4)
+
+        # 3. 速度对比（batch=1）
+        ctx.update(progress=80, message="Measuring CPU latency")
+        images = benchmark_service.load_images()
+        latency = {}
+        for name, artifact in (("torch", str(model_path)), ("fp32", fp32["export_path"]), ("int8", int8["export_path"])):
+            latency[name] = benchmark_service.measure(artifact, task, images, request.img_size, 1, 20)
+
+        int8_p50 = latency["int8"]["latency_p50_ms"]
+        report = {
+            "model_name": request.model_name,
+            "model_sha256": model_index_service.file_sha256(model_path),
+            "host": benchmark_service.host,
+            "format": request.format,
+            "img_size": request.img_size,
+            "calibration_data": str(data_yaml),
+            "artifact": int8["export_path"],
+            "fp32_metrics": fp32_metrics,
+            "int8_metrics": int8_metrics,
+            "map_drop": map_drop,
+            "latency": latency,
+            "speedup_vs_torch": round(latency["torch"]["latency_p50_ms"] / int8_p50, 2) if int8_p50 else None,
+            "speedup_vs_fp32": round(latency["fp32"]["latency_p50_ms"] / int8_p50, 2) if int8_p50 else None,
+            "accuracy_ok": map_drop <= request.map_tolerance,
+            "registered": False,
+            "created_at": datetime.now().isoformat()
+        }
+
+        # 4. 注册为默认推理引擎
+        if request.register_engine and report["accuracy_ok"]:
+            benchmark_service.set_serving_engine(request.model_name, {
+                "format": request.format,
+                "artifact": int8["export_path"],
+                "img_size": request.img_size,
+                "batch_size": 1,
+                "task": task,
+                "int8": True,
+                "latency_p50_ms": int8_p50,
+                "speedup": report["speedup_vs_torch"],
+                "map_drop": map_drop
+            })
+            report["registered"] = True
+
+        with open(self.reports_dir / f"{model_path.stem}.int8.json", 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        return report
+
+
+# 全局服务实例
+quantization_service = QuantizationService()
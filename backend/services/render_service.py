@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+渲染结果缓存服务
+
+在线程池中执行渲染函数（如标注可视化），把得到的 JPEG 字节缓存在内存中，
+总大小超过 RENDER_CACHE_SIZE 时按最近访问时间淘汰。渲染结果不写入磁盘。
+
+缓存键由调用方决定，应包含影响输出的全部内容（源图片版本、标注版本、输出尺寸和质量等），
+内容变化后使用新的键，旧结果随 LRU 淘汰。同一个键的并发请求共用一次渲染。
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, Dict
+
+from config.config import settings
+
+
+class RenderService:
+    """渲染结果缓存服务"""
+
+    def __init__(self):
+        self.max_cache_bytes = settings.RENDER_CACHE_SIZE
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, settings.IMAGE_WORKERS),
+            thread_name_prefix="render"
+        )
+        self._lock = threading.Lock()
+        # 正在渲染的键：同一个键的并发请求共用一次渲染
+        self._pending: Dict[str, Future] = {}
+        # 缓存键 -> 渲染结果，按最近访问排序（最早的在前）
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._cache_bytes = 0
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key: str, render: Callable[[], bytes]) -> bytes:
+        """
+        获取渲染结果（阻塞直到渲染完成）
+
+        Args:
+            key: 缓存键
+            render: 缓存未命中时在线程池中执行的渲染函数，返回编码后的字节
+
+        Returns:
+            渲染结果
+        """
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return data
+            self._misses += 1
+            future = self._pending.get(key)
+            if future is None:
+                future = self._executor.submit(self._render, key, render)
+                self._pending[key] = future
+
+        return future.result()
+
+    def _render(self, key: str, render: Callable[[], bytes]) -> bytes:
+        try:
+            data = render()
+            with self._lock:
+                self._entries[key] = data
+                self._entries.move_to_end(key)
+                self._cache_bytes += len(data)
+                self._evict(keep=key)
+            return data
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def _evict(self, keep: str):
+        """淘汰最久未访问的结果直到缓存大小不超过上限（调用方持有锁）"""
+        while self._cache_bytes > self.max_cache_bytes and len(self._entries) > 1:
+            key, data = next(iter(self._entries.items()))
+            if key == keep:
+                break
+            del self._entries[key]
+            self._cache_bytes -= len(data)
+
+    def get_cache_info(self) -> Dict[str, int]:
+        """渲染缓存使用情况"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self._cache_bytes,
+                "max_size_bytes": self.max_cache_bytes,
+                "hits": self._hits,
+                "misses": self._misses
+            }
+
+
+# 全局服务实例
+render_service = RenderService()
@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+分片数据集服务
+
+- 打包：按划分顺序把数据集的图片和标签写入 <dataset>/shards/（backend/utils/shard_store.py），
+  目录结构统一为 images/<划分>/...、labels/<划分>/...，data.yaml 随索引保存
+- 还原：把分片解包为普通的 YOLO 数据集目录（原数据集或新数据集）
+- 训练：分片顺序读取到本地目录（SHARD_VIEW_DIR，应指向本地磁盘），同一版本的分片只读取一次
+- 批量推理 / 自动标注：流式读取分片，解码线程池 + 批量推理，结果写为 JSON Lines；
+  自动标注时把预测框作为标签，与原图一起写入新的分片数据集
+"""
+import os
+import json
+import time
+import shutil
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Iterator, Callable
+
+import cv2
+import numpy as np
+import yaml
+
+from config.config import settings
+from backend.models.schemas import ShardPackRequest, ShardUnpackRequest, ShardPredictRequest, JobStatus
+from backend.services.job_service import job_service, JobContext
+from backend.services.dataset_catalog_service import dataset_catalog_service
+from backend.services.dataset_ingest_service import DATASET_NAME_PATTERN
+from backend.utils.file_utils import atomic_open
+from backend.utils.label_store import label_path_for
+from backend.utils.shard_store import (
+    SHARD_DIR_NAME, INDEX_FILE, ShardWriter, ShardReader, Sample, unpack_shards
+)
+
+# 打包时每批并行读取的文件数
+READ_BATCH = 256
+
+
+def _read_file(path: Optional[str]) -> Optional[bytes]:
+    if path is None:
+        return None
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+class ShardService:
+    """分片数据集服务"""
+
+    def __init__(self):
+        self.views_dir = settings.SHARD_VIEW_DIR
+        self.views_dir.mkdir(parents=True, exist_ok=True)
+        self.predictions_dir = settings.EXPORTS_DIR / "predictions"
+        # 按数据集加锁，不同数据集的解包可以并行
+        self._view_locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+
+    def _shards_dir(self, name: str) -> Path:
+        return settings.DATASETS_DIR / name / SHARD_DIR_NAME
+
+    def get_info(self, name: str) -> Optional[Dict[str, Any]]:
+        """分片信息（不含逐样本索引），没有分片时返回 None"""
+        try:
+            reader = ShardReader(self._shards_dir(name))
+        except FileNotFoundError:
+            return None
+        index = reader.index
+        return {
+            "dataset_name": name,
+            "id": index["id"],
+            "created_at": index["created_at"],
+            "num_samples": index["num_samples"],
+            "splits": index["splits"],
+            "num_shards": len(index["shards"]),
+            "size_bytes": sum(s["size"] for s in index["shards"]),
+            "shards": [
+                {"file": s["file"], "samples": s["samples"], "size": s["size"]}
+                for s in index["shards"]
+            ]
+        }
+
+    # ==================== 打包 ====================
+
+    def submit_pack(self, name: str, request: ShardPackRequest) -> JobStatus:
+        """提交打包任务"""
+        if not dataset_catalog_service.get_dataset(name):
+            raise FileNotFoundError(f"Dataset not found: {name}")
+        return job_service.submit("shard_pack", self._pack_job, name, request, dedupe_key=f"shards:{name}")
+
+    def _pack_job(self, ctx: JobContext, name: str, request: ShardPackRequest) -> Dict[str, Any]:
+        dataset_dir = settings.DATASETS_DIR / name
+        with open(dataset_dir / "data.yaml", 'r', encoding='utf-8') as f:
+            data = yaml.safe_load(f) or {}
+
+        ctx.update(progress=0, message="Listing images")
+        samples = self._canonical_samples(name)
+
+        # 分片内统一为 images/<划分>/ 布局，还原后的 data.yaml 按该布局重写
+        data.pop("path", None)
+        for split in {split for _, split, _ in samples}:
+            if split != "all":
+                data[split] = f"images/{split}"
+
+        packed_at = time.time()
+        shard_size = (request.shard_size_mb * 1024 * 1024) if request.shard_size_mb else settings.SHARD_SIZE
+        writer = ShardWriter(self._shards_dir(name), shard_size, data)
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, settings.INGEST_WORKERS)) as pool:
+                for start in range(0, len(samples), READ_BATCH):
+                    batch = samples[start:start + READ_BATCH]
+                    images = pool.map(_read_file, [path for path, _, _ in batch])
+                    labels = pool.map(_read_file, [label_path_for(path) for path, _, _ in batch])
+                    for (path, split, key), image, label in zip(batch, images, labels):
+                        if image is None:
+                            continue
+                        writer.add(key, split, image, label, packed_at)
+                    ctx.update(
+                        progress=min(start + READ_BATCH, len(samples)) / max(len(samples), 1) * 100,
+                        message=f"Packed {min(start + READ_BATCH, len(samples))}/{len(samples)} images"
+                    )
+            index = writer.close()
+        except BaseException:
+            writer.abort()
+            raise
+
+        info = self.get_info(name)
+        info["skipped"] = len(samples) - index["num_samples"]
+        return info
+
+    def _canonical_samples(self, name: str) -> List[tuple]:
+        """[(图片路径, 划分, 分片中的成员名)]，成员名统一为 images/<划分>/<相对路径>"""
+        samples, used = [], set()
+        for path, split, source in dataset_catalog_service.list_images(name):
+            # 来自列表文件的图片只保留文件名，重名时加序号
+            rel = os.path.relpath(path, source) if source else os.path.basename(path)
+            rel = rel.replace(os.sep, "/")
+            prefix = "images" if split == "all" else f"images/{split}"
+            key = f"{prefix}/{rel}"
+            stem, ext = os.path.splitext(key)
+            n = 1
+            while key in used:
+                key = f"{stem}_{n}{ext}"
+                n += 1
+            used.add(key)
+            samples.append((path, split, key))
+        return samples
+
+    # ==================== 还原 ====================
+
+    def submit_unpack(self, name: str, request: ShardUnpackRequest) -> JobStatus:
+        """提交还原任务"""
+        if not (self._shards_dir(name) / INDEX_FILE).exists():
+            raise FileNotFoundError(f"Dataset has no shards: {name}")
+        target = request.target_name or name
+        if not DATASET_NAME_PATTERN.match(target):
+            raise ValueError(f"Invalid dataset name: {target}")
+        target_dir = settings.DATASETS_DIR / target
+        occupied = (target_dir / "images").exists() if target == name else target_dir.exists()
+        if occupied and not request.overwrite:
+            raise FileExistsError(f"Dataset already exists: {target}")
+        return job_service.submit(
+            "shard_unpack", self._unpack_job, name, target, dedupe_key=f"shards:{name}"
+        )
+
+    def _unpack_job(self, ctx: JobContext, name: str, target: str) -> Dict[str, Any]:
+        staging = settings.DATASETS_DIR / ".staging" / ctx.job_id
+        content_dir = staging / "content"
+        try:
+            result = unpack_shards(
+                self._shards_dir(name), content_dir,
+                prefetch=settings.SHARD_PREFETCH,
+                workers=settings.SHARD_READ_WORKERS,
+                progress=lambda done, total: ctx.update(
+                    progress=done / max(total, 1) * 100, message=f"Unpacked {done}/{total} images"
+                )
+            )
+            target_dir = settings.DATASETS_DIR / target
+            if target == name:
+                # 还原到原数据集时保留分片
+                self._shards_dir(name).rename(content_dir / SHARD_DIR_NAME)
+            if target_dir.exists():
+                target_dir.rename(staging / "previous")
+            content_dir.rename(target_dir)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+        dataset_catalog_service.refresh(target)
+        result.update({"dataset_name": target, "dataset_path": str(settings.DATASETS_DIR / target / "data.yaml")})
+        return result
+
+    # ==================== 训练 ====================
+
+    def submit_training(self, name: str, start: Callable[[Path], Dict[str, Any]]) -> JobStatus:
+        """
+        提交训练准备任务：后台解包分片（materialize），完成后调用 start(data.yaml 路径) 开始训练
+
+        首次训练需要顺序读取整个数据集，不能在请求线程中执行。
+
+        Args:
+            name: 数据集名称
+            start: 返回值合并到任务结果（例如训练任务 ID）
+        """
+        if not (self._shards_dir(name) / INDEX_FILE).exists():
+            raise FileNotFoundError(f"Dataset has no shards: {name}")
+        return job_service.submit("shard_materialize", self._materialize_and_train_job, name, start)
+
+    def _materialize_and_train_job(
+        self,
+        ctx: JobContext,
+        name: str,
+        start: Callable[[Path], Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        ctx.update(message="Reading shards")
+        data_yaml = self.materialize(name)
+        if data_yaml is None:
+            raise FileNotFoundError(f"Dataset has no shards: {name}")
+        ctx.update(message="Starting training")
+        return {"dataset_name": name, "dataset_path": str(data_yaml), **start(data_yaml)}
+
+    def materialize(self, name: str) -> Optional[Path]:
+        """
+        把分片顺序读取到本地目录（SHARD_VIEW_DIR），返回可用于训练的 data.yaml
+
+        同一版本（索引 id）的分片只读取一次；分片重新打包后旧的缓存目录会被删除。
+        """
+        try:
+            reader = ShardReader(self._shards_dir(name))
+        except FileNotFoundError:
+            return None
+
+        # 每个数据集单独一个子目录，清理旧版本时不会误删名称相近的其他数据集
+        view_dir = self.views_dir / name / reader.index["id"]
+        data_yaml = view_dir / "data.yaml"
+        with self._view_locks[name]:
+            if not data_yaml.exists():
+                self._build_view(reader, name, view_dir)
+        return data_yaml
+
+    def _build_view(self, reader: ShardReader, name: str, view_dir: Path):
+        tmp_dir = view_dir.parent / f".{view_dir.name}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        unpack_shards(
+            reader.shards_dir, tmp_dir,
+            prefetch=settings.SHARD_PREFETCH,
+            workers=settings.SHARD_READ_WORKERS
+        )
+        # data.yaml 中写入绝对路径，训练时与工作目录无关
+        data = dict(reader.data, path=str(view_dir))
+        with open(tmp_dir / "data.yaml", 'w', encoding='utf-8') as f:
+            yaml.safe_dump(data, f, allow_unicode=True, sort_keys=False)
+
+        for old in view_dir.parent.iterdir():
+            if old != tmp_dir:
+                shutil.rmtree(old, ignore_errors=True)
+        tmp_dir.rename(view_dir)
+
+    # ==================== 批量推理 / 自动标注 ====================
+
+    def submit_predict(self, name: str, request: ShardPredictRequest) -> JobStatus:
+        """提交批量推理任务"""
+        reader = ShardReader(self._shards_dir(name)) if (self._shards_dir(name) / INDEX_FILE).exists() else None
+        if reader is None:
+            raise FileNotFoundError(f"Dataset has no shards: {name}")
+        if request.split and request.split not in reader.splits:
+            raise ValueError(f"Unknown split: {request.split}")
+        if request.save_labels:
+            target = request.target_name or f"{name}_auto"
+            if not DATASET_NAME_PATTERN.match(target) or target == name:
+                raise ValueError(f"Invalid dataset name: {target}")
+            if (settings.DATASETS_DIR / target).exists():
+                raise FileExistsError(f"Dataset already exists: {target}")
+        return job_service.submit("shard_predict", self._predict_job, name, request)
+
+    def _batches(self, reader: ShardReader, request: ShardPredictRequest, pool: ThreadPoolExecutor) -> Iterator[tuple]:
+        """按批读取并解码样本（解码在线程池中进行，与推理重叠）"""
+        def decode(sample: Sample) -> Optional[np.ndarray]:
+            return cv2.imdecode(np.frombuffer(sample.image, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+        batch: List[Sample] = []
+        pending = None
+        for sample in reader.iter_samples(request.split, prefetch=settings.SHARD_PREFETCH):
+            batch.append(sample)
+            if len(batch) == request.batch_size:
+                if pending is not None:
+                    yield pending[0], list(pending[1])
+                pending = (batch, pool.map(decode, batch))
+                batch = []
+        if pending is not None:
+            yield pending[0], list(pending[1])
+        if batch:
+            yield batch, list(pool.map(decode, batch))
+
+    def _predict_job(self, ctx: JobContext, name: str, request: ShardPredictRequest) -> Dict[str, Any]:
+        from backend.services.yolo_service import yolo_service
+
+        if not yolo_service:
+            raise RuntimeError("YOLO service not available")
+        # 批量推理的 batch 和 imgsz 由请求决定，不能使用固定形状的默认推理引擎
+        model = yolo_service.load_model(request.model_name, use_serving_engine=False)
+        reader = ShardReader(self._shards_dir(name))
+        total = reader.splits[request.split] if request.split else len(reader)
+
+        self.predictions_dir.mkdir(parents=True, exist_ok=True)
+        output_file = self.predictions_dir / f"{name}_{ctx.job_id}.jsonl"
+
+        writer = None
+        target = request.target_name or f"{name}_auto"
+        if request.save_labels:
+            data = dict(reader.data)
+            data["names"] = {int(k): v for k, v in model.names.items()}
+            data["nc"] = len(model.names)
+            writer = ShardWriter(settings.DATASETS_DIR / target / SHARD_DIR_NAME, settings.SHARD_SIZE, data)
+
+        processed, unreadable, detections = 0, 0, 0
+        start_time = time.time()
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, settings.IMAGE_WORKERS)) as pool, \
+                    open(output_file, 'w', encoding='utf-8') as out:
+                for samples, images in self._batches(reader, request, pool):
+                    valid = [i for i, image in enumerate(images) if image is not None]
+                    unreadable += len(samples) - len(valid)
+                    results = model.predict(
+                        [images[i] for i in valid],
+                        conf=request.confidence,
+                        iou=request.iou_threshold,
+                        imgsz=request.img_size,
+                        verbose=False
+                    ) if valid else []
+
+                    for i, result in zip(valid, results):
+                        sample = samples[i]
+                        boxes = result.boxes
+                        xyxy = boxes.xyxy.cpu().numpy()
+                        cls = boxes.cls.cpu().numpy().astype(int)
+                        conf = boxes.conf.cpu().numpy()
+                        h, w = images[i].shape[:2]
+                        detections += len(cls)
+                        out.write(json.dumps({
+                            "image": sample.key,
+                            "split": sample.split,
+                            "width": w,
+                            "height": h,
+                            "detections": [
+                                {
+                                    "class_id": int(c),
+                                    "class_name": model.names[int(c)],
+                                    "confidence": round(float(s), 4),
+                                    "bbox": [round(float(v), 2) for v in box]
+                                }
+                                for box, c, s in zip(xyxy, cls, conf)
+                            ]
+                        }, ensure_ascii=False) + "\n")
+
+                        if writer is not None:
+                            xywhn = boxes.xywhn.cpu().numpy()
+                            label = "".join(
+                                f"{c} {x:.6f} {y:.6f} {bw:.6f} {bh:.6f}\n"
+                                for c, (x, y, bw, bh) in zip(cls, xywhn)
+                            )
+                            writer.add(sample.key, sample.split, sample.image, label.encode("utf-8"))
+
+                    processed += len(samples)
+                    elapsed = time.time() - start_time
+                    ctx.update(
+                        progress=processed / max(total, 1) * 100,
+                        message=f"Processed {processed}/{total} images ({processed / max(elapsed, 1e-6):.1f} img/s)"
+                    )
+            if writer is not None:
+                writer.close()
+                with atomic_open(settings.DATASETS_DIR / target / "data.yaml", 'w', encoding='utf-8') as f:
+                    yaml.safe_dump(writer.data, f, allow_unicode=True, sort_keys=False)
+        except BaseException:
+            if writer is not None:
+                writer.abort()
+                shutil.rmtree(settings.DATASETS_DIR / target, ignore_errors=True)
+            raise
+
+        elapsed = time.time() - start_time
+        result = {
+            "dataset_name": name,
+            "model_name": request.model_name,
+            "processed": processed,
+            "unreadable": unreadable,
+            "detections": detections,
+            "elapsed": round(elapsed, 2),
+            "images_per_second": round(processed / max(elapsed, 1e-6), 2),
+            "predictions_file": str(output_file)
+        }
+        if writer is not None:
+            result["labeled_dataset"] = target
+        return result
+
+
+# 全局服务实例
+shard_service = ShardService()
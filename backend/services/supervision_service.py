@@ -10,6 +10,8 @@ from typing import List, Dict, Any, Optional, Tuple
 import supervision as sv
 from ultralytics import YOLO
 
+from backend.utils.file_utils import atomic_open, atomic_copy
+
 
 class SupervisionService:
     """Supervision 标注和可视化服务"""
@@ -258,7 +260,7 @@ class SupervisionService:
             image_name = Path(image_path).stem
             label_file = output_path / f"{image_name}.txt"
             
-            with open(label_file, 'w') as f:
+            with atomic_open(label_file, 'w') as f:
                 for i in range(len(detections)):
                     class_id = detections.class_id[i]
                     xyxy = detections.xyxy[i]
@@ -348,7 +350,7 @@ names:
             for i, name in enumerate(class_names):
                 data_yaml_content += f"  {i}: {name}\n"
             
-            with open(output_path / "data.yaml", 'w') as f:
+            with atomic_open(output_path / "data.yaml", 'w') as f:
                 f.write(data_yaml_content)
             
             return {
@@ -377,12 +379,10 @@ names:
         class_names: List[str]
     ):
         """处理单张图像和标注"""
-        import shutil
-        
-        # 复制图像
+        # 复制图像（目标可能是数据集版本 blob 的硬链接，写入新文件再替换）
         src_image = Path(src_image_dir) / image_name
         dst_image = Path(dst_image_dir) / image_name
-        shutil.copy(src_image, dst_image)
+        atomic_copy(src_image, dst_image)
         
         # 保存标注
         image = cv2.imread(str(src_image))
@@ -390,7 +390,7 @@ names:
         
         label_file = Path(dst_label_dir) / f"{Path(image_name).stem}.txt"
         
-        with open(label_file, 'w') as f:
+        with atomic_open(label_file, 'w') as f:
             for i in range(len(detections)):
                 class_id = detections.class_id[i]
                 xyxy = detections.xyxy[i]
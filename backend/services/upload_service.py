@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+分片上传服务 - 可断点续传的大模型文件上传
+
+协议：
+1. POST   /models/upload/sessions                 创建会话（文件名、总大小、可选 SHA256）
+2. PUT    /models/upload/sessions/{id}?offset=N   按顺序上传分片，offset 必须等于已接收字节数
+3. GET    /models/upload/sessions/{id}            查询已接收字节数，断线后从此处续传
+4. POST   /models/upload/sessions/{id}/finalize   校验大小和 SHA256，原子发布到 MODELS_DIR
+
+SHA256 随分片到达增量计算，发布时无需再次读取整个文件。
+"""
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, Any, Optional
+from datetime import datetime, timedelta
+
+from config.config import settings
+from backend.utils.file_utils import get_unique_filename
+
+
+# 会话过期时间
+SESSION_TTL = timedelta(hours=24)
+
+
+class UploadError(Exception):
+    """上传协议错误，status_code 对应 HTTP 状态码"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class UploadService:
+    """模型分片上传服务"""
+
+    def __init__(self):
+        self.sessions_dir = settings.UPLOADS_DIR / ".sessions"
+        self.sessions_dir.mkdir(parents=True, exist_ok=True)
+        # session_id -> 增量 SHA256 状态（服务重启后从已接收数据重建）
+        self._hashers: Dict[str, Any] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._global_lock = threading.Lock()
+
+    def _session_dir(self, session_id: str) -> Path:
+        # session_id 由服务端生成，拒绝任何路径字符
+        if not session_id.isalnum():
+            raise UploadError("Invalid session id", 404)
+        return self.sessions_dir / session_id
+
+    def _lock_for(self, session_id: str) -> threading.Lock:
+        with self._global_lock:
+            return self._locks.setdefault(session_id, threading.Lock())
+
+    def _load_session(self, session_id: str) -> Dict[str, Any]:
+        session_file = self._session_dir(session_id) / "session.json"
+        if not session_file.exists():
+            raise UploadError("Upload session not found", 404)
+        with open(session_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_session(self, session: Dict[str, Any]):
+        session["updated_at"] = datetime.now().isoformat()
+        session_file = self._session_dir(session["session_id"]) / "session.json"
+        tmp_file = session_file.with_suffix(".tmp")
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(session, f, ensure_ascii=False, indent=2)
+        tmp_file.replace(session_file)
+
+    def _cleanup_expired(self):
+        """清理过期的上传会话"""
+        now = datetime.now()
+        for session_dir in self.sessions_dir.iterdir():
+            try:
+                with open(session_dir / "session.json", 'r', encoding='utf-8') as f:
+                    updated_at = datetime.fromisoformat(json.load(f)["updated_at"])
+            except Exception:
+                updated_at = datetime.fromtimestamp(session_dir.stat().st_mtime)
+            if now - updated_at > SESSION_TTL:
+                shutil.rmtree(session_dir, ignore_errors=True)
+                self._hashers.pop(session_dir.name, None)
+
+    def create_session(
+        self,
+        filename: str,
+        size: int,
+        sha256: Optional[str] = None,
+        overwrite: bool = False
+    ) -> Dict[str, Any]:
+        """创建上传会话"""
+        filename = Path(filename).name
+        if not filename.endswith('.pt'):
+            raise UploadError("Only .pt files are allowed")
+        if size <= 0:
+            raise UploadError("File size must be positive")
+        if size > settings.MAX_MODEL_UPLOAD_SIZE:
+            raise UploadError(
+                f"File too large: {size} bytes (limit {settings.MAX_MODEL_UPLOAD_SIZE} bytes)", 413
+            )
+
+        self._cleanup_expired()
+
+        session_id = uuid.uuid4().hex
+        session_dir = self._session_dir(session_id)
+        session_dir.mkdir(parents=True)
+        (session_dir / "data.part").touch()
+
+        session = {
+            "session_id": session_id,
+            "filename": filename,
+            "size": size,
+            "received": 0,
+            "sha256": sha256.lower() if sha256 else None,
+            "overwrite": overwrite,
+            "status": "uploading",
+            "created_at": datetime.now().isoformat()
+        }
+        self._save_session(session)
+        self._hashers[session_id] = hashlib.sha256()
+        return session
+
+    def get_session(self, session_id: str) -> Dict[str, Any]:
+        """查询会话状态"""
+        return self._load_session(session_id)
+
+    def _get_hasher(self, session_id: str, part_file: Path, received: int):
+        """获取增量哈希状态，服务重启后从已接收的数据重建"""
+        hasher = self._hashers.get(session_id)
+        if hasher is None:
+            hasher = hashlib.sha256()
+            with open(part_file, 'rb') as f:
+                remaining = received
+                while remaining > 0:
+                    chunk = f.read(min(1024 * 1024, remaining))
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    remaining -= len(chunk)
+            self._hashers[session_id] = hasher
+        return hasher
+
+    def append_chunk(self, session_id: str, offset: int, data: bytes) -> Dict[str, Any]:
+        """
+        追加一个分片
+
+        Args:
+            session_id: 会话ID
+            offset: 分片在文件中的起始位置，必须等于已接收字节数
+            data: 分片数据
+
+        Returns:
+            更新后的会话状态
+        """
+        with self._lock_for(session_id):
+            session = self._load_session(session_id)
+            if session["status"] != "uploading":
+                raise UploadError(f"Session is {session['status']}", 409)
+            if offset != session["received"]:
+                raise UploadError(
+                    f"Offset mismatch: expected {session['received']}, got {offset}", 409
+                )
+            if session["received"] + len(data) > session["size"]:
+                raise UploadError("Chunk exceeds declared file size", 413)
+
+            part_file = self._session_dir(session_id) / "data.part"
+            hasher = self._get_hasher(session_id, part_file, session["received"])
+
+            with open(part_file, 'r+b') as f:
+                # 丢弃上次中断时可能残留的未确认数据
+                f.truncate(session["received"])
+                f.seek(session["received"])
+                f.write(data)
+            hasher.update(data)
+
+            session["received"] += len(data)
+            self._save_session(session)
+            return session
+
+    def finalize(self, session_id: str) -> Dict[str, Any]:
+        """
+        校验并原子发布到 MODELS_DIR
+
+        Returns:
+            {"filename", "path", "sha256", "replaced"}
+        """
+        with self._lock_for(session_id):
+            session = self._load_session(session_id)
+            if session["received"] != session["size"]:
+                raise UploadError(
+                    f"Upload incomplete: {session['received']}/{session['size']} bytes", 409
+                )
+
+            session_dir = self._session_dir(session_id)
+            part_file = session_dir / "data.part"
+            digest = self._get_hasher(session_id, part_file, session["received"]).hexdigest()
+            if session["sha256"] and digest != session["sha256"]:
+                session["status"] = "failed"
+                self._save_session(session)
+                raise UploadError("SHA256 mismatch", 422)
+
+            filename = session["filename"]
+            if not session["overwrite"]:
+                filename = get_unique_filename(str(settings.MODELS_DIR), filename)
+            target = settings.MODELS_DIR / filename
+            replaced = target.exists()
+
+            # 同一文件系统内直接 rename；跨设备时先复制到目标目录再 rename，保证原子替换
+            try:
+                os.replace(part_file, target)
+            except OSError:
+                tmp_target = settings.MODELS_DIR / f".{filename}.{session_id}.tmp"
+                shutil.copyfile(part_file, tmp_target)
+                os.replace(tmp_target, target)
+
+            shutil.rmtree(session_dir, ignore_errors=True)
+            self._hashers.pop(session_id, None)
+            with self._global_lock:
+                self._locks.pop(session_id, None)
+
+            return {
+                "filename": filename,
+                "path": str(target),
+                "sha256": digest,
+                "replaced": replaced
+            }
+
+    def abort(self, session_id: str):
+        """取消上传并删除已接收数据"""
+        session_dir = self._session_dir(session_id)
+        if not session_dir.exists():
+            raise UploadError("Upload session not found", 404)
+        shutil.rmtree(session_dir, ignore_errors=True)
+        self._hashers.pop(session_id, None)
+
+
+# 全局服务实例
+upload_service = UploadService()
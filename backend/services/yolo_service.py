@@ -2,6 +2,7 @@
 YOLO 模型服务
 """
 import os
+import sys
 import time
 import json
 import threading
@@ -24,6 +25,8 @@ from backend.models.schemas import (
     DetectionResult, InferenceResponse, TrainingConfig,
     TrainingStatus, ModelInfo, ExportConfig
 )
+from backend.services.model_index_service import model_index_service
+from backend.services.benchmark_service import benchmark_service
 
 
 class YOLOService:
@@ -36,8 +39,21 @@ class YOLOService:
         self.models: Dict[str, YOLO] = {}
         self.training_tasks: Dict[str, TrainingStatus] = {}
         
-    def load_model(self, model_name: str) -> YOLO:
-        """加载模型"""
+    def load_model(self, model_name: str, use_serving_engine: bool = True) -> YOLO:
+        """
+        加载模型（本机设置了默认推理引擎时加载对应的导出格式）
+        
+        默认推理引擎是固定 batch=1 和服务尺寸的导出产物，批量推理或使用其他输入尺寸时
+        应传入 use_serving_engine=False 加载原始权重。
+        """
+        engine = benchmark_service.get_serving_engine(model_name) if use_serving_engine else None
+        if engine:
+            # 以产物路径缓存，切换引擎后无需重启即可生效
+            if engine["artifact"] not in self.models:
+                print(f"Loading {model_name} with {engine['format']} engine: {engine['artifact']}")
+                self.models[engine["artifact"]] = YOLO(engine["artifact"], task=engine.get("task"))
+            return self.models[engine["artifact"]]
+        
         if model_name in self.models:
             return self.models[model_name]
         
@@ -75,6 +91,11 @@ class YOLOService:
             iou_threshold = iou_threshold or settings.IOU_THRESHOLD
             img_size = img_size or settings.DEFAULT_IMG_SIZE
             
+            # 导出格式的输入尺寸在导出时已固定
+            engine = benchmark_service.get_serving_engine(model_name)
+            if engine:
+                img_size = engine["img_size"]
+            
             # 加载模型
             model = self.load_model(model_name)
             
@@ -134,6 +155,10 @@ class YOLOService:
         """后台训练线程"""
         status = self.training_tasks[task_id]
         
+        if config.world_size > 1:
+            self._train_distributed(task_id, config)
+            return
+        
         try:
             # 加载基础模型
             model_type = config.model_type or "yolo11n"
@@ -197,6 +222,132 @@ class YOLOService:
             status.error_message = str(e)
             status.updated_at = datetime.now()
     
+    def _train_distributed(self, task_id: str, config: TrainingConfig):
+        """
+        CPU 多进程数据并行训练（gloo 后端）
+        
+        在本机拉起 nproc_per_node 个 rank 进程，多机时其余节点使用 job.json
+        自行启动（见 distributed_training 模块说明）。各 rank 的吞吐量写入
+        rank_<n>.json，由本线程汇总到训练状态中。
+        """
+        from backend.services.distributed_training import launch_local_workers
+        
+        status = self.training_tasks[task_id]
+        processes = []
+        
+        try:
+            dataset_path = Path(config.dataset_path)
+            if not dataset_path.exists():
+                raise FileNotFoundError(f"数据集文件不存在: {config.dataset_path}")
+            
+            nproc = config.nproc_per_node or config.world_size
+            if config.world_size % nproc != 0:
+                raise ValueError("world_size 必须是 nproc_per_node 的整数倍")
+            
+            project_dir = settings.MODELS_DIR / config.project_name
+            job_dir = project_dir / f"{task_id}_dist"
+            job_dir.mkdir(parents=True, exist_ok=True)
+            
+            job = {
+                "job_dir": str(job_dir),
+                "project": str(project_dir),
+                "dataset_path": str(dataset_path.resolve()),
+                "model_type": config.model_type or "yolo11n",
+                "pretrained": config.pretrained,
+                "epochs": config.epochs,
+                "batch_per_rank": max(config.batch_size // config.world_size, 1),
+                "img_size": config.img_size,
+                "patience": config.patience,
+                "save_period": config.save_period,
+                "optimizer": config.optimizer,
+                "lr0": config.lr0,
+                "lrf": config.lrf,
+                "world_size": config.world_size,
+                "nproc_per_node": nproc,
+                "master_addr": config.master_addr,
+                "master_port": config.master_port,
+                # 平均分配本机 CPU 核心，避免各 rank 线程互相争抢
+                "threads_per_rank": max((os.cpu_count() or 1) // nproc, 1)
+            }
+            job_file = job_dir / "job.json"
+            with open(job_file, 'w', encoding='utf-8') as f:
+                json.dump(job, f, ensure_ascii=False, indent=2)
+            
+            print(f"[{task_id}] 启动分布式训练: world_size={config.world_size}, 本机 rank 数={nproc}")
+            if config.world_size > nproc:
+                print(f"[{task_id}] 其他节点请执行: {sys.executable} -m backend.services.distributed_training "
+                      f"--config {job_file} --node-rank <N>")
+            
+            processes = launch_local_workers(job_file, job, config.node_rank)
+            status.status = "running"
+            status.updated_at = datetime.now()
+            
+            while True:
+                finished = all(p.poll() is not None for p in processes)
+                self._collect_rank_stats(status, job_dir)
+                if finished:
+                    break
+                time.sleep(2)
+            
+            failed = [r for r in (status.ranks or []) if r.get("state") == "failed"]
+            if any(p.returncode != 0 for p in processes) or failed:
+                error = failed[0].get("error") if failed else None
+                raise RuntimeError(error or f"分布式训练进程异常退出，日志见 {job_dir}")
+            
+            rank0 = next((r for r in status.ranks or [] if r.get("rank") == 0), {})
+            status.status = "completed"
+            status.progress = 100.0
+            status.current_epoch = config.epochs
+            status.metrics = {
+                "final_metrics": rank0.get("final_metrics", {}),
+                "total_images_per_sec": sum(r.get("images_per_sec", 0.0) for r in status.ranks or [])
+            }
+            status.updated_at = datetime.now()
+            print(f"[{task_id}] 分布式训练完成")
+            
+        except Exception as e:
+            print(f"[{task_id}] 分布式训练失败: {e}")
+            for p in processes:
+                if p.poll() is None:
+                    p.terminate()
+            
+            status.status = "failed"
+            status.error_message = str(e)
+            status.updated_at = datetime.now()
+    
+    def _collect_rank_stats(self, status: TrainingStatus, job_dir: Path):
+        """汇总各 rank 的吞吐量统计到训练状态"""
+        ranks: Dict[int, Dict[str, Any]] = {}
+        
+        # rank 0 每个 epoch 汇总的全部 rank（包括远程节点）
+        gathered_file = job_dir / "ranks.json"
+        if gathered_file.exists():
+            try:
+                with open(gathered_file, 'r', encoding='utf-8') as f:
+                    for r in json.load(f).get("ranks", []):
+                        if r:
+                            ranks[r["rank"]] = r
+            except (OSError, ValueError):
+                pass
+        
+        # 本机 rank 的实时统计
+        for rank_file in job_dir.glob("rank_*.json"):
+            try:
+                with open(rank_file, 'r', encoding='utf-8') as f:
+                    r = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if r["rank"] not in ranks or r["updated_at"] >= ranks[r["rank"]]["updated_at"]:
+                ranks[r["rank"]] = r
+        
+        if not ranks:
+            return
+        
+        status.ranks = [ranks[k] for k in sorted(ranks)]
+        status.current_epoch = min(r.get("epoch", 0) for r in status.ranks)
+        status.progress = min(status.current_epoch / max(status.total_epochs, 1) * 100, 99.0)
+        status.updated_at = datetime.now()
+    
     def train(self, config: TrainingConfig) -> str:
         """开始训练（异步）"""
         task_id = f"train_{int(time.time())}"
@@ -209,10 +360,22 @@ class YOLOService:
             current_epoch=0,
             total_epochs=config.epochs,
             created_at=datetime.now(),
-            updated_at=datetime.now()
+            updated_at=datetime.now(),
+            dataset_version=config.dataset_version
         )
         self.training_tasks[task_id] = status
         
+        # 记录训练使用的数据集版本，便于复现
+        if config.dataset_version:
+            run_dir = settings.MODELS_DIR / config.project_name
+            run_dir.mkdir(parents=True, exist_ok=True)
+            with open(run_dir / "dataset_version.json", 'w', encoding='utf-8') as f:
+                json.dump({
+                    "task_id": task_id,
+                    "dataset_name": config.dataset_name,
+                    "dataset_version": config.dataset_version
+                }, f, ensure_ascii=False, indent=2)
+        
         # 在后台线程中启动训练
         thread = threading.Thread(
             target=self._train_thread,
@@ -258,38 +421,8 @@ class YOLOService:
             }
     
     def list_models(self) -> List[ModelInfo]:
-        """列出所有模型"""
-        models = []
-        models_dir = settings.MODELS_DIR
-        
-        for model_file in models_dir.glob("**/*.pt"):
-            try:
-                stat = model_file.stat()
-                
-                # 尝试加载模型获取信息
-                try:
-                    model = YOLO(str(model_file))
-                    task = model.task
-                    classes = list(model.names.values()) if hasattr(model, 'names') else []
-                except:
-                    task = "unknown"
-                    classes = []
-                
-                info = ModelInfo(
-                    name=model_file.name,
-                    path=str(model_file),
-                    size=stat.st_size,
-                    created_at=datetime.fromtimestamp(stat.st_ctime),
-                    model_type="yolo",
-                    task=task,
-                    classes=classes
-                )
-                models.append(info)
-            except Exception as e:
-                print(f"Error reading model {model_file}: {e}")
-                continue
-        
-        return models
+        """列出所有模型（元数据来自持久化索引，不加载模型）"""
+        return model_index_service.list_models()
     
     def get_device_info(self) -> Tuple[bool, Optional[str]]:
         """获取设备信息"""
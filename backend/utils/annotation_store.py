@@ -0,0 +1,895 @@
+"""
+标注项目的 SQLite 存储
+
+所有标注项目共用一个数据库文件（annotation_projects/annotations.db），表结构：
+- projects     项目信息
+- images       项目中的图片（名称、每次改写标注时递增的版本号，以及上传时记录的内容哈希和尺寸）
+- annotations  标注框，每个框一行，按 (project_id, image_name) 建索引
+- classes      项目类别（按顺序）
+- auto_annotate_jobs / auto_annotate_done
+               自动标注任务的参数、累计统计和已完成的图片（与标注在同一事务中写入，用于断点续跑）
+- project_stats / class_stats
+               项目的图片数、已标注图片数、自动 / 手动标注数和各类别标注数，由触发器在写入图片和
+               标注的同一事务中增量更新，读取统计时不需要扫描标注
+
+数据库使用 WAL 模式，读操作不会被写操作阻塞；每个线程使用独立的连接，
+写操作串行执行。保存标注时只改写内容发生变化的图片。
+
+表结构通过 PRAGMA user_version 记录版本，打开数据库时按顺序执行未应用的迁移。
+"""
+import json
+import base64
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple, Set
+
+
+# 表结构迁移：第 i 项把数据库从版本 i 升级到 i + 1
+MIGRATIONS: List[str] = [
+    """
+    CREATE TABLE projects (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        description TEXT NOT NULL DEFAULT '',
+        path TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL,
+        images_mtime_ns INTEGER
+    );
+    CREATE TABLE images (
+        project_id TEXT NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+        name TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        PRIMARY KEY (project_id, name)
+    ) WITHOUT ROWID;
+    CREATE TABLE annotations (
+        id INTEGER PRIMARY KEY,
+        project_id TEXT NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+        image_name TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        class TEXT,
+        class_id INTEGER,
+        x REAL, y REAL, width REAL, height REAL,
+        confidence REAL,
+        auto_annotated INTEGER,
+        extra TEXT
+    );
+    CREATE INDEX idx_annotations_image ON annotations(project_id, image_name, position);
+    CREATE INDEX idx_annotations_class ON annotations(project_id, class);
+    CREATE TABLE classes (
+        project_id TEXT NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+        position INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        PRIMARY KEY (project_id, position)
+    ) WITHOUT ROWID;
+    """,
+    # v2: 图片标注版本号（增量保存时的乐观并发控制）
+    """
+    ALTER TABLE images ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
+    """,
+    # v3: 按上传时间分页
+    """
+    CREATE INDEX idx_images_created ON images(project_id, created_at, name);
+    """,
+    # v4: 可恢复的自动标注任务
+    """
+    CREATE TABLE auto_annotate_jobs (
+        job_id TEXT PRIMARY KEY,
+        project_id TEXT NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+        params TEXT NOT NULL,
+        stats TEXT NOT NULL,
+        status TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL
+    );
+    CREATE INDEX idx_auto_annotate_jobs_status ON auto_annotate_jobs(status);
+    CREATE TABLE auto_annotate_done (
+        job_id TEXT NOT NULL REFERENCES auto_annotate_jobs(job_id) ON DELETE CASCADE,
+        image_name TEXT NOT NULL,
+        PRIMARY KEY (job_id, image_name)
+    ) WITHOUT ROWID;
+    """,
+    # v5: 上传时记录的图片内容哈希、尺寸和大小（按内容去重）
+    """
+    ALTER TABLE images ADD COLUMN sha256 TEXT;
+    ALTER TABLE images ADD COLUMN width INTEGER;
+    ALTER TABLE images ADD COLUMN height INTEGER;
+    ALTER TABLE images ADD COLUMN size INTEGER;
+    CREATE INDEX idx_images_sha256 ON images(project_id, sha256);
+    """,
+    # v6: 增量维护的统计计数（由触发器在写入标注和图片的同一事务中更新）
+    """
+    ALTER TABLE images ADD COLUMN box_count INTEGER NOT NULL DEFAULT 0;
+    CREATE TABLE project_stats (
+        project_id TEXT PRIMARY KEY REFERENCES projects(id) ON DELETE CASCADE,
+        total_images INTEGER NOT NULL DEFAULT 0,
+        annotated_images INTEGER NOT NULL DEFAULT 0,
+        auto_annotations INTEGER NOT NULL DEFAULT 0,
+        manual_annotations INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE class_stats (
+        project_id TEXT NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+        class TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (project_id, class)
+    ) WITHOUT ROWID;
+    CREATE TRIGGER trg_projects_insert AFTER INSERT ON projects BEGIN
+        INSERT OR IGNORE INTO project_stats (project_id) VALUES (NEW.id);
+    END;
+    CREATE TRIGGER trg_images_insert AFTER INSERT ON images BEGIN
+        UPDATE project_stats SET
+            total_images = total_images + 1,
+            annotated_images = annotated_images + (NEW.box_count > 0)
+        WHERE project_id = NEW.project_id;
+    END;
+    CREATE TRIGGER trg_images_delete AFTER DELETE ON images BEGIN
+        UPDATE project_stats SET
+            total_images = total_images - 1,
+            annotated_images = annotated_images - (OLD.box_count > 0)
+        WHERE project_id = OLD.project_id;
+    END;
+    CREATE TRIGGER trg_images_box_count AFTER UPDATE OF box_count ON images
+    WHEN (NEW.box_count > 0) != (OLD.box_count > 0) BEGIN
+        UPDATE project_stats SET
+            annotated_images = annotated_images + (NEW.box_count > 0) - (OLD.box_count > 0)
+        WHERE project_id = NEW.project_id;
+    END;
+    CREATE TRIGGER trg_annotations_insert AFTER INSERT ON annotations BEGIN
+        UPDATE images SET box_count = box_count + 1
+        WHERE project_id = NEW.project_id AND name = NEW.image_name;
+        UPDATE project_stats SET
+            auto_annotations = auto_annotations + (COALESCE(NEW.auto_annotated, 0) != 0),
+            manual_annotations = manual_annotations + (COALESCE(NEW.auto_annotated, 0) = 0)
+        WHERE project_id = NEW.project_id;
+        INSERT OR IGNORE INTO class_stats (project_id, class) VALUES (NEW.project_id, COALESCE(NEW.class, 'unknown'));
+        UPDATE class_stats SET count = count + 1
+        WHERE project_id = NEW.project_id AND class = COALESCE(NEW.class, 'unknown');
+    END;
+    CREATE TRIGGER trg_annotations_delete AFTER DELETE ON annotations BEGIN
+        UPDATE images SET box_count = box_count - 1
+        WHERE project_id = OLD.project_id AND name = OLD.image_name;
+        UPDATE project_stats SET
+            auto_annotations = auto_annotations - (COALESCE(OLD.auto_annotated, 0) != 0),
+            manual_annotations = manual_annotations - (COALESCE(OLD.auto_annotated, 0) = 0)
+        WHERE project_id = OLD.project_id;
+        UPDATE class_stats SET count = count - 1
+        WHERE project_id = OLD.project_id AND class = COALESCE(OLD.class, 'unknown');
+    END;
+    INSERT INTO project_stats (project_id) SELECT id FROM projects;
+    """,
+    # v7: 图片登记前已写入的标注（例如同步图片目录之前保存的标注）在登记时计入 box_count
+    """
+    DROP TRIGGER trg_images_insert;
+    CREATE TRIGGER trg_images_insert AFTER INSERT ON images BEGIN
+        UPDATE project_stats SET
+            total_images = total_images + 1,
+            annotated_images = annotated_images + (NEW.box_count > 0)
+        WHERE project_id = NEW.project_id;
+        UPDATE images SET box_count = (
+            SELECT COUNT(*) FROM annotations WHERE project_id = NEW.project_id AND image_name = NEW.name
+        ) WHERE project_id = NEW.project_id AND name = NEW.name;
+    END;
+    """,
+]
+
+# 升级到这些版本后按现有数据重算统计计数（v6 创建计数表，v7 修正此前漏计的标注）
+STATS_REBUILD_VERSIONS = (6, 7)
+
+# 统计计数的完整重算（迁移和一致性检查时使用）
+REBUILD_STATS_SQL: List[str] = [
+    """
+    UPDATE images SET box_count = (
+        SELECT COUNT(*) FROM annotations a WHERE a.project_id = images.project_id AND a.image_name = images.name
+    ) WHERE project_id = :project_id
+    """,
+    """
+    UPDATE project_stats SET
+        total_images = (SELECT COUNT(*) FROM images WHERE project_id = :project_id),
+        annotated_images = (SELECT COUNT(*) FROM images WHERE project_id = :project_id AND box_count > 0),
+        auto_annotations = (
+            SELECT COUNT(*) FROM annotations WHERE project_id = :project_id AND COALESCE(auto_annotated, 0) != 0
+        ),
+        manual_annotations = (
+            SELECT COUNT(*) FROM annotations WHERE project_id = :project_id AND COALESCE(auto_annotated, 0) = 0
+        )
+    WHERE project_id = :project_id
+    """,
+    """
+    DELETE FROM class_stats WHERE project_id = :project_id
+    """,
+    """
+    INSERT INTO class_stats (project_id, class, count)
+    SELECT project_id, COALESCE(class, 'unknown'), COUNT(*) FROM annotations
+    WHERE project_id = :project_id GROUP BY COALESCE(class, 'unknown')
+    """,
+]
+
+# 图片分页支持的排序方式：排序键 -> (列, 是否降序)
+IMAGE_SORTS = {
+    "name": ("name", False),
+    "-name": ("name", True),
+    "created_at": ("created_at", False),
+    "-created_at": ("created_at", True),
+}
+
+# 图片分页支持的标注状态过滤
+IMAGE_STATUSES = ("annotated", "unannotated")
+
+# 标注框中单独成列的字段，其余字段以 JSON 保存在 extra 列
+_BOX_COLUMNS = ("class", "class_id", "x", "y", "width", "height", "confidence", "auto_annotated")
+_PROJECT_COLUMNS = ("id", "name", "description", "created_at", "updated_at", "path")
+
+
+class AnnotationConflictError(Exception):
+    """增量保存时图片标注已被他人修改，conflicts 为 {图片名: {"version", "annotations"}}（服务端当前内容）"""
+
+    def __init__(self, conflicts: Dict[str, Dict[str, Any]]):
+        super().__init__(f"Annotations changed by another user: {', '.join(sorted(conflicts))}")
+        self.conflicts = conflicts
+
+
+def _encode_cursor(sort: str, key: Any, name: str) -> str:
+    raw = json.dumps([sort, key, name], ensure_ascii=False, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str, sort: str) -> Tuple[Any, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, key, name = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort:
+        raise ValueError("Cursor does not match sort order")
+    return key, name
+
+
+def _split_statements(script: str) -> List[str]:
+    """把迁移脚本拆分为单条语句（触发器内部的分号不拆分）"""
+    statements, buffer = [], ""
+    for piece in script.split(";"):
+        buffer += piece + ";"
+        if sqlite3.complete_statement(buffer):
+            if buffer.strip(" \n;"):
+                statements.append(buffer)
+            buffer = ""
+    return statements
+
+
+def _box_to_row(box: Dict[str, Any]) -> tuple:
+    extra = {k: v for k, v in box.items() if k not in _BOX_COLUMNS}
+    auto = box.get("auto_annotated")
+    return (
+        box.get("class"), box.get("class_id"),
+        box.get("x"), box.get("y"), box.get("width"), box.get("height"),
+        box.get("confidence"),
+        None if auto is None else int(bool(auto)),
+        json.dumps(extra, ensure_ascii=False) if extra else None
+    )
+
+
+def _row_to_box(row) -> Dict[str, Any]:
+    box = {}
+    for key in _BOX_COLUMNS:
+        value = row[key]
+        if value is not None:
+            box[key] = bool(value) if key == "auto_annotated" else value
+    if row["extra"]:
+        box.update(json.loads(row["extra"]))
+    return box
+
+
+def _normalize_box(box: Dict[str, Any]) -> Dict[str, Any]:
+    """把标注框转换为从数据库读出时的形式（用于判断内容是否变化）"""
+    return _row_to_box(dict(zip(_BOX_COLUMNS + ("extra",), _box_to_row(box))))
+
+
+class AnnotationStore:
+    """标注项目数据库"""
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._migrate()
+
+    # ==================== 连接与事务 ====================
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), isolation_level=None, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """写事务（同一进程内串行执行）"""
+        conn = self._connect()
+        with self._write_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def _migrate(self):
+        conn = self._connect()
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for target in range(version, len(MIGRATIONS)):
+            with self.transaction() as tx:
+                for statement in _split_statements(MIGRATIONS[target]):
+                    tx.execute(statement)
+                if target + 1 in STATS_REBUILD_VERSIONS:
+                    # 计数表刚创建或计数规则有变化：按现有数据重新计算
+                    for (project_id,) in tx.execute("SELECT id FROM projects").fetchall():
+                        self._rebuild_stats(tx, project_id)
+                tx.execute(f"PRAGMA user_version = {target + 1}")
+
+    @property
+    def schema_version(self) -> int:
+        return self._connect().execute("PRAGMA user_version").fetchone()[0]
+
+    # ==================== 项目 ====================
+
+    def _project_dict(self, row: sqlite3.Row) -> Dict[str, Any]:
+        return {key: row[key] for key in _PROJECT_COLUMNS}
+
+    def list_projects(self) -> List[Dict[str, Any]]:
+        rows = self._connect().execute("SELECT * FROM projects ORDER BY created_at").fetchall()
+        return [self._project_dict(row) for row in rows]
+
+    def get_project(self, project_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute("SELECT * FROM projects WHERE id = ?", (project_id,)).fetchone()
+        return self._project_dict(row) if row else None
+
+    def has_project(self, project_id: str) -> bool:
+        return self._connect().execute(
+            "SELECT 1 FROM projects WHERE id = ?", (project_id,)
+        ).fetchone() is not None
+
+    def create_project(self, project: Dict[str, Any]):
+        with self.transaction() as tx:
+            tx.execute(
+                "INSERT INTO projects (id, name, description, path, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (project["id"], project["name"], project.get("description", ""), project["path"],
+                 project["created_at"], project["updated_at"])
+            )
+
+    def delete_project(self, project_id: str) -> bool:
+        with self.transaction() as tx:
+            return tx.execute("DELETE FROM projects WHERE id = ?", (project_id,)).rowcount > 0
+
+    def touch_project(self, project_id: str, tx: Optional[sqlite3.Connection] = None):
+        """更新项目修改时间"""
+        sql = "UPDATE projects SET updated_at = ? WHERE id = ?"
+        args = (datetime.now().isoformat(), project_id)
+        if tx is not None:
+            tx.execute(sql, args)
+        else:
+            with self.transaction() as conn:
+                conn.execute(sql, args)
+
+    # ==================== 图片 ====================
+
+    def list_image_names(self, project_id: str) -> List[str]:
+        rows = self._connect().execute(
+            "SELECT name FROM images WHERE project_id = ? ORDER BY name", (project_id,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def count_images(self, project_id: str) -> int:
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM images WHERE project_id = ?", (project_id,)
+        ).fetchone()[0]
+
+    def list_images_page(
+        self,
+        project_id: str,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+        sort: str = "name",
+        status: Optional[str] = None,
+        class_name: Optional[str] = None,
+        auto_annotated: Optional[bool] = None,
+        max_confidence: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        按游标分页列出图片
+
+        游标记录上一页最后一张图片的排序键，翻页时直接从索引位置继续读取，
+        页码很大时也不需要跳过前面的行；翻页期间新增或删除图片不会造成重复或遗漏。
+
+        Args:
+            project_id: 项目ID
+            cursor: 上一页返回的 next_cursor，None 表示第一页
+            limit: 每页图片数
+            sort: 排序方式（见 IMAGE_SORTS）
+            status: annotated / unannotated
+            class_name: 只列出包含该类别标注的图片
+            auto_annotated: True 只列出含自动标注的图片，False 只列出不含自动标注的图片
+            max_confidence: 只列出含置信度低于该值的标注的图片
+
+        Returns:
+            {"images": [{"name", "created_at", "version", "num_annotations"}],
+             "next_cursor": 下一页游标（没有更多时为 None）, "total": 满足过滤条件的图片总数}
+
+        Raises:
+            ValueError: 排序方式、过滤条件或游标无效
+        """
+        if sort not in IMAGE_SORTS:
+            raise ValueError(f"Invalid sort: {sort}, expected one of {', '.join(IMAGE_SORTS)}")
+        if status is not None and status not in IMAGE_STATUSES:
+            raise ValueError(f"Invalid status: {status}, expected one of {', '.join(IMAGE_STATUSES)}")
+        column, descending = IMAGE_SORTS[sort]
+
+        has_annotation = "EXISTS (SELECT 1 FROM annotations a WHERE a.project_id = i.project_id AND a.image_name = i.name{})"
+        where, args = ["i.project_id = ?"], [project_id]
+        if status == "annotated":
+            where.append(has_annotation.format(""))
+        elif status == "unannotated":
+            where.append("NOT " + has_annotation.format(""))
+        if class_name is not None:
+            where.append(has_annotation.format(" AND a.class = ?"))
+            args.append(class_name)
+        if auto_annotated is not None:
+            where.append(("" if auto_annotated else "NOT ") + has_annotation.format(" AND a.auto_annotated = 1"))
+        if max_confidence is not None:
+            where.append(has_annotation.format(" AND a.confidence < ?"))
+            args.append(max_confidence)
+
+        conn = self._connect()
+        total = conn.execute(f"SELECT COUNT(*) FROM images i WHERE {' AND '.join(where)}", args).fetchone()[0]
+
+        if cursor:
+            key, name = _decode_cursor(cursor, sort)
+            where.append(f"(i.{column}, i.name) {'<' if descending else '>'} (?, ?)")
+            args.extend([key, name])
+        order = "DESC" if descending else "ASC"
+        rows = conn.execute(
+            f"SELECT i.name, i.created_at, i.version, "
+            f"(SELECT COUNT(*) FROM annotations a WHERE a.project_id = i.project_id AND a.image_name = i.name) "
+            f"AS num_annotations FROM images i WHERE {' AND '.join(where)} "
+            f"ORDER BY i.{column} {order}, i.name {order} LIMIT ?",
+            (*args, limit + 1)
+        ).fetchall()
+
+        images = [dict(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = images[-1]
+            next_cursor = _encode_cursor(sort, last[column], last["name"])
+        return {"images": images, "next_cursor": next_cursor, "total": total}
+
+    def get_images_mtime(self, project_id: str) -> Optional[int]:
+        row = self._connect().execute(
+            "SELECT images_mtime_ns FROM projects WHERE id = ?", (project_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def add_images(
+        self,
+        project_id: str,
+        names: Iterable[str],
+        images_mtime_ns: Optional[int] = None,
+        metadata: Optional[Dict[str, Dict[str, Any]]] = None
+    ):
+        """登记图片（已存在的忽略），metadata 为 {图片名: {sha256, width, height, size}}"""
+        now = datetime.now().isoformat()
+        with self.transaction() as tx:
+            tx.executemany(
+                "INSERT OR IGNORE INTO images (project_id, name, created_at) VALUES (?, ?, ?)",
+                ((project_id, name, now) for name in names)
+            )
+            if metadata:
+                self.set_image_metadata(project_id, metadata, tx)
+            if images_mtime_ns is not None:
+                tx.execute("UPDATE projects SET images_mtime_ns = ? WHERE id = ?", (images_mtime_ns, project_id))
+            self.touch_project(project_id, tx)
+
+    def set_image_metadata(
+        self,
+        project_id: str,
+        metadata: Dict[str, Dict[str, Any]],
+        tx: Optional[sqlite3.Connection] = None
+    ):
+        """记录图片的内容哈希、尺寸和文件大小"""
+        def write(conn: sqlite3.Connection):
+            conn.executemany(
+                "UPDATE images SET sha256 = ?, width = ?, height = ?, size = ? WHERE project_id = ? AND name = ?",
+                (
+                    (meta["sha256"], meta.get("width"), meta.get("height"), meta.get("size"), project_id, name)
+                    for name, meta in metadata.items()
+                )
+            )
+
+        if tx is not None:
+            write(tx)
+        else:
+            with self.transaction() as conn:
+                write(conn)
+
+    def get_image_hashes(self, project_id: str) -> Dict[str, str]:
+        """已记录内容哈希的图片 {sha256: 图片名}"""
+        rows = self._connect().execute(
+            "SELECT sha256, name FROM images WHERE project_id = ? AND sha256 IS NOT NULL ORDER BY name",
+            (project_id,)
+        ).fetchall()
+        hashes: Dict[str, str] = {}
+        for sha256, name in rows:
+            hashes.setdefault(sha256, name)
+        return hashes
+
+    def list_unhashed_images(self, project_id: str) -> List[str]:
+        """尚未记录内容哈希的图片（上传功能之前登记或在平台之外放入的图片）"""
+        rows = self._connect().execute(
+            "SELECT name FROM images WHERE project_id = ? AND sha256 IS NULL ORDER BY name", (project_id,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def remove_images(self, project_id: str, names: Iterable[str], images_mtime_ns: Optional[int] = None) -> int:
+        """删除图片记录及其标注"""
+        names = list(names)
+        with self.transaction() as tx:
+            tx.executemany(
+                "DELETE FROM annotations WHERE project_id = ? AND image_name = ?",
+                ((project_id, name) for name in names)
+            )
+            removed = 0
+            for name in names:
+                removed += tx.execute(
+                    "DELETE FROM images WHERE project_id = ? AND name = ?", (project_id, name)
+                ).rowcount
+            if images_mtime_ns is not None:
+                tx.execute("UPDATE projects SET images_mtime_ns = ? WHERE id = ?", (images_mtime_ns, project_id))
+            self.touch_project(project_id, tx)
+        return removed
+
+    def sync_images(self, project_id: str, names: List[str], images_mtime_ns: int):
+        """按图片目录的实际内容同步图片记录（目录在平台之外被修改时使用）"""
+        existing = set(self.list_image_names(project_id))
+        current = set(names)
+        now = datetime.now().isoformat()
+        with self.transaction() as tx:
+            tx.executemany(
+                "INSERT OR IGNORE INTO images (project_id, name, created_at) VALUES (?, ?, ?)",
+                ((project_id, name, now) for name in sorted(current - existing))
+            )
+            for name in existing - current:
+                tx.execute("DELETE FROM annotations WHERE project_id = ? AND image_name = ?", (project_id, name))
+                tx.execute("DELETE FROM images WHERE project_id = ? AND name = ?", (project_id, name))
+            tx.execute("UPDATE projects SET images_mtime_ns = ? WHERE id = ?", (images_mtime_ns, project_id))
+
+    # ==================== 统计 ====================
+
+    def get_stats(self, project_id: str) -> Optional[Dict[str, Any]]:
+        """读取项目的统计计数（图片数、已标注图片数、自动 / 手动标注数、各类别标注数）"""
+        conn = self._connect()
+        row = conn.execute("SELECT * FROM project_stats WHERE project_id = ?", (project_id,)).fetchone()
+        if row is None:
+            return None
+        stats = {key: row[key] for key in row.keys() if key != "project_id"}
+        stats["class_counts"] = {
+            name: count for name, count in conn.execute(
+                "SELECT class, count FROM class_stats WHERE project_id = ? AND count > 0 ORDER BY class",
+                (project_id,)
+            ).fetchall()
+        }
+        return stats
+
+    def _rebuild_stats(self, tx: sqlite3.Connection, project_id: str):
+        tx.execute("INSERT OR IGNORE INTO project_stats (project_id) VALUES (?)", (project_id,))
+        for statement in REBUILD_STATS_SQL:
+            tx.execute(statement, {"project_id": project_id})
+
+    def rebuild_stats(self, project_id: str) -> Dict[str, Any]:
+        """
+        按标注数据重新计算统计计数
+
+        Returns:
+            {"consistent": 重算前的计数是否与实际一致, "before": 重算前, "after": 重算后}
+        """
+        with self.transaction() as tx:
+            before = self.get_stats(project_id)
+            self._rebuild_stats(tx, project_id)
+            after = self.get_stats(project_id)
+        return {"consistent": before == after, "before": before, "after": after}
+
+    # ==================== 标注 ====================
+
+    def get_annotations(
+        self,
+        project_id: str,
+        image_names: Optional[List[str]] = None
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        读取标注
+
+        Args:
+            project_id: 项目ID
+            image_names: 只读取这些图片的标注，None 表示全部
+
+        Returns:
+            {图片名: [标注框]}（没有标注的图片不出现在结果中）
+        """
+        conn = self._connect()
+        if image_names is None:
+            rows = conn.execute(
+                "SELECT * FROM annotations WHERE project_id = ? ORDER BY image_name, position", (project_id,)
+            ).fetchall()
+        else:
+            rows = []
+            for start in range(0, len(image_names), 500):
+                chunk = image_names[start:start + 500]
+                rows.extend(conn.execute(
+                    f"SELECT * FROM annotations WHERE project_id = ? AND image_name IN "
+                    f"({','.join('?' * len(chunk))}) ORDER BY image_name, position",
+                    (project_id, *chunk)
+                ).fetchall())
+
+        annotations: Dict[str, List[Dict[str, Any]]] = {}
+        for row in rows:
+            annotations.setdefault(row["image_name"], []).append(_row_to_box(row))
+        return annotations
+
+    def get_image_versions(self, project_id: str, image_names: Optional[List[str]] = None) -> Dict[str, int]:
+        """读取图片标注版本号 {图片名: 版本}（不存在的图片不出现在结果中）"""
+        conn = self._connect()
+        if image_names is None:
+            rows = conn.execute("SELECT name, version FROM images WHERE project_id = ?", (project_id,)).fetchall()
+        else:
+            rows = []
+            for start in range(0, len(image_names), 500):
+                chunk = image_names[start:start + 500]
+                rows.extend(conn.execute(
+                    f"SELECT name, version FROM images WHERE project_id = ? AND name IN ({','.join('?' * len(chunk))})",
+                    (project_id, *chunk)
+                ).fetchall())
+        return {row[0]: row[1] for row in rows}
+
+    def _write_image_annotations(self, tx: sqlite3.Connection, project_id: str, image_name: str, boxes: List[Dict[str, Any]]):
+        tx.execute("DELETE FROM annotations WHERE project_id = ? AND image_name = ?", (project_id, image_name))
+        tx.executemany(
+            "INSERT INTO annotations (project_id, image_name, position, class, class_id, x, y, width, height, "
+            "confidence, auto_annotated, extra) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            ((project_id, image_name, i, *_box_to_row(box)) for i, box in enumerate(boxes))
+        )
+        tx.execute(
+            "UPDATE images SET version = version + 1 WHERE project_id = ? AND name = ?", (project_id, image_name)
+        )
+
+    def set_image_annotations(
+        self,
+        project_id: str,
+        annotations: Dict[str, List[Dict[str, Any]]],
+        classes: Optional[List[str]] = None
+    ) -> int:
+        """
+        替换指定图片的标注（其他图片不受影响）
+
+        Returns:
+            写入的图片数
+        """
+        with self.transaction() as tx:
+            for image_name, boxes in annotations.items():
+                self._write_image_annotations(tx, project_id, image_name, boxes)
+            if classes is not None:
+                self.set_classes(project_id, classes, tx)
+            self.touch_project(project_id, tx)
+        return len(annotations)
+
+    def replace_annotations(
+        self,
+        project_id: str,
+        annotations: Dict[str, List[Dict[str, Any]]],
+        classes: Optional[List[str]] = None
+    ) -> int:
+        """
+        用完整的标注字典替换项目标注，只改写内容有变化的图片
+
+        Returns:
+            改写的图片数
+        """
+        existing = self.get_annotations(project_id)
+        changed = {
+            name: boxes for name, boxes in annotations.items()
+            if existing.get(name, []) != [_normalize_box(box) for box in boxes]
+        }
+        removed = [name for name in existing if name not in annotations]
+
+        with self.transaction() as tx:
+            for image_name, boxes in changed.items():
+                self._write_image_annotations(tx, project_id, image_name, boxes)
+            for name in removed:
+                self._write_image_annotations(tx, project_id, name, [])
+            if classes is not None and classes != self.get_classes(project_id):
+                self.set_classes(project_id, classes, tx)
+            self.touch_project(project_id, tx)
+        return len(changed) + len(removed)
+
+    def patch_annotations(
+        self,
+        project_id: str,
+        changes: Dict[str, List[Dict[str, Any]]],
+        base_versions: Dict[str, Optional[int]],
+        classes: Optional[List[str]] = None
+    ) -> Dict[str, int]:
+        """
+        替换若干图片的标注，并检查版本号
+
+        所有图片的版本号都与 base_versions 一致时才写入（全部写入或全部不写）。
+
+        Args:
+            project_id: 项目ID
+            changes: {图片名: 该图片的全部标注框}，空列表表示清空
+            base_versions: {图片名: 客户端读取时的版本号}，None 或缺省表示不检查
+            classes: 同时更新的类别列表
+
+        Returns:
+            写入后的版本号 {图片名: 版本}
+
+        Raises:
+            FileNotFoundError: 图片不存在
+            AnnotationConflictError: 有图片的版本号不一致
+        """
+        names = list(changes)
+        with self.transaction() as tx:
+            # 写事务持有写锁，检查版本与写入之间不会有其他写入
+            current = self.get_image_versions(project_id, names)
+            missing = [name for name in names if name not in current]
+            if missing:
+                raise FileNotFoundError(f"Image not found: {', '.join(missing)}")
+
+            stale = [
+                name for name in names
+                if base_versions.get(name) is not None and base_versions[name] != current[name]
+            ]
+            if stale:
+                annotations = self.get_annotations(project_id, stale)
+                raise AnnotationConflictError({
+                    name: {"version": current[name], "annotations": annotations.get(name, [])}
+                    for name in stale
+                })
+
+            for name in names:
+                self._write_image_annotations(tx, project_id, name, changes[name])
+            if classes is not None and classes != self.get_classes(project_id):
+                self.set_classes(project_id, classes, tx)
+            self.touch_project(project_id, tx)
+        return {name: current[name] + 1 for name in names}
+
+    # ==================== 自动标注任务 ====================
+
+    def create_annotate_job(
+        self,
+        job_id: str,
+        project_id: str,
+        params: Dict[str, Any],
+        stats: Dict[str, Any],
+        classes: List[str]
+    ):
+        """登记自动标注任务，同时把项目类别设置为模型类别"""
+        now = datetime.now().isoformat()
+        with self.transaction() as tx:
+            tx.execute(
+                "INSERT INTO auto_annotate_jobs (job_id, project_id, params, stats, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 'running', ?, ?)",
+                (job_id, project_id, json.dumps(params, ensure_ascii=False), json.dumps(stats, ensure_ascii=False),
+                 now, now)
+            )
+            self.set_classes(project_id, classes, tx)
+
+    def checkpoint_annotate_job(
+        self,
+        job_id: str,
+        project_id: str,
+        annotations: Dict[str, List[Dict[str, Any]]],
+        done: List[str],
+        stats: Dict[str, Any]
+    ):
+        """在一个事务中写入一批图片的标注、标记这些图片已完成并更新累计统计"""
+        with self.transaction() as tx:
+            for image_name, boxes in annotations.items():
+                self._write_image_annotations(tx, project_id, image_name, boxes)
+            tx.executemany(
+                "INSERT OR IGNORE INTO auto_annotate_done (job_id, image_name) VALUES (?, ?)",
+                ((job_id, name) for name in done)
+            )
+            tx.execute(
+                "UPDATE auto_annotate_jobs SET stats = ?, updated_at = ? WHERE job_id = ?",
+                (json.dumps(stats, ensure_ascii=False), datetime.now().isoformat(), job_id)
+            )
+            self.touch_project(project_id, tx)
+
+    def set_annotate_job_status(self, job_id: str, status: str):
+        with self.transaction() as tx:
+            tx.execute(
+                "UPDATE auto_annotate_jobs SET status = ?, updated_at = ? WHERE job_id = ?",
+                (status, datetime.now().isoformat(), job_id)
+            )
+
+    def get_annotate_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute("SELECT * FROM auto_annotate_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if not row:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["stats"] = json.loads(job["stats"])
+        return job
+
+    def list_annotate_jobs(self, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        if status is None:
+            rows = self._connect().execute("SELECT job_id FROM auto_annotate_jobs ORDER BY created_at").fetchall()
+        else:
+            rows = self._connect().execute(
+                "SELECT job_id FROM auto_annotate_jobs WHERE status = ? ORDER BY created_at", (status,)
+            ).fetchall()
+        return [self.get_annotate_job(row[0]) for row in rows]
+
+    def get_annotate_done(self, job_id: str) -> Set[str]:
+        """任务已完成的图片名"""
+        rows = self._connect().execute(
+            "SELECT image_name FROM auto_annotate_done WHERE job_id = ?", (job_id,)
+        ).fetchall()
+        return {row[0] for row in rows}
+
+    def import_project(
+        self,
+        project: Dict[str, Any],
+        image_names: List[str],
+        annotations: Dict[str, List[Dict[str, Any]]],
+        classes: Optional[List[str]]
+    ):
+        """在一个事务中导入完整的项目（用于从旧版 JSON 文件迁移）"""
+        project_id = project["id"]
+        with self.transaction() as tx:
+            tx.execute(
+                "INSERT INTO projects (id, name, description, path, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (project_id, project.get("name", project_id), project.get("description", ""), project["path"],
+                 project.get("created_at", project.get("updated_at", "")),
+                 project.get("updated_at", project.get("created_at", "")))
+            )
+            tx.executemany(
+                "INSERT INTO images (project_id, name, created_at) VALUES (?, ?, ?)",
+                ((project_id, name, project.get("created_at", "")) for name in image_names)
+            )
+            for image_name, boxes in annotations.items():
+                self._write_image_annotations(tx, project_id, image_name, boxes)
+            if classes is not None:
+                self.set_classes(project_id, classes, tx)
+
+    # ==================== 类别 ====================
+
+    def get_classes(self, project_id: str) -> Optional[List[str]]:
+        """读取类别列表，未设置时返回 None"""
+        rows = self._connect().execute(
+            "SELECT name FROM classes WHERE project_id = ? ORDER BY position", (project_id,)
+        ).fetchall()
+        return [row[0] for row in rows] if rows else None
+
+    def set_classes(self, project_id: str, classes: List[str], tx: Optional[sqlite3.Connection] = None):
+        def write(conn: sqlite3.Connection):
+            conn.execute("DELETE FROM classes WHERE project_id = ?", (project_id,))
+            conn.executemany(
+                "INSERT INTO classes (project_id, position, name) VALUES (?, ?, ?)",
+                ((project_id, i, name) for i, name in enumerate(classes))
+            )
+
+        if tx is not None:
+            write(tx)
+        else:
+            with self.transaction() as conn:
+                write(conn)
+
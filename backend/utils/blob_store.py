@@ -0,0 +1,139 @@
+"""
+内容寻址的文件存储
+
+文件按 sha256 存放在 <root>/<前两位>/<sha256>，数据集工作目录中的文件与 blob 是同一个
+inode 的硬链接，因此创建快照和检出版本都不复制文件数据。
+
+修改数据集文件时应写入新文件再替换（backend/utils/file_utils.py 的 atomic_open，会断开硬链接），
+不能原地覆盖写入，否则会同时改变所有版本中的内容。权限位对 root 运行的服务不起作用，
+因此改为检查：快照时发现文件与 blob 仍是同一个 inode 但大小或 mtime 已变化，
+检出时发现 blob 大小与清单不一致，都会抛出 BlobIntegrityError。
+"""
+import os
+import shutil
+import hashlib
+import uuid
+from pathlib import Path
+from typing import Set, Optional
+
+
+# 计算哈希时每次读取的字节数
+HASH_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def file_sha256(path: str) -> str:
+    """计算文件的 sha256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BlobIntegrityError(Exception):
+    """blob 内容被原地修改（与版本清单不一致）"""
+    pass
+
+
+def _link_or_copy(source: str, target: str):
+    """创建硬链接，跨文件系统时退化为复制"""
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+class BlobStore:
+    """内容寻址存储"""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path_for(self, sha: str) -> Path:
+        return self.root / sha[:2] / sha
+
+    def has(self, sha: str) -> bool:
+        return self.path_for(sha).exists()
+
+    def adopt(self, path: str, sha: str) -> bool:
+        """
+        把工作目录中的文件纳入存储
+
+        - 内容尚未存储：把文件硬链接为 blob（不复制数据）
+        - 内容已存储但文件是另一份副本（例如重新上传的相同图片）：把文件替换为指向 blob
+          的硬链接，释放重复占用的空间
+
+        Returns:
+            是否新增了 blob
+        """
+        blob = self.path_for(sha)
+        try:
+            blob_stat = blob.stat()
+        except FileNotFoundError:
+            blob_stat = None
+
+        if blob_stat is None:
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            tmp_blob = blob.with_name(f".{sha}.{uuid.uuid4().hex[:8]}.tmp")
+            _link_or_copy(path, str(tmp_blob))
+            os.replace(tmp_blob, blob)
+            return True
+
+        if blob_stat.st_ino != os.stat(path).st_ino:
+            tmp_file = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+            try:
+                os.link(blob, tmp_file)
+            except OSError:
+                # 与存储不在同一文件系统，保留原文件
+                return False
+            os.replace(tmp_file, path)
+        return False
+
+    def is_linked(self, sha: str, st: os.stat_result) -> bool:
+        """文件（以 stat 结果表示）是否与 blob 共用 inode"""
+        try:
+            blob_stat = self.path_for(sha).stat()
+        except FileNotFoundError:
+            return False
+        return (blob_stat.st_dev, blob_stat.st_ino) == (st.st_dev, st.st_ino)
+
+    def verify(self, sha: str, size: int):
+        """检查 blob 存在且大小与清单一致，否则抛出 BlobIntegrityError"""
+        try:
+            actual = self.path_for(sha).stat().st_size
+        except FileNotFoundError:
+            raise BlobIntegrityError(f"Blob missing: {sha}")
+        if actual != size:
+            raise BlobIntegrityError(
+                f"Blob {sha} was modified in place (size {actual}, expected {size}); "
+                f"versions referencing it are corrupted"
+            )
+
+    def checkout(self, sha: str, target: str, size: Optional[int] = None):
+        """把 blob 硬链接到目标路径，指定 size 时先校验 blob 大小"""
+        if size is not None:
+            self.verify(sha, size)
+        _link_or_copy(str(self.path_for(sha)), target)
+
+    def remove_unreferenced(self, referenced: Set[str]) -> int:
+        """
+        删除不被任何版本引用、也没有工作目录在使用（硬链接数为 1）的 blob
+
+        Returns:
+            删除的 blob 数量
+        """
+        removed = 0
+        for blob in self.root.glob("*/*"):
+            if blob.name.startswith(".") or blob.name in referenced:
+                continue
+            try:
+                if blob.stat().st_nlink == 1:
+                    blob.unlink()
+                    removed += 1
+            except OSError:
+                continue
+        return removed
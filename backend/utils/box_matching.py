@@ -0,0 +1,225 @@
+"""
+标注框匹配
+
+按类别一次性计算两组标注框的 IoU 矩阵，再用贪心或匈牙利算法做一对一匹配。
+用于自动标注的智能合并（新旧标注去重），以及两个标注项目之间的标签比较。
+
+标注框格式与标注项目一致：{"class", "x", "y", "width", "height", "confidence"?}，
+坐标为归一化的左上角和宽高。
+"""
+from typing import List, Dict, Any, Tuple
+
+import numpy as np
+
+try:
+    from scipy.optimize import linear_sum_assignment
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+
+MATCH_METHODS = ("greedy", "hungarian")
+
+
+def boxes_to_xyxy(annotations: List[Dict[str, Any]]) -> np.ndarray:
+    """把标注框列表转换为 [N, 4] 的 (x1, y1, x2, y2) 数组"""
+    if not annotations:
+        return np.zeros((0, 4), dtype=np.float64)
+    xywh = np.array(
+        [[a["x"], a["y"], a["width"], a["height"]] for a in annotations],
+        dtype=np.float64
+    )
+    xywh[:, 2:] += xywh[:, :2]
+    return xywh
+
+
+def iou_matrix(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """计算两组 xyxy 框两两之间的 IoU，返回 [N, M] 矩阵"""
+    if len(boxes_a) == 0 or len(boxes_b) == 0:
+        return np.zeros((len(boxes_a), len(boxes_b)), dtype=np.float64)
+
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    wh = np.clip(bottom_right - top_left, 0, None)
+    intersection = wh[..., 0] * wh[..., 1]
+
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - intersection
+
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+def _assign_greedy(ious: np.ndarray, iou_threshold: float) -> Tuple[np.ndarray, np.ndarray]:
+    """贪心匹配：按 IoU 从高到低依次取行列都未使用的框对"""
+    rows, cols = np.nonzero(ious > iou_threshold)
+    if len(rows) == 0:
+        return rows, cols
+    order = np.argsort(-ious[rows, cols], kind="stable")
+
+    used_rows, used_cols = set(), set()
+    keep = []
+    for k in order:
+        r, c = rows[k], cols[k]
+        if r in used_rows or c in used_cols:
+            continue
+        used_rows.add(r)
+        used_cols.add(c)
+        keep.append(k)
+    keep = np.array(keep, dtype=np.int64)
+    return rows[keep], cols[keep]
+
+
+def _assign_hungarian(ious: np.ndarray, iou_threshold: float) -> Tuple[np.ndarray, np.ndarray]:
+    """匈牙利算法：低于阈值的框对不参与匹配，最大化匹配框对的 IoU 之和"""
+    weights = np.where(ious > iou_threshold, ious, 0.0)
+    rows, cols = linear_sum_assignment(weights, maximize=True)
+    keep = weights[rows, cols] > 0
+    return rows[keep], cols[keep]
+
+
+def match_boxes(
+    boxes_a: np.ndarray,
+    classes_a: np.ndarray,
+    boxes_b: np.ndarray,
+    classes_b: np.ndarray,
+    iou_threshold: float = 0.5,
+    method: str = "greedy"
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    同类别框之间的一对一匹配
+
+    Args:
+        boxes_a, boxes_b: [N, 4] / [M, 4] xyxy 数组
+        classes_a, classes_b: 各框的类别（任意可比较的值）
+        iou_threshold: IoU 超过此值的框对才会匹配
+        method: greedy（贪心）或 hungarian（匈牙利算法，需要 scipy）
+
+    Returns:
+        (a 中的索引, b 中的索引, 对应 IoU)，按 a 的索引排序
+    """
+    if method not in MATCH_METHODS:
+        raise ValueError(f"Unsupported match method: {method}")
+    if method == "hungarian" and not SCIPY_AVAILABLE:
+        raise ValueError("Hungarian matching requires: pip install scipy")
+    assign = _assign_greedy if method == "greedy" else _assign_hungarian
+
+    classes_a = np.asarray(classes_a)
+    classes_b = np.asarray(classes_b)
+    matched_a, matched_b = [], []
+    common_classes = np.intersect1d(classes_a, classes_b) if len(classes_a) and len(classes_b) else []
+    for cls in common_classes:
+        idx_a = np.flatnonzero(classes_a == cls)
+        idx_b = np.flatnonzero(classes_b == cls)
+        rows, cols = assign(iou_matrix(boxes_a[idx_a], boxes_b[idx_b]), iou_threshold)
+        matched_a.append(idx_a[rows])
+        matched_b.append(idx_b[cols])
+
+    if not matched_a:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros(0, dtype=np.float64)
+
+    matched_a = np.concatenate(matched_a)
+    matched_b = np.concatenate(matched_b)
+    order = np.argsort(matched_a, kind="stable")
+    matched_a, matched_b = matched_a[order], matched_b[order]
+
+    # 只为匹配上的框对重新计算 IoU，避免保存各类别的完整矩阵
+    a, b = boxes_a[matched_a], boxes_b[matched_b]
+    wh = np.clip(np.minimum(a[:, 2:], b[:, 2:]) - np.maximum(a[:, :2], b[:, :2]), 0, None)
+    intersection = wh[:, 0] * wh[:, 1]
+    union = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1]) + (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1]) - intersection
+    ious = np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+    return matched_a, matched_b, ious
+
+
+def match_annotations(
+    annotations_a: List[Dict[str, Any]],
+    annotations_b: List[Dict[str, Any]],
+    iou_threshold: float = 0.5,
+    method: str = "greedy"
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """按类别名匹配两组标注框，返回值同 match_boxes"""
+    return match_boxes(
+        boxes_to_xyxy(annotations_a), [a["class"] for a in annotations_a],
+        boxes_to_xyxy(annotations_b), [b["class"] for b in annotations_b],
+        iou_threshold=iou_threshold,
+        method=method
+    )
+
+
+def compare_annotation_sets(
+    reference: Dict[str, List[Dict[str, Any]]],
+    candidate: Dict[str, List[Dict[str, Any]]],
+    iou_threshold: float = 0.5,
+    method: str = "greedy"
+) -> Dict[str, Any]:
+    """
+    以 reference 为基准比较两组标注（{图片名: 标注列表}），只比较两边都有的图片
+
+    匹配上的框计为 matched，只在 reference 中的计为 missing，只在 candidate 中的计为 extra。
+
+    Returns:
+        总体和各类别的 matched / missing / extra / precision / recall / mean_iou，
+        以及存在差异的图片列表
+    """
+    per_class: Dict[str, Dict[str, Any]] = {}
+
+    def class_entry(name: str) -> Dict[str, Any]:
+        if name not in per_class:
+            per_class[name] = {"matched": 0, "missing": 0, "extra": 0, "iou_sum": 0.0}
+        return per_class[name]
+
+    differing_images = []
+    common = sorted(set(reference) & set(candidate))
+    for name in common:
+        ref_anns = reference[name]
+        cand_anns = candidate[name]
+        ref_idx, cand_idx, ious = match_annotations(ref_anns, cand_anns, iou_threshold, method)
+
+        ref_unmatched = np.ones(len(ref_anns), dtype=bool)
+        ref_unmatched[ref_idx] = False
+        cand_unmatched = np.ones(len(cand_anns), dtype=bool)
+        cand_unmatched[cand_idx] = False
+
+        for i, iou in zip(ref_idx, ious):
+            entry = class_entry(ref_anns[i]["class"])
+            entry["matched"] += 1
+            entry["iou_sum"] += float(iou)
+        for i in np.flatnonzero(ref_unmatched):
+            class_entry(ref_anns[i]["class"])["missing"] += 1
+        for i in np.flatnonzero(cand_unmatched):
+            class_entry(cand_anns[i]["class"])["extra"] += 1
+
+        if ref_unmatched.any() or cand_unmatched.any():
+            differing_images.append({
+                "image": name,
+                "matched": int(len(ref_idx)),
+                "missing": int(ref_unmatched.sum()),
+                "extra": int(cand_unmatched.sum())
+            })
+
+    def summarize(entry: Dict[str, Any]) -> Dict[str, Any]:
+        matched = entry["matched"]
+        return {
+            "matched": matched,
+            "missing": entry["missing"],
+            "extra": entry["extra"],
+            "precision": round(matched / max(matched + entry["extra"], 1), 4),
+            "recall": round(matched / max(matched + entry["missing"], 1), 4),
+            "mean_iou": round(entry["iou_sum"] / matched, 4) if matched else 0.0
+        }
+
+    total = {"matched": 0, "missing": 0, "extra": 0, "iou_sum": 0.0}
+    for entry in per_class.values():
+        for key in total:
+            total[key] += entry[key]
+
+    return {
+        "compared_images": len(common),
+        "iou_threshold": iou_threshold,
+        "method": method,
+        **summarize(total),
+        "classes": {name: summarize(entry) for name, entry in sorted(per_class.items())},
+        "differing_images": differing_images
+    }
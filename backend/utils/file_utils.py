@@ -2,9 +2,11 @@
 文件工具函数
 """
 import os
+import uuid
 import shutil
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Optional, IO, Iterator
 from datetime import datetime
 
 
@@ -75,11 +77,74 @@ def get_unique_filename(directory: str, filename: str) -> str:
     return file_path.name
 
 
-def save_uploaded_file(upload_file, destination: str) -> str:
-    """保存上传的文件"""
+class FileTooLargeError(Exception):
+    """上传文件超过大小限制"""
+    pass
+
+
+def save_uploaded_file(upload_file, destination: str, max_size: Optional[int] = None) -> str:
+    """保存上传的文件（指定 max_size 时超过限制会删除已写入部分并抛出 FileTooLargeError）"""
+    written = 0
     try:
         with open(destination, "wb") as buffer:
-            shutil.copyfileobj(upload_file.file, buffer)
+            for chunk in iter(lambda: upload_file.file.read(1024 * 1024), b""):
+                written += len(chunk)
+                if max_size is not None and written > max_size:
+                    raise FileTooLargeError(f"File exceeds size limit of {max_size} bytes")
+                buffer.write(chunk)
         return destination
+    except FileTooLargeError:
+        os.remove(destination)
+        raise
     except Exception as e:
         raise Exception(f"Error saving file: {e}")
+
+
+def link_file(src: Path, dst: Path) -> str:
+    """
+    将文件链接到目标位置，避免复制数据
+
+    优先使用硬链接，跨文件系统时退化为符号链接，最后才复制。
+
+    Returns:
+        实际使用的方式: "hardlink", "symlink" 或 "copy"
+    """
+    src, dst = Path(src), Path(dst)
+    if dst.exists() or dst.is_symlink():
+        dst.unlink()
+    try:
+        os.link(src, dst)
+        return "hardlink"
+    except OSError:
+        pass
+    try:
+        os.symlink(src.resolve(), dst)
+        return "symlink"
+    except OSError:
+        shutil.copy2(src, dst)
+        return "copy"
+
+
+@contextmanager
+def atomic_open(path, mode: str = "w", **kwargs) -> Iterator[IO]:
+    """
+    写入同目录下的临时文件，成功后用 os.replace 替换目标文件，出错时删除临时文件
+
+    数据集中的文件可能是版本 blob 的硬链接（backend/utils/blob_store.py），
+    替换会断开链接，直接 open(path, 'w') 原地写入则会同时改变历史版本的内容。
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        with open(tmp_path, mode, **kwargs) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def atomic_copy(src, dst):
+    """复制文件，目标文件通过 atomic_open 替换（不会原地覆盖已有文件）"""
+    with open(src, 'rb') as fsrc, atomic_open(dst, 'wb') as fdst:
+        shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
@@ -0,0 +1,432 @@
+"""
+YOLO 标签打包存储
+
+把数据集中每张图片一个的 .txt 标签文件打包为 <dataset>/labels.pack/：
+- boxes.npy    所有目标连续存放的 float32 数组 [N, 5]（class, x, y, w, h）
+- offsets.npy  int64 [F + 1]，第 i 个标签文件的目标为 boxes[offsets[i]:offsets[i + 1]]
+- mtimes.npy / sizes.npy  打包时各标签文件的 mtime_ns 和大小，用于增量同步
+- invalid.npy  各标签文件中无法解析的行数
+- files.txt    标签文件路径（相对数据集目录），与 offsets 顺序一致
+- index.json   划分范围、标签目录 mtime、版本号
+
+读取时以 mmap 方式打开，整个数据集的标签扫描变成一次顺序读取。
+标签目录的 mtime 变化（文件增删）时自动增量同步：只重新解析 mtime 或大小变化的文件。
+原地修改文件内容不会改变目录 mtime，需要调用 sync_labels(full=True)。
+"""
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+
+PACK_DIR_NAME = "labels.pack"
+PACK_FORMAT_VERSION = 1
+
+# 每个解析任务处理的标签文件数
+PARSE_CHUNK_SIZE = 1000
+
+_cache: Dict[str, "PackedLabels"] = {}
+_cache_lock = threading.Lock()
+
+
+def parse_label_files(paths: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    解析一批 YOLO 标签文件（分割标签的多边形转为外接框）
+
+    Returns:
+        (boxes[N, 5], 每个文件的目标数, 每个文件无法解析的行数)
+    """
+    values: List[Any] = []
+    counts = np.zeros(len(paths), dtype=np.int64)
+    invalid = np.zeros(len(paths), dtype=np.int64)
+
+    for i, path in enumerate(paths):
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+        except OSError:
+            continue
+
+        tokens = content.split()
+        num_lines = content.count(b"\n") + (0 if content.endswith(b"\n") else 1)
+        if tokens and len(tokens) == 5 * num_lines:
+            # 常见情况：每行 5 个数
+            values.extend(tokens)
+            counts[i] = num_lines
+            continue
+
+        for line in content.splitlines():
+            row = line.split()
+            if not row:
+                continue
+            if len(row) == 5:
+                values.extend(row)
+            elif len(row) >= 7 and len(row) % 2 == 1:
+                xy = np.array(row[1:], dtype=np.float32).reshape(-1, 2)
+                lo, hi = xy.min(axis=0), xy.max(axis=0)
+                center, size = (lo + hi) / 2, hi - lo
+                values.extend([row[0], center[0], center[1], size[0], size[1]])
+            else:
+                invalid[i] += 1
+                continue
+            counts[i] += 1
+
+    try:
+        boxes = np.array(values, dtype=np.float32).reshape(-1, 5)
+    except ValueError:
+        # 极少数情况下存在非数字内容，逐行转换并丢弃对应的行
+        boxes, counts, invalid = _parse_label_files_strict(paths)
+    return boxes, counts, invalid
+
+
+def _parse_label_files_strict(paths: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """逐行解析（用于包含非数字内容的标签文件）"""
+    rows: List[List[float]] = []
+    counts = np.zeros(len(paths), dtype=np.int64)
+    invalid = np.zeros(len(paths), dtype=np.int64)
+    for i, path in enumerate(paths):
+        try:
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                lines = f.read().splitlines()
+        except OSError:
+            continue
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                row = [float(v) for v in line.split()]
+            except ValueError:
+                invalid[i] += 1
+                continue
+            if len(row) == 5:
+                rows.append(row)
+            elif len(row) >= 7 and len(row) % 2 == 1:
+                xy = np.array(row[1:], dtype=np.float32).reshape(-1, 2)
+                lo, hi = xy.min(axis=0), xy.max(axis=0)
+                rows.append([row[0], *((lo + hi) / 2), *(hi - lo)])
+            else:
+                invalid[i] += 1
+                continue
+            counts[i] += 1
+    return np.array(rows, dtype=np.float32).reshape(-1, 5), counts, invalid
+
+
+def label_dir_for(image_dir: str) -> str:
+    """按 YOLO 约定由图片目录得到标签目录（最后一个 images 替换为 labels）"""
+    sa, sb = f"{os.sep}images{os.sep}", f"{os.sep}labels{os.sep}"
+    path = image_dir.rstrip(os.sep) + os.sep
+    if sa not in path:
+        return str(Path(image_dir).parent / "labels")
+    return sb.join(path.rsplit(sa, 1)).rstrip(os.sep)
+
+
+def label_path_for(image_path: str) -> str:
+    """按 YOLO 约定由图片路径得到标签文件路径"""
+    sa, sb = f"{os.sep}images{os.sep}", f"{os.sep}labels{os.sep}"
+    return os.path.splitext(sb.join(image_path.rsplit(sa, 1)))[0] + ".txt"
+
+
+def expand_ranges(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """把多个 [start, start + length) 区间展开为一个下标数组"""
+    lengths = lengths.astype(np.int64)
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    shifts = np.repeat(starts.astype(np.int64) - (np.cumsum(lengths) - lengths), lengths)
+    return shifts + np.arange(total, dtype=np.int64)
+
+
+class PackedLabels:
+    """只读的标签包视图（数组以 mmap 方式打开）"""
+
+    def __init__(self, pack_dir: Path):
+        self.pack_dir = pack_dir
+        with open(pack_dir / "index.json", 'r', encoding='utf-8') as f:
+            self.index: Dict[str, Any] = json.load(f)
+        with open(pack_dir / "files.txt", 'r', encoding='utf-8') as f:
+            self.files: List[str] = f.read().splitlines()
+
+        self.boxes = np.load(pack_dir / "boxes.npy", mmap_mode='r')
+        self.offsets = np.load(pack_dir / "offsets.npy", mmap_mode='r')
+        self.mtimes = np.load(pack_dir / "mtimes.npy", mmap_mode='r')
+        self.sizes = np.load(pack_dir / "sizes.npy", mmap_mode='r')
+        self.invalid = np.load(pack_dir / "invalid.npy", mmap_mode='r')
+        self._positions: Optional[Dict[str, int]] = None
+
+    @property
+    def generation(self) -> str:
+        """内容版本号：任何标签文件变化后都会改变"""
+        return self.index["generation"]
+
+    @property
+    def splits(self) -> Dict[str, Dict[str, Any]]:
+        """{split: {"start", "end", "num_images"}}，start/end 为文件下标范围"""
+        return self.index["splits"]
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def get(self, label_file: str) -> Optional[np.ndarray]:
+        """按标签文件路径（相对数据集目录）查找目标，不存在时返回 None"""
+        if self._positions is None:
+            self._positions = {path: i for i, path in enumerate(self.files)}
+        i = self._positions.get(label_file)
+        if i is None:
+            return None
+        return self.boxes[self.offsets[i]:self.offsets[i + 1]]
+
+    def split_arrays(self, split: str) -> Tuple[np.ndarray, np.ndarray, int]:
+        """返回一个划分的 (boxes, 每个标签文件的目标数, 无法解析的行数)"""
+        info = self.splits[split]
+        start, end = info["start"], info["end"]
+        offsets = np.asarray(self.offsets[start:end + 1])
+        invalid = int(np.asarray(self.invalid[start:end]).sum())
+        return np.asarray(self.boxes[offsets[0]:offsets[-1]]), np.diff(offsets), invalid
+
+
+def _list_split(sources: List[str]) -> Tuple[List[str], Dict[str, int], Optional[int]]:
+    """
+    列出一个划分的标签文件
+
+    Returns:
+        (标签文件绝对路径, {标签目录或图片列表文件: mtime_ns}, 图片列表文件中的图片数)
+    """
+    paths: List[str] = []
+    watched: Dict[str, int] = {}
+    listed_images = None
+
+    for source in sources:
+        if os.path.isfile(source):
+            # 图片列表文件：路径相对于列表文件所在目录
+            base = os.path.dirname(source)
+            watched[source] = os.stat(source).st_mtime_ns
+            with open(source, 'r', encoding='utf-8') as f:
+                images = [line.strip() for line in f if line.strip()]
+            label_paths = [label_path_for(os.path.normpath(os.path.join(base, p))) for p in images]
+            for directory in {os.path.dirname(p) for p in label_paths}:
+                try:
+                    watched[directory] = os.stat(directory).st_mtime_ns
+                except OSError:
+                    continue
+            paths.extend(label_paths)
+            listed_images = (listed_images or 0) + len(images)
+            continue
+
+        stack = [label_dir_for(source)]
+        while stack:
+            directory = stack.pop()
+            try:
+                watched[directory] = os.stat(directory).st_mtime_ns
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.name.endswith(".txt"):
+                            paths.append(entry.path)
+            except OSError:
+                continue
+
+    paths.sort()
+    return paths, watched, listed_images
+
+
+def _watched_unchanged(watched: Dict[str, int]) -> bool:
+    for path, mtime_ns in watched.items():
+        try:
+            if os.stat(path).st_mtime_ns != mtime_ns:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def _parse_parallel(paths: List[str], workers: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """多进程解析标签文件，结果顺序与 paths 一致"""
+    if not paths:
+        empty = np.zeros(0, dtype=np.int64)
+        return np.zeros((0, 5), dtype=np.float32), empty, empty
+
+    chunks = [paths[i:i + PARSE_CHUNK_SIZE] for i in range(0, len(paths), PARSE_CHUNK_SIZE)]
+    if len(chunks) == 1 or workers <= 1:
+        results = [parse_label_files(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+            results = list(pool.map(parse_label_files, chunks))
+
+    return (
+        np.concatenate([r[0] for r in results]),
+        np.concatenate([r[1] for r in results]),
+        np.concatenate([r[2] for r in results])
+    )
+
+
+def _stat_files(paths: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """获取文件 mtime_ns 和大小（不存在的文件记为 -1）"""
+    mtimes = np.full(len(paths), -1, dtype=np.int64)
+    sizes = np.full(len(paths), -1, dtype=np.int64)
+    for i, path in enumerate(paths):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        mtimes[i] = st.st_mtime_ns
+        sizes[i] = st.st_size
+    return mtimes, sizes
+
+
+def _relative(dataset_dir: Path, path: str) -> str:
+    root = str(dataset_dir) + os.sep
+    return path[len(root):] if path.startswith(root) else path
+
+
+def _write_pack(
+    dataset_dir: Path,
+    files: List[str],
+    boxes: np.ndarray,
+    counts: np.ndarray,
+    mtimes: np.ndarray,
+    sizes: np.ndarray,
+    invalid: np.ndarray,
+    index: Dict[str, Any]
+) -> Path:
+    """写入新的标签包并原子替换旧的"""
+    pack_dir = dataset_dir / PACK_DIR_NAME
+    tmp_dir = dataset_dir / f".{PACK_DIR_NAME}.{uuid.uuid4().hex[:8]}"
+    tmp_dir.mkdir()
+
+    offsets = np.zeros(len(files) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    digest = hashlib.sha1()
+    for array in (mtimes, sizes, counts):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    digest.update("\n".join(files).encode("utf-8"))
+    index["generation"] = digest.hexdigest()[:16]
+
+    np.save(tmp_dir / "boxes.npy", np.ascontiguousarray(boxes, dtype=np.float32))
+    np.save(tmp_dir / "offsets.npy", offsets)
+    np.save(tmp_dir / "mtimes.npy", mtimes)
+    np.save(tmp_dir / "sizes.npy", sizes)
+    np.save(tmp_dir / "invalid.npy", invalid)
+    with open(tmp_dir / "files.txt", 'w', encoding='utf-8') as f:
+        f.write("\n".join(files))
+    with open(tmp_dir / "index.json", 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+
+    # 已打开的 mmap 仍指向旧文件，替换不影响正在进行的读取
+    old_dir = None
+    if pack_dir.exists():
+        old_dir = dataset_dir / f".{PACK_DIR_NAME}.old.{uuid.uuid4().hex[:8]}"
+        pack_dir.rename(old_dir)
+    tmp_dir.rename(pack_dir)
+    if old_dir is not None:
+        shutil.rmtree(old_dir, ignore_errors=True)
+    return pack_dir
+
+
+def sync_labels(
+    dataset_dir: Path,
+    splits: Dict[str, List[str]],
+    workers: int = 1,
+    full: bool = False
+) -> PackedLabels:
+    """
+    获取与标签文件同步的标签包
+
+    Args:
+        dataset_dir: 数据集目录
+        splits: {split: [图片目录或图片列表文件]}
+        workers: 解析标签文件的进程数
+        full: 逐个检查标签文件的 mtime / 大小（可发现原地修改）
+
+    Returns:
+        标签包视图
+    """
+    dataset_dir = Path(dataset_dir)
+    pack_dir = dataset_dir / PACK_DIR_NAME
+    key = str(dataset_dir.resolve())
+
+    with _cache_lock:
+        current = _cache.get(key)
+        if current is None and (pack_dir / "index.json").exists():
+            try:
+                current = PackedLabels(pack_dir)
+            except Exception as e:
+                print(f"Error loading label pack {pack_dir}: {e}")
+                current = None
+
+        if current is not None and not full \
+                and current.index.get("format") == PACK_FORMAT_VERSION \
+                and current.index.get("sources") == splits \
+                and _watched_unchanged(current.index.get("watched", {})):
+            _cache[key] = current
+            return current
+
+        # 重新列出标签文件，只解析新增或变化的文件
+        files: List[str] = []
+        watched: Dict[str, int] = {}
+        split_ranges: Dict[str, Dict[str, Any]] = {}
+        for split, sources in splits.items():
+            paths, split_watched, listed_images = _list_split(sources)
+            split_ranges[split] = {
+                "start": len(files),
+                "end": len(files) + len(paths),
+                "num_images": listed_images
+            }
+            files.extend(paths)
+            watched.update(split_watched)
+
+        mtimes, sizes = _stat_files(files)
+        rel_files = [_relative(dataset_dir, p) for p in files]
+
+        reuse = np.zeros(len(files), dtype=bool)
+        old_idx = np.full(len(files), -1, dtype=np.int64)
+        if current is not None:
+            positions = {path: i for i, path in enumerate(current.files)}
+            old_idx = np.array([positions.get(p, -1) for p in rel_files], dtype=np.int64)
+            found = old_idx >= 0
+            safe_idx = np.where(found, old_idx, 0)
+            if len(current.files):
+                reuse = found & (np.asarray(current.mtimes)[safe_idx] == mtimes) \
+                    & (np.asarray(current.sizes)[safe_idx] == sizes)
+
+        parse_idx = np.flatnonzero(~reuse)
+        parsed_boxes, parsed_counts, parsed_invalid = _parse_parallel([files[i] for i in parse_idx], workers)
+
+        counts = np.zeros(len(files), dtype=np.int64)
+        invalid = np.zeros(len(files), dtype=np.int64)
+        counts[parse_idx] = parsed_counts
+        invalid[parse_idx] = parsed_invalid
+        reuse_idx = np.flatnonzero(reuse)
+        if len(reuse_idx):
+            old_offsets = np.asarray(current.offsets)
+            counts[reuse_idx] = old_offsets[old_idx[reuse_idx] + 1] - old_offsets[old_idx[reuse_idx]]
+            invalid[reuse_idx] = np.asarray(current.invalid)[old_idx[reuse_idx]]
+
+        offsets = np.zeros(len(files) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        boxes = np.zeros((int(offsets[-1]), 5), dtype=np.float32)
+        if len(parse_idx):
+            boxes[expand_ranges(offsets[parse_idx], parsed_counts)] = parsed_boxes
+        if len(reuse_idx):
+            src = expand_ranges(old_offsets[old_idx[reuse_idx]], counts[reuse_idx])
+            boxes[expand_ranges(offsets[reuse_idx], counts[reuse_idx])] = current.boxes[src]
+
+        index = {
+            "format": PACK_FORMAT_VERSION,
+            "sources": splits,
+            "splits": split_ranges,
+            "watched": watched,
+            "num_parsed": int(len(parse_idx))
+        }
+        _write_pack(dataset_dir, rel_files, boxes, counts, mtimes, sizes, invalid, index)
+        packed = PackedLabels(pack_dir)
+        _cache[key] = packed
+        return packed
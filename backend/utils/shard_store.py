@@ -0,0 +1,357 @@
+"""
+分片数据集存储
+
+把数据集的图片和标签顺序写入若干个大的 tar 分片（<dataset>/shards/）：
+- shard-000000.tar ...  每个样本为一张图片（images/...）紧跟其标签（labels/...，可缺省）
+- index.json            数据集配置（data.yaml 内容）、各分片的样本数，以及每个样本所在的
+                        分片和图片 / 标签数据在分片中的偏移量（用于随机读取单个样本）
+
+网络存储上逐个读取海量小文件受限于单次请求延迟，分片格式把整个数据集的读取变成
+少量大文件的顺序读取。读取时由后台线程按顺序流式解析分片并预取到队列中。
+"""
+import os
+import json
+import uuid
+import queue
+import shutil
+import tarfile
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Iterator, NamedTuple
+
+import yaml
+
+
+SHARD_DIR_NAME = "shards"
+SHARD_FORMAT_VERSION = 1
+INDEX_FILE = "index.json"
+
+# 读取分片时的文件缓冲区大小
+READ_BUFFER_SIZE = 8 * 1024 * 1024
+
+_TAR_BLOCK = tarfile.BLOCKSIZE
+
+
+class Sample(NamedTuple):
+    """分片中的一个样本"""
+    key: str  # 图片在数据集中的相对路径（images/...）
+    split: str
+    image: bytes
+    label: Optional[bytes]  # 没有标签文件时为 None
+
+
+def label_member_for(image_key: str) -> str:
+    """由图片成员名得到标签成员名（images/a/b.jpg -> labels/a/b.txt）"""
+    parts = image_key.split("/")
+    parts[0] = "labels"
+    return os.path.splitext("/".join(parts))[0] + ".txt"
+
+
+def _padded(size: int) -> int:
+    return (size + _TAR_BLOCK - 1) // _TAR_BLOCK * _TAR_BLOCK
+
+
+class ShardWriter:
+    """
+    顺序写入分片数据集
+
+    写入临时目录，close() 时整体替换目标目录，读取方不会看到写了一半的分片。
+    """
+
+    def __init__(self, shards_dir: Path, shard_size: int, data: Dict[str, Any]):
+        self.shards_dir = Path(shards_dir)
+        self.shard_size = shard_size
+        self.tmp_dir = self.shards_dir.with_name(f".{self.shards_dir.name}.{uuid.uuid4().hex[:8]}.tmp")
+        self.tmp_dir.mkdir(parents=True)
+
+        self._split_names: List[str] = []
+        self._shards: List[Dict[str, Any]] = []
+        self._samples: Dict[str, List[Any]] = {"key": [], "split": [], "shard": [], "image": [], "label": []}
+        self._tar: Optional[tarfile.TarFile] = None
+        self.data = data
+
+    def _open_shard(self):
+        name = f"shard-{len(self._shards):06d}.tar"
+        self._tar = tarfile.open(self.tmp_dir / name, "w", format=tarfile.PAX_FORMAT)
+        self._shards.append({"file": name, "samples": 0, "splits": {}})
+
+    def _close_shard(self):
+        if self._tar is not None:
+            self._tar.close()
+            self._shards[-1]["size"] = (self.tmp_dir / self._shards[-1]["file"]).stat().st_size
+            self._tar = None
+
+    def _add_member(self, name: str, data: bytes, mtime: float) -> List[int]:
+        """写入一个成员，返回 [数据偏移, 大小]"""
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(mtime)
+        self._tar.addfile(info, _BytesReader(data))
+        # addfile 之后 offset 指向下一个头部，数据按 512 字节对齐
+        return [self._tar.offset - _padded(len(data)), len(data)]
+
+    def add(self, key: str, split: str, image: bytes, label: Optional[bytes] = None, mtime: float = 0):
+        """
+        写入一个样本
+
+        Args:
+            key: 图片相对路径（images/...）
+            split: 所属划分
+            image: 图片文件内容
+            label: 标签文件内容，没有标签时为 None
+            mtime: 写入分片的文件修改时间
+        """
+        if self._tar is None or self._tar.offset >= self.shard_size:
+            self._close_shard()
+            self._open_shard()
+
+        if split not in self._split_names:
+            self._split_names.append(split)
+
+        image_ref = self._add_member(key, image, mtime)
+        label_ref = self._add_member(label_member_for(key), label, mtime) if label is not None else None
+
+        shard = self._shards[-1]
+        shard["samples"] += 1
+        shard["splits"][split] = shard["splits"].get(split, 0) + 1
+        self._samples["key"].append(key)
+        self._samples["split"].append(self._split_names.index(split))
+        self._samples["shard"].append(len(self._shards) - 1)
+        self._samples["image"].append(image_ref)
+        self._samples["label"].append(label_ref)
+
+    def close(self) -> Dict[str, Any]:
+        """写入索引并替换目标目录，返回索引"""
+        self._close_shard()
+        splits: Dict[str, int] = {}
+        for shard in self._shards:
+            for split, count in shard["splits"].items():
+                splits[split] = splits.get(split, 0) + count
+
+        index = {
+            "format": SHARD_FORMAT_VERSION,
+            "id": uuid.uuid4().hex[:16],
+            "created_at": datetime.now().isoformat(),
+            "data": self.data,
+            "num_samples": len(self._samples["key"]),
+            "splits": splits,
+            "split_names": self._split_names,
+            "shards": self._shards,
+            "samples": self._samples
+        }
+        with open(self.tmp_dir / INDEX_FILE, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False, separators=(",", ":"))
+
+        old_dir = None
+        if self.shards_dir.exists():
+            old_dir = self.shards_dir.with_name(f".{self.shards_dir.name}.{uuid.uuid4().hex[:8]}.old")
+            self.shards_dir.rename(old_dir)
+        self.tmp_dir.rename(self.shards_dir)
+        if old_dir is not None:
+            shutil.rmtree(old_dir, ignore_errors=True)
+        return index
+
+    def abort(self):
+        """放弃写入"""
+        if self._tar is not None:
+            self._tar.close()
+            self._tar = None
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+class _BytesReader:
+    """tarfile.addfile 所需的最小文件对象"""
+
+    def __init__(self, data: bytes):
+        self._view = memoryview(data)
+        self._pos = 0
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._view) if size is None or size < 0 else self._pos + size
+        chunk = self._view[self._pos:end].tobytes()
+        self._pos += len(chunk)
+        return chunk
+
+
+class ShardReader:
+    """读取分片数据集"""
+
+    def __init__(self, shards_dir: Path):
+        self.shards_dir = Path(shards_dir)
+        with open(self.shards_dir / INDEX_FILE, 'r', encoding='utf-8') as f:
+            self.index = json.load(f)
+        if self.index.get("format") != SHARD_FORMAT_VERSION:
+            raise ValueError(f"Unsupported shard format: {self.index.get('format')}")
+        # JSON 对象的键总是字符串，还原 names 的整数类别编号
+        names = self.index["data"].get("names")
+        if isinstance(names, dict):
+            self.index["data"]["names"] = {int(k) if str(k).isdigit() else k: v for k, v in names.items()}
+        self._split_of: Optional[Dict[str, str]] = None
+
+    def __len__(self) -> int:
+        return self.index["num_samples"]
+
+    @property
+    def data(self) -> Dict[str, Any]:
+        """数据集配置（data.yaml 内容）"""
+        return self.index["data"]
+
+    @property
+    def splits(self) -> Dict[str, int]:
+        return self.index["splits"]
+
+    def _split_lookup(self) -> Dict[str, str]:
+        if self._split_of is None:
+            names = self.index["split_names"]
+            samples = self.index["samples"]
+            self._split_of = {k: names[s] for k, s in zip(samples["key"], samples["split"])}
+        return self._split_of
+
+    def read_sample(self, i: int) -> Sample:
+        """按样本序号随机读取单个样本"""
+        samples = self.index["samples"]
+        shard = self.index["shards"][samples["shard"][i]]
+        with open(self.shards_dir / shard["file"], 'rb') as f:
+            f.seek(samples["image"][i][0])
+            image = f.read(samples["image"][i][1])
+            label = None
+            if samples["label"][i] is not None:
+                f.seek(samples["label"][i][0])
+                label = f.read(samples["label"][i][1])
+        split = self.index["split_names"][samples["split"][i]]
+        return Sample(samples["key"][i], split, image, label)
+
+    def iter_samples(
+        self,
+        split: Optional[str] = None,
+        prefetch: int = 256,
+        workers: int = 1
+    ) -> Iterator[Sample]:
+        """
+        顺序读取样本，后台线程预取
+
+        Args:
+            split: 只读取指定划分，None 表示全部
+            prefetch: 预取队列长度（样本数）
+            workers: 并行读取的分片数；为 1 时按写入顺序返回，大于 1 时顺序不确定
+        """
+        shards = [s for s in self.index["shards"] if split is None or s["splits"].get(split)]
+        if not shards:
+            return
+        split_of = self._split_lookup()
+        workers = max(1, min(workers, len(shards)))
+        samples: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, prefetch))
+        stop = threading.Event()
+        done = object()
+
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    samples.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def read_shards(assigned: List[Dict[str, Any]]):
+            try:
+                for shard in assigned:
+                    for sample in self._read_shard(shard, split_of):
+                        if split is not None and sample.split != split:
+                            continue
+                        if not put(sample):
+                            return
+                put(done)
+            except BaseException as e:
+                put(e)
+
+        threads = [
+            threading.Thread(target=read_shards, args=(shards[i::workers],), daemon=True)
+            for i in range(workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            finished = 0
+            while finished < workers:
+                item = samples.get()
+                if item is done:
+                    finished += 1
+                elif isinstance(item, BaseException):
+                    raise item
+                else:
+                    yield item
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    def _read_shard(self, shard: Dict[str, Any], split_of: Dict[str, str]) -> Iterator[Sample]:
+        """流式解析单个分片（只做顺序读取）"""
+        pending: Optional[Sample] = None
+        with open(self.shards_dir / shard["file"], 'rb', buffering=READ_BUFFER_SIZE) as f:
+            with tarfile.open(fileobj=f, mode="r|") as tar:
+                for member in tar:
+                    if not member.isfile():
+                        continue
+                    data = tar.extractfile(member).read()
+                    if member.name.startswith("images/"):
+                        if pending is not None:
+                            yield pending
+                        pending = Sample(member.name, split_of.get(member.name, ""), data, None)
+                    elif pending is not None and member.name == label_member_for(pending.key):
+                        yield pending._replace(label=data)
+                        pending = None
+        if pending is not None:
+            yield pending
+
+
+def unpack_shards(
+    shards_dir: Path,
+    target_dir: Path,
+    prefetch: int = 256,
+    workers: int = 1,
+    progress=None
+) -> Dict[str, Any]:
+    """
+    把分片还原为普通的 YOLO 数据集目录（images/、labels/、data.yaml）
+
+    Args:
+        shards_dir: 分片目录
+        target_dir: 输出目录
+        progress: 可选回调 progress(已写入样本数, 总样本数)
+
+    Returns:
+        {"num_images": ..., "num_labels": ...}
+    """
+    reader = ShardReader(shards_dir)
+    target_dir = Path(target_dir)
+    target_dir.mkdir(parents=True, exist_ok=True)
+    total = len(reader)
+    num_images, num_labels = 0, 0
+    created = set()
+
+    for sample in reader.iter_samples(prefetch=prefetch, workers=workers):
+        image_path = target_dir / sample.key
+        if image_path.parent not in created:
+            image_path.parent.mkdir(parents=True, exist_ok=True)
+            created.add(image_path.parent)
+        image_path.write_bytes(sample.image)
+        num_images += 1
+
+        if sample.label is not None:
+            label_path = target_dir / label_member_for(sample.key)
+            if label_path.parent not in created:
+                label_path.parent.mkdir(parents=True, exist_ok=True)
+                created.add(label_path.parent)
+            label_path.write_bytes(sample.label)
+            num_labels += 1
+
+        if progress and num_images % 1000 == 0:
+            progress(num_images, total)
+
+    with open(target_dir / "data.yaml", 'w', encoding='utf-8') as f:
+        yaml.safe_dump(reader.data, f, allow_unicode=True, sort_keys=False)
+    return {"num_images": num_images, "num_labels": num_labels}
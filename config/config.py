@@ -12,9 +12,12 @@ DATASETS_DIR = DATA_DIR / "datasets"
 MODELS_DIR = DATA_DIR / "models"
 EXPORTS_DIR = DATA_DIR / "exports"
 UPLOADS_DIR = DATA_DIR / "uploads"
+CACHE_DIR = DATA_DIR / "cache"
+BLOBS_DIR = DATA_DIR / "blobs"
+VERSIONS_DIR = DATA_DIR / "versions"
 
 # 确保目录存在
-for directory in [DATA_DIR, DATASETS_DIR, MODELS_DIR, EXPORTS_DIR, UPLOADS_DIR]:
+for directory in [DATA_DIR, DATASETS_DIR, MODELS_DIR, EXPORTS_DIR, UPLOADS_DIR, CACHE_DIR, BLOBS_DIR, VERSIONS_DIR]:
     directory.mkdir(parents=True, exist_ok=True)
 
 
@@ -35,6 +38,9 @@ class Settings:
     MODELS_DIR: Path = MODELS_DIR
     EXPORTS_DIR: Path = EXPORTS_DIR
     UPLOADS_DIR: Path = UPLOADS_DIR
+    CACHE_DIR: Path = CACHE_DIR
+    BLOBS_DIR: Path = BLOBS_DIR  # 数据集版本的内容寻址存储
+    VERSIONS_DIR: Path = VERSIONS_DIR  # 数据集版本清单
     
     # 模型配置
     DEFAULT_MODEL: str = os.getenv("DEFAULT_MODEL", "yolo11n.pt")
@@ -46,8 +52,41 @@ class Settings:
     DEFAULT_BATCH_SIZE: int = int(os.getenv("DEFAULT_BATCH_SIZE", "16"))
     DEFAULT_IMG_SIZE: int = int(os.getenv("DEFAULT_IMG_SIZE", "640"))
     
+    # 基准测试数据集（coco8）
+    BENCHMARK_DATASET_DIR: Path = BASE_DIR / "datasets" / "coco8"
+    
+    # 导出配置
+    EXPORT_WORKERS: int = int(os.getenv("EXPORT_WORKERS", "1"))  # 同时执行的导出任务数
+    
+    # 后台任务
+    JOB_HISTORY_SIZE: int = int(os.getenv("JOB_HISTORY_SIZE", "100"))  # 每种任务类型在内存中保留的已结束任务数
+    
+    # 数据集导入配置
+    MAX_DATASET_UPLOAD_SIZE: int = int(os.getenv("MAX_DATASET_UPLOAD_SIZE", "20480")) * 1024 * 1024  # 压缩包大小上限
+    MAX_DATASET_EXTRACTED_SIZE: int = int(os.getenv("MAX_DATASET_EXTRACTED_SIZE", "51200")) * 1024 * 1024  # 解压后大小上限
+    MAX_DATASET_ENTRIES: int = int(os.getenv("MAX_DATASET_ENTRIES", "2000000"))  # 压缩包内文件数上限
+    INGEST_WORKERS: int = int(os.getenv("INGEST_WORKERS", str(min(8, os.cpu_count() or 1))))  # 并行解压线程数
+    LABEL_WORKERS: int = int(os.getenv("LABEL_WORKERS", str(os.cpu_count() or 1)))  # 标签解析进程数
+    IMAGE_WORKERS: int = int(os.getenv("IMAGE_WORKERS", str(os.cpu_count() or 1)))  # 图片解码线程数
+    
+    # 分片数据集
+    SHARD_SIZE: int = int(os.getenv("SHARD_SIZE", "512")) * 1024 * 1024  # 单个分片大小
+    SHARD_READ_WORKERS: int = int(os.getenv("SHARD_READ_WORKERS", "4"))  # 并行读取的分片数
+    SHARD_PREFETCH: int = int(os.getenv("SHARD_PREFETCH", "256"))  # 预取样本数
+    # 训练前解包分片的目录，应指向本地磁盘（如 /scratch、本地 NVMe），不要与数据集放在同一网络存储上
+    SHARD_VIEW_DIR: Path = Path(os.getenv("SHARD_VIEW_DIR", str(CACHE_DIR / "shard_views")))
+    
+    # 图片预览缓存
+    PREVIEW_CACHE_SIZE: int = int(os.getenv("PREVIEW_CACHE_SIZE", "2048")) * 1024 * 1024  # 预览图缓存大小上限
+    RENDER_CACHE_SIZE: int = int(os.getenv("RENDER_CACHE_SIZE", "256")) * 1024 * 1024  # 标注可视化结果的内存缓存上限
+    
+    # 标注项目
+    ANNOTATION_FULL_LOAD_LIMIT: int = int(os.getenv("ANNOTATION_FULL_LOAD_LIMIT", "2000"))  # 超过此图片数的项目分页加载
+    
     # API 配置
     MAX_UPLOAD_SIZE: int = int(os.getenv("MAX_UPLOAD_SIZE", "50")) * 1024 * 1024  # 转换为字节
+    MAX_MODEL_UPLOAD_SIZE: int = int(os.getenv("MAX_MODEL_UPLOAD_SIZE", "2048")) * 1024 * 1024
+    UPLOAD_CHUNK_MAX_SIZE: int = int(os.getenv("UPLOAD_CHUNK_MAX_SIZE", "64")) * 1024 * 1024  # 单个分片上限
     ALLOWED_EXTENSIONS: List[str] = os.getenv(
         "ALLOWED_EXTENSIONS", 
         "jpg,jpeg,png,bmp,mp4,avi,mov"
@@ -94,6 +94,11 @@ class API {
         return response.json();
     }
 
+    static async getExportStatus(jobId) {
+        const response = await fetch(`${API_BASE}/models/export/${jobId}`);
+        return response.json();
+    }
+
     // 数据集相关
     static async listDatasets() {
         const response = await fetch(`${API_BASE}/datasets/list`);